@@ -1,10 +1,19 @@
 # python imports
+import time
+
+# taken before all other imports for --startup-profile
+STARTED = time.perf_counter()
+
 import argparse
 import asyncio
 import logging
 
 # idotmatrix imports
 from core.cmd import CMD
+from core.startup import StartupProfile
+
+startup = StartupProfile(STARTED)
+startup.mark("imports")
 
 
 def log():
@@ -30,14 +39,66 @@ def main():
     parser.add_argument(
         "--address",
         action="store",
-        help="the bluetooth address of the device",
+        help="the bluetooth address of the device, a comma separated list of addresses or a group name from device_groups.json",
     )
     # add cmd arguments
     cmd.add_arguments(parser)
+    # daemon arguments
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keeps the connection to the device open and accepts commands on a unix domain socket",
+    )
+    parser.add_argument(
+        "--socket",
+        action="store",
+        help="path of the daemon socket (default: IDOTMATRIX_SOCKET or <tmp>/idotmatrix.sock)",
+    )
+    parser.add_argument(
+        "--http",
+        action="store",
+        nargs="?",
+        const="8080",
+        help="the daemon also serves its commands as http endpoints on [HOST:]PORT (default: 127.0.0.1:8080)",
+    )
+    parser.add_argument(
+        "--sync-interval",
+        action="store",
+        type=float,
+        help="the daemon synchronizes the time of the device right away and then every given number of seconds",
+    )
+    parser.add_argument(
+        "--priority",
+        action="store",
+        type=int,
+        default=0,
+        help="priority of the command in the daemon queue, more important commands interrupt running uploads (default: 0)",
+    )
+    parser.add_argument(
+        "--slot",
+        action="store",
+        help="what the command updates in the daemon queue, a newer command for the same slot replaces it (default: derived from the command)",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="reports how long importing, connecting and running the command took",
+    )
     # parse arguments
     args = parser.parse_args()
+    startup.mark("arguments")
+    if args.startup_profile:
+        cmd.startup = startup
     # run command
-    asyncio.run(cmd.run(args))
+    if args.daemon:
+        # the daemon (and its job queue and api) is only loaded when it runs
+        from core.daemon import Daemon
+
+        asyncio.run(Daemon(cmd, parser, args.socket).serve(args))
+    else:
+        asyncio.run(cmd.run(args))
+    if args.startup_profile:
+        startup.report()
 
 
 if __name__ == "__main__":
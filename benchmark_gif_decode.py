@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark of --process-gif with an oversized gif: generates a large
+animated gif (written frame by frame, so generating it does not need the
+memory either) and processes it with the idotmatrix library (all frames
+collected before encoding) and with the streaming pipeline of
+core.gifstream (one frame at a time), each in a fresh process. Prints the
+peak memory each one adds on top of the imports, the time and the payload
+size.
+
+    python3 benchmark_gif_decode.py [--width 1024] [--frames 300] [--pixel-size 32]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+from PIL import Image
+
+from core.gifstream import GifWriter
+
+
+def generate_gif(file_path, width, frames):
+    """moving diagonal stripes with a bouncing block, 256 colors"""
+    palette = numpy.zeros((256, 3), dtype=numpy.uint8)
+    palette[:, 0] = numpy.arange(256)
+    palette[:, 1] = numpy.arange(256)[::-1]
+    palette[:, 2] = (numpy.arange(256) * 7) % 256
+    ys, xs = numpy.mgrid[0:width, 0:width]
+    stripes = ((xs + ys) // 8).astype(numpy.uint16)
+    block = width // 8
+    with open(file_path, "wb") as file:
+        writer = GifWriter(file, (width, width), loop=0)
+        for index in range(frames):
+            pixels = ((stripes + index * 3) % 255).astype(numpy.uint8)
+            offset = abs((index * 17) % (2 * (width - block)) - (width - block))
+            pixels[offset : offset + block, offset : offset + block] = 255
+            frame = Image.fromarray(pixels, "P")
+            frame.putpalette(palette.tobytes())
+            writer.write(frame, 40)
+        writer.close()
+
+
+def resident_bytes():
+    """the current resident memory of this process (linux)"""
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakSampler(threading.Thread):
+    """samples the resident memory every millisecond, the high-water mark of
+    the process would include the imports
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = self.baseline = resident_bytes()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, resident_bytes())
+            time.sleep(0.001)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        return (self.peak - self.baseline) / 1024 / 1024
+
+
+def run(pipeline, file_path, pixel_size):
+    """processes the gif in this (fresh) process, returns the added peak memory in MiB, seconds and bytes"""
+    from core.gifstream import process_gif
+    from idotmatrix import Gif
+
+    sampler = PeakSampler()
+    sampler.start()
+    started = time.perf_counter()
+    if pipeline == "library":
+        detached = Gif()
+        detached.conn = None
+        payload = asyncio.run(detached.uploadProcessed(file_path=file_path, pixel_size=pixel_size))
+        size = sum(len(chunk) for chunk in payload)
+    else:
+        size = len(process_gif(file_path, pixel_size))
+    seconds = time.perf_counter() - started
+    return sampler.stop(), seconds, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measures the peak memory of processing a large gif")
+    parser.add_argument("--width", type=int, default=1024, help="width and height of the generated gif")
+    parser.add_argument("--frames", type=int, default=300, help="frames of the generated gif")
+    parser.add_argument("--pixel-size", type=int, default=32, help="size the gif is processed to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "large.gif")
+        generate_gif(file_path, args.width, args.frames)
+        print(
+            f"{args.frames} frames of {args.width}x{args.width} pixels "
+            f"({os.path.getsize(file_path) / 1024 / 1024:.1f} MiB) processed to {args.pixel_size} pixels"
+        )
+        print(f"{'pipeline':>10} {'peak MiB':>9} {'seconds':>8} {'bytes':>8}")
+        context = multiprocessing.get_context("spawn")
+        for pipeline in ("library", "streaming"):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                peak, seconds, size = executor.submit(run, pipeline, file_path, args.pixel_size).result()
+            print(f"{pipeline:>10} {peak:>9.1f} {seconds:>8.2f} {size:>8}")
+
+
+if __name__ == "__main__":
+    main()
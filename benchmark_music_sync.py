@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+CPU benchmark of --music-sync without a device: analysing the audio of one
+frame (all fft windows in one rfft call against one call per window),
+drawing the bars and encoding the frame like the frame stream does (pixel
+diff and png). Prints the cpu time per frame and the share of one core
+used at the given frame rate, e.g. to check a Raspberry Pi keeps up.
+
+    python3 benchmark_music_sync.py [--fps 20] [--seconds 10] [--rate 44100]
+"""
+
+import argparse
+import time
+
+import numpy
+
+from core.audio import WINDOW, BandAnalyzer, SpectrumRenderer
+from core.framebuffer import encode_png
+from core.graffiti import pack_writes, pixel_packets
+
+
+def generate_audio(rate, seconds, seed=1):
+    """a frequency sweep with beats and some noise"""
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(int(rate * seconds)) / rate
+    frequency = 60 * 2 ** (t % 8)
+    beats = 0.5 + 0.5 * (numpy.sin(2 * numpy.pi * 2 * t) > 0)
+    signal = 0.4 * numpy.sin(2 * numpy.pi * numpy.cumsum(frequency) / rate) * beats
+    return (signal + 0.02 * rng.standard_normal(len(t))).astype(numpy.float32)
+
+
+def looped_levels(analyzer, samples):
+    """the analysis of BandAnalyzer.add with one fft call per window, for comparison"""
+    analyzer.buffer = numpy.concatenate((analyzer.buffer, samples))
+    if len(analyzer.buffer) < analyzer.window:
+        return None
+    levels = None
+    start = 0
+    while start + analyzer.window <= len(analyzer.buffer):
+        window = analyzer.buffer[start : start + analyzer.window]
+        spectrum = numpy.abs(numpy.fft.rfft(window * analyzer.taper)[: analyzer.end]) ** 2
+        power = numpy.add.reduceat(spectrum, analyzer.starts) / analyzer.bins
+        levels = power if levels is None else numpy.maximum(levels, power)
+        start += analyzer.hop
+    analyzer.buffer = analyzer.buffer[start:]
+    return numpy.clip(1 + 10 * numpy.log10(levels / analyzer.reference + 1e-12) / 60, 0, 1)
+
+
+def measure(audio, rate, fps, size, bands, analyze):
+    """returns the cpu seconds per frame of analysing, drawing and encoding"""
+    analyzer = BandAnalyzer(rate, bands)
+    renderer = SpectrumRenderer(size, bands)
+    per_frame = int(rate / fps)
+    previous = None
+    frames = 0
+    started = time.process_time()
+    for offset in range(0, len(audio) - per_frame, per_frame):
+        pixels = renderer.render(analyze(analyzer, audio[offset : offset + per_frame]))
+        if previous is not None:
+            ys, xs = numpy.nonzero(numpy.any(previous != pixels, axis=2))
+            changed = [(int(x), int(y), *map(int, pixels[y, x])) for x, y in zip(xs, ys)]
+            pack_writes(pixel_packets(changed, 509), 509)
+        encode_png(pixels)
+        previous = pixels
+        frames += 1
+    return (time.process_time() - started) / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measures the cpu use of --music-sync")
+    parser.add_argument("--fps", type=float, default=20, help="frames per second")
+    parser.add_argument("--seconds", type=float, default=10, help="seconds of generated audio")
+    parser.add_argument("--rate", type=int, default=44100, help="sample rate")
+    args = parser.parse_args()
+
+    audio = generate_audio(args.rate, args.seconds)
+    print(f"{args.seconds:g}s of audio at {args.rate} Hz, {args.fps:g} fps, windows of {WINDOW} samples")
+    print(f"{'size':>6} {'bands':>6} {'looped ms':>10} {'vectorized ms':>14} {'cpu at fps':>11}")
+    for size, bands in ((16, 16), (32, 16), (32, 32), (64, 32)):
+        looped = measure(audio, args.rate, args.fps, size, bands, looped_levels)
+        vectorized = measure(audio, args.rate, args.fps, size, bands, BandAnalyzer.add)
+        print(
+            f"{size:>4}px {bands:>6} {looped * 1000:>10.3f} {vectorized * 1000:>14.3f} "
+            f"{vectorized * args.fps * 100:>10.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
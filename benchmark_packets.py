@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the gif packet assembly: the packets built by the idotmatrix
+library (one bytes object per chunk, copied again for every BLE write) against
+core.packets (one preallocated buffer, memoryview writes).
+
+    python3 benchmark_packets.py [--frames 16] [--write-size 509] [--repeat 200]
+"""
+
+import argparse
+import io
+import random
+import time
+import tracemalloc
+
+from PIL import Image
+
+from core.packets import gif_packets
+from idotmatrix import Gif
+
+
+def generate_gif(size, frames, seed=1):
+    """creates an animated gif with some noise, so it does not compress to nothing"""
+    rng = random.Random(seed)
+    images = []
+    for frame in range(frames):
+        image = Image.new("RGB", (size, size))
+        image.putdata(
+            [
+                ((x * 8 + frame * 16) % 256, (y * 8) % 256, rng.randrange(256))
+                for y in range(size)
+                for x in range(size)
+            ]
+        )
+        images.append(image)
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="GIF", save_all=True, append_images=images[1:], duration=100, loop=0)
+    return buffer.getvalue()
+
+
+def library_path(gif_data, write_size):
+    """packets as built by the library, split into writes like ConnectionManager.send"""
+    writes = 0
+    for packet in Gif()._createPayloads(gif_data):
+        for i in range(0, len(packet), write_size):
+            writes += len(packet[i : i + write_size])
+    return writes
+
+
+def buffer_path(gif_data, write_size):
+    """packets as built by core.packets, split into writes like ConnectionManager.send"""
+    writes = 0
+    for packet in gif_packets(gif_data):
+        for i in range(0, len(packet), write_size):
+            writes += len(packet[i : i + write_size])
+    return writes
+
+
+def measure(path, gif_data, write_size, repeat):
+    """returns the mean time per upload in ms and the peak allocation in bytes"""
+    path(gif_data, write_size)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        path(gif_data, write_size)
+    elapsed = (time.perf_counter() - started) / repeat * 1000
+    tracemalloc.start()
+    path(gif_data, write_size)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compares the gif packet assembly paths")
+    parser.add_argument("--frames", type=int, default=16, help="frames of the generated gifs")
+    parser.add_argument("--write-size", type=int, default=509, help="bytes per BLE write (MTU - 3)")
+    parser.add_argument("--repeat", type=int, default=200, help="uploads built per measurement")
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'gif bytes':>10} {'packets':>8} {'library ms':>11} {'buffer ms':>10} {'library peak':>13} {'buffer peak':>12}")
+    for size in (16, 32, 64):
+        gif_data = generate_gif(size, args.frames)
+        assert [bytes(packet) for packet in Gif()._createPayloads(gif_data)] == [
+            bytes(packet) for packet in gif_packets(gif_data)
+        ], "both paths must build the same packets"
+        library_ms, library_peak = measure(library_path, gif_data, args.write_size, args.repeat)
+        buffer_ms, buffer_peak = measure(buffer_path, gif_data, args.write_size, args.repeat)
+        print(
+            f"{size:>4}px {len(gif_data):>10} {len(gif_packets(gif_data)):>8} "
+            f"{library_ms:>11.3f} {buffer_ms:>10.3f} {library_peak:>13} {buffer_peak:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
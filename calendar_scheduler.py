@@ -7,7 +7,7 @@ This script runs calendar updates every 30 minutes and displays status on iDotMa
 
 import time
 import schedule
-import subprocess
+from core import client
 import sys
 import os
 from datetime import datetime
@@ -114,11 +114,13 @@ def display_status_on_device(status, events):
             gif_path = "images/busy_emoji.gif"
             print(f"Displaying BUSY animation: {gif_path}")
             
-            # Use the run script to display animated GIF
+            # Use the run script to display animated GIF, the daemon
+            # interrupts a running upload for it
             cmd = [
                 "./run_in_venv.sh",
                 "--address", DEVICE_ADDRESS,
-                "--set-gif", gif_path
+                "--set-gif", gif_path,
+                "--priority", "10"
             ]
             
         else:
@@ -135,7 +137,7 @@ def display_status_on_device(status, events):
         
         print(f"🚀 Running: {' '.join(cmd)}")
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = client.run(cmd)
         
         if result.returncode == 0:
             print(f"✅ Status displayed with animated emoji")
@@ -7,7 +7,7 @@ Runs every 30 minutes and displays status on iDotMatrix device
 
 import time
 import schedule
-import subprocess
+from core import client
 import sys
 import os
 import logging
@@ -224,7 +224,7 @@ def display_status_on_device(status, events):
         logger.info(f"Running command: {' '.join(cmd)}")
         print(f"🚀 Running: {' '.join(cmd)}")
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = client.run(cmd)
         
         if result.returncode == 0:
             logger.info(f"Status displayed successfully with animation")
@@ -7,7 +7,7 @@ Runs every 30 minutes and displays status on iDotMatrix device
 
 import time
 import schedule
-import subprocess
+from core import client
 import sys
 import os
 from datetime import datetime
@@ -137,10 +137,13 @@ def display_status_on_device(status, events):
             "--text-size", str(text_size),
             "--text-color", text_color
         ]
+        if status == "busy":
+            # the daemon interrupts a running upload for a starting meeting
+            cmd += ["--priority", "10"]
         
         print(f"🚀 Running: {' '.join(cmd)}")
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = client.run(cmd)
         
         if result.returncode == 0:
             print(f"✅ Status displayed: {display_text}")
@@ -0,0 +1,558 @@
+# python imports
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+# idotmatrix imports
+from core import storage
+
+DEFAULT_HOST = "127.0.0.1"
+# largest request body accepted (gif and image uploads)
+MAX_BODY_SIZE = 32 * 1024 * 1024
+# largest json body or form field, these are kept in memory
+MAX_FIELD_SIZE = 64 * 1024
+# bytes read from the socket at once while streaming a body
+READ_SIZE = 64 * 1024
+# seconds a client may take to send the request line and the headers
+HEADER_TIMEOUT = 10
+# seconds a client may pause while sending the body
+BODY_TIMEOUT = 30
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+# json or form fields every endpoint takes, passed on as app.py arguments
+COMMON_OPTIONS = {
+    "address": "--address",
+    "priority": "--priority",
+    "slot": "--slot",
+    "transport": "--transport",
+}
+TEXT_OPTIONS = {
+    "size": "--text-size",
+    "mode": "--text-mode",
+    "speed": "--text-speed",
+    "color_mode": "--text-color-mode",
+    "color": "--text-color",
+    "bg_mode": "--text-bg-mode",
+    "bg_color": "--text-bg-color",
+}
+GIF_OPTIONS = {
+    "max_frames": "--gif-max-frames",
+    "max_fps": "--gif-max-fps",
+    "max_upload_bytes": "--max-upload-bytes",
+    "max_upload_seconds": "--max-upload-seconds",
+}
+
+
+class HttpError(Exception):
+    """answers the request with the given status and error message"""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def listen_address(value: str) -> Tuple[str, int]:
+    """parses the [HOST:]PORT of --http"""
+    host, _, port = str(value).rpartition(":")
+    if not port.isdigit():
+        raise ValueError(f"invalid address {value}, expected [HOST:]PORT")
+    return host.strip("[]") or DEFAULT_HOST, int(port)
+
+
+def is_set(value) -> bool:
+    """returns True for json true and form values like 1, true, on or yes"""
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "on", "yes")
+    return bool(value)
+
+
+def argument(value) -> str:
+    """turns a json value into an app.py argument, e.g. [255, 0, 0] into 255-0-0"""
+    if isinstance(value, (list, tuple)):
+        return "-".join(str(part) for part in value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def options(fields: Dict, names: Dict[str, str]) -> List[str]:
+    """returns the app.py arguments of the given fields
+
+    Values are attached with = so that they are never parsed as options.
+    """
+    return [f"{option}={argument(fields[name])}" for name, option in names.items() if name in fields]
+
+
+def require(fields: Dict, name: str):
+    if fields.get(name) in (None, ""):
+        raise HttpError(400, f"missing field {name}")
+    return fields[name]
+
+
+def temporary_file(name: Optional[str] = None, mime: str = ""):
+    """creates a file for an upload, keeping the extension of its name (e.g. .idm)"""
+    suffix = os.path.splitext(name or "")[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,8}", suffix):
+        suffix = mimetypes.guess_extension(mime) or ""
+    descriptor, path = tempfile.mkstemp(prefix="idotmatrix-", suffix=suffix)
+    return os.fdopen(descriptor, "wb"), path
+
+
+class Request:
+    """request line and headers of one HTTP request, the body is streamed on demand"""
+
+    def __init__(self, reader, writer, method: str, target: str, headers: Dict[str, str]) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.method = method
+        url = urlsplit(target)
+        self.path = url.path.rstrip("/") or "/"
+        self.query = dict(parse_qsl(url.query))
+        self.headers = headers
+        # body bytes read so far and the seconds it took
+        self.received = 0
+        self.receiving = 0.0
+
+    @classmethod
+    async def read(cls, reader, writer) -> Optional["Request"]:
+        """reads the request line and the headers, returns None if the client sent nothing"""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split()
+        except ValueError:
+            raise HttpError(400, "invalid request line") from None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, separator, value = line.decode("latin-1").partition(":")
+            if not separator:
+                raise HttpError(400, "invalid header line")
+            headers[name.strip().lower()] = value.strip()
+        return cls(reader, writer, method.upper(), target, headers)
+
+    def content_type(self) -> Tuple[str, Dict[str, str]]:
+        """returns the media type and its parameters, e.g. the multipart boundary"""
+        value, *parameters = self.headers.get("content-type", "").split(";")
+        values = {}
+        for parameter in parameters:
+            name, _, parameter_value = parameter.strip().partition("=")
+            values[name.lower()] = parameter_value.strip('"')
+        return value.strip().lower(), values
+
+    async def body(self) -> AsyncIterator[bytes]:
+        """yields the body as it arrives (at most MAX_BODY_SIZE bytes)"""
+        if self.headers.get("expect", "").lower() == "100-continue":
+            # curl waits for this before sending larger uploads
+            self.writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await self.writer.drain()
+        started = time.perf_counter()
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            chunks = self._chunked()
+        else:
+            try:
+                length = int(self.headers.get("content-length", 0))
+            except ValueError:
+                raise HttpError(400, "invalid content length") from None
+            if length > MAX_BODY_SIZE:
+                raise HttpError(413, f"the body exceeds {MAX_BODY_SIZE} bytes")
+            chunks = self._sized(length)
+        async for chunk in chunks:
+            self.received += len(chunk)
+            if self.received > MAX_BODY_SIZE:
+                raise HttpError(413, f"the body exceeds {MAX_BODY_SIZE} bytes")
+            self.receiving = time.perf_counter() - started
+            yield chunk
+
+    async def _wait(self, read):
+        """waits for a read of the body, a client which stalls gets 408"""
+        try:
+            return await asyncio.wait_for(read, BODY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HttpError(408, f"no body data for {BODY_TIMEOUT}s") from None
+
+    async def _sized(self, length: int) -> AsyncIterator[bytes]:
+        while length > 0:
+            chunk = await self._wait(self.reader.read(min(READ_SIZE, length)))
+            if not chunk:
+                raise HttpError(400, "the body ended early")
+            length -= len(chunk)
+            yield chunk
+
+    async def _chunked(self) -> AsyncIterator[bytes]:
+        while True:
+            line = await self._wait(self.reader.readline())
+            try:
+                size = int(line.split(b";")[0].strip(), 16)
+            except ValueError:
+                raise HttpError(400, "invalid chunk size") from None
+            if size == 0:
+                # skip the trailers
+                while (await self._wait(self.reader.readline())) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            async for chunk in self._sized(size):
+                yield chunk
+            await self._wait(self.reader.readline())
+
+    async def fields(self, form: bool) -> Dict:
+        """reads a json object or (with form) an url encoded body, {} for an empty body"""
+        data = bytearray()
+        async for chunk in self.body():
+            data += chunk
+            if len(data) > MAX_FIELD_SIZE:
+                raise HttpError(413, f"bodies without files are limited to {MAX_FIELD_SIZE} bytes")
+        data = data.strip()
+        # curl -d sends json as form unless the content type is given
+        if form and not data.startswith(b"{"):
+            return dict(parse_qsl(data.decode("utf-8", "replace")))
+        if not data:
+            return {}
+        try:
+            value = json.loads(data)
+        except ValueError as error:
+            raise HttpError(400, f"invalid json: {error}") from None
+        if not isinstance(value, dict):
+            raise HttpError(400, "expected a json object")
+        return value
+
+
+class FormParser:
+    """Streaming multipart/form-data parser.
+
+    File parts are written to temporary files while they arrive, so an
+    upload is never held in memory as a whole, the other fields are kept as
+    strings. The paths of the files are added to files as soon as they are
+    created, so the caller can remove them even if the body is invalid.
+    """
+
+    def __init__(self, boundary: bytes, files: Dict[str, str]) -> None:
+        self.delimiter = b"\r\n--" + boundary
+        self.fields: Dict[str, str] = {}
+        self.files = files
+        # the first boundary is not preceded by a line break
+        self.buffer = bytearray(b"\r\n")
+        self.state = "preamble"
+        self.name = None
+        self.target = None
+
+    def feed(self, data: bytes) -> None:
+        self.buffer += data
+        while self._step():
+            pass
+
+    def _step(self) -> bool:
+        """parses the buffer up to the next state, returns False if more data is needed"""
+        if self.state == "preamble":
+            index = self.buffer.find(self.delimiter)
+            if index < 0:
+                # keep what may be the start of the delimiter
+                del self.buffer[: max(0, len(self.buffer) - len(self.delimiter) + 1)]
+                return False
+            del self.buffer[: index + len(self.delimiter)]
+            self.state = "delimiter"
+        elif self.state == "delimiter":
+            if self.buffer[:2] == b"--":
+                self.buffer.clear()
+                self.state = "done"
+                return False
+            end = self.buffer.find(b"\r\n")
+            if end < 0:
+                if len(self.buffer) > MAX_FIELD_SIZE:
+                    raise HttpError(400, "invalid multipart boundary")
+                return False
+            del self.buffer[: end + 2]
+            self.state = "headers"
+        elif self.state == "headers":
+            end = 0 if self.buffer.startswith(b"\r\n") else self.buffer.find(b"\r\n\r\n")
+            if end < 0:
+                if len(self.buffer) > MAX_FIELD_SIZE:
+                    raise HttpError(400, "the headers of a multipart part are too long")
+                return False
+            headers = self.buffer[:end].decode("utf-8", "replace")
+            del self.buffer[: end + (2 if end == 0 else 4)]
+            self._start(headers)
+            self.state = "body"
+        elif self.state == "body":
+            index = self.buffer.find(self.delimiter)
+            if index < 0:
+                # everything but a possible start of the delimiter belongs to the part
+                end = len(self.buffer) - len(self.delimiter) + 1
+                if end > 0:
+                    self._write(self.buffer[:end])
+                    del self.buffer[:end]
+                return False
+            self._write(self.buffer[:index])
+            del self.buffer[: index + len(self.delimiter)]
+            self._finish()
+            self.state = "delimiter"
+        else:
+            return False
+        return True
+
+    def _start(self, headers: str) -> None:
+        disposition = ""
+        for line in headers.split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-disposition":
+                disposition = value
+        parameters = dict(re.findall(r'(\w+)\*?="?([^";]*)"?', disposition))
+        self.name = parameters.get("name", "")
+        if "filename" in parameters:
+            self.target, self.files[self.name] = temporary_file(parameters["filename"])
+        else:
+            self.target = bytearray()
+
+    def _write(self, data) -> None:
+        if isinstance(self.target, bytearray):
+            if len(self.target) + len(data) > MAX_FIELD_SIZE:
+                raise HttpError(413, f"form fields are limited to {MAX_FIELD_SIZE} bytes")
+            self.target += data
+        else:
+            self.target.write(data)
+
+    def _finish(self) -> None:
+        if isinstance(self.target, bytearray):
+            self.fields[self.name] = self.target.decode("utf-8", "replace")
+        else:
+            self.target.close()
+        self.target = None
+
+    def close(self) -> None:
+        """closes the file of an unfinished part"""
+        if self.target is not None and not isinstance(self.target, bytearray):
+            self.target.close()
+
+
+class HttpApi:
+    """HTTP endpoints for the CMD operations of a daemon.
+
+    The server runs on the event loop of the daemon, so it shares the open
+    device connection. Every endpoint takes a json object, form fields or
+    query parameters (plus address, priority, slot and transport), turns them
+    into app.py arguments and queues them like a request on the unix socket.
+    Uploads (multipart/form-data with a "file" field, or the file itself as
+    body) are streamed into temporary files, which are removed once the
+    request is answered.
+
+        GET  /status      the devices and queues of the daemon
+        POST /text        text, size, mode, speed, color_mode, color, bg_mode, bg_color
+        POST /gif         file, process (pixel size), force, max_frames, max_fps,
+                          max_upload_bytes, max_upload_seconds, crop
+        POST /image       file, process (pixel size), force
+        POST /brightness  brightness (5..100)
+        POST /clock       style (0..7), date, 24h, color
+        POST /scoreboard  home, away (0..999)
+        POST /pixels      pixels: [[x, y, r, g, b], ...]
+
+    The response is the daemon response as json (status 200 if it is ok,
+    400 for invalid requests and 500 if the command or the server failed).
+    The time spent receiving the body is added as "received", and all
+    phases are also sent as Server-Timing header.
+
+    There is no authentication, so the server listens on 127.0.0.1 unless
+    --http names another host.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, daemon) -> None:
+        self.daemon = daemon
+        self.server = None
+        self.routes = {
+            "/text": self.text,
+            "/gif": self.gif,
+            "/image": self.image,
+            "/brightness": self.brightness,
+            "/clock": self.clock,
+            "/scoreboard": self.scoreboard,
+            "/pixels": self.pixels,
+        }
+
+    async def start(self, address: str):
+        """starts listening on [HOST:]PORT and returns the server"""
+        try:
+            host, port = listen_address(address)
+        except ValueError as error:
+            self.logging.error(f"wrong argument for --http: {error}")
+            quit()
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.logging.info(f"http api listening on {host}:{port}")
+        return self.server
+
+    async def handle(self, reader, writer) -> None:
+        """answers one request and closes the connection"""
+        started = time.perf_counter()
+        files: Dict[str, str] = {}
+        request = None
+        try:
+            try:
+                request = await asyncio.wait_for(Request.read(reader, writer), HEADER_TIMEOUT)
+                if request is None:
+                    return
+                status, response = await self.dispatch(request, files)
+            except HttpError as error:
+                status, response = error.status, {"ok": False, "error": str(error)}
+            except (ValueError, asyncio.TimeoutError) as error:
+                status, response = 400, {"ok": False, "error": f"invalid request: {error}"}
+            except ConnectionError:
+                raise
+            except Exception as error:
+                self.logging.exception(f"request failed: {error}")
+                status, response = 500, {"ok": False, "error": f"internal error: {error}"}
+            if request is not None and request.received:
+                response["received"] = {"bytes": request.received, "seconds": round(request.receiving, 3)}
+            response["elapsed"] = round(time.perf_counter() - started, 3)
+            if request is not None:
+                self.logging.debug(f"{request.method} {request.path}: {status}")
+            await self.respond(writer, status, response)
+        except ConnectionError as error:
+            self.logging.debug(f"client went away: {error}")
+        finally:
+            for path in files.values():
+                storage.remove(path)
+            writer.close()
+
+    async def dispatch(self, request: Request, files: Dict[str, str]) -> Tuple[int, Dict]:
+        if request.path == "/status":
+            if request.method != "GET":
+                raise HttpError(405, "use GET for /status")
+            return 200, self.status()
+        endpoint = self.routes.get(request.path)
+        if endpoint is None:
+            raise HttpError(404, f"no endpoint {request.path}")
+        if request.method != "POST":
+            raise HttpError(405, f"use POST for {request.path}")
+        fields = await self.read(request, files)
+        argv = endpoint(fields, files) + options(fields, COMMON_OPTIONS)
+        try:
+            args = self.daemon.parse(argv)
+        except ValueError as error:
+            raise HttpError(400, str(error)) from None
+        response = await self.daemon.submit(args, argv)
+        return (200 if response["ok"] else 500), response
+
+    async def read(self, request: Request, files: Dict[str, str]) -> Dict:
+        """reads the fields of a request, uploaded files are streamed to files"""
+        mime, parameters = request.content_type()
+        fields = dict(request.query)
+        if mime == "multipart/form-data":
+            boundary = parameters.get("boundary")
+            if not boundary:
+                raise HttpError(400, "multipart body without boundary")
+            form = FormParser(boundary.encode("latin-1"), files)
+            try:
+                async for chunk in request.body():
+                    form.feed(chunk)
+            finally:
+                form.close()
+            if form.state != "done":
+                raise HttpError(400, "incomplete multipart body")
+            fields.update(form.fields)
+        elif mime in ("", "application/json", "application/x-www-form-urlencoded"):
+            fields.update(await request.fields(form=mime == "application/x-www-form-urlencoded"))
+        else:
+            # the body is the file itself, e.g. curl --data-binary @image.gif
+            target, files["file"] = temporary_file(request.query.get("filename"), mime)
+            with target:
+                async for chunk in request.body():
+                    target.write(chunk)
+        return fields
+
+    async def respond(self, writer, status: int, response: Dict) -> None:
+        body = json.dumps(response).encode()
+        headers = [
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        durations = self.server_timing(response)
+        if durations:
+            headers.append(f"Server-Timing: {durations}")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    @staticmethod
+    def server_timing(response: Dict) -> str:
+        """returns the receive time, the phases and the total time in Server-Timing format"""
+        durations = {}
+        if "received" in response:
+            durations["receive"] = response["received"]["seconds"]
+        for record in response.get("timings", []):
+            durations[record["phase"]] = durations.get(record["phase"], 0.0) + record["elapsed"]
+        durations["total"] = response["elapsed"]
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+    def status(self) -> Dict:
+        return {
+            "ok": True,
+            "addresses": self.daemon.addresses,
+            "queues": {
+                key: {
+                    "running": str(queue.current) if queue.current else None,
+                    "pending": len(queue.pending),
+                    **queue.stats,
+                }
+                for key, queue in self.daemon.queues.items()
+            },
+        }
+
+    def upload(self, option: str, process: str, fields: Dict, files: Dict[str, str]) -> List[str]:
+        if "file" not in files:
+            raise HttpError(400, "missing file upload")
+        argv = [f"{option}={files['file']}"]
+        if fields.get("process"):
+            argv.append(f"{process}={argument(fields['process'])}")
+        if is_set(fields.get("force")):
+            argv.append("--force")
+        return argv
+
+    def text(self, fields: Dict, files: Dict[str, str]) -> List[str]:
+        return [f"--set-text={argument(require(fields, 'text'))}"] + options(fields, TEXT_OPTIONS)
+
+    def gif(self, fields: Dict, files: Dict[str, str]) -> List[str]:
+        argv = self.upload("--set-gif", "--process-gif", fields, files) + options(fields, GIF_OPTIONS)
+        if is_set(fields.get("crop")):
+            argv.append("--gif-crop")
+        return argv
+
+    def image(self, fields: Dict, files: Dict[str, str]) -> List[str]:
+        return ["--image=true"] + self.upload("--set-image", "--process-image", fields, files)
+
+    def brightness(self, fields: Dict, files: Dict[str, str]) -> List[str]:
+        return [f"--set-brightness={argument(require(fields, 'brightness'))}"]
+
+    def clock(self, fields: Dict, files: Dict[str, str]) -> List[str]:
+        argv = [f"--clock={argument(fields.get('style', 0))}"]
+        if is_set(fields.get("date")):
+            argv.append("--clock-with-date")
+        if is_set(fields.get("24h")):
+            argv.append("--clock-24h")
+        return argv + options(fields, {"color": "--clock-color"})
+
+    def scoreboard(self, fields: Dict, files: Dict[str, str]) -> List[str]:
+        return [f"--scoreboard={argument(require(fields, 'home'))}-{argument(require(fields, 'away'))}"]
+
+    def pixels(self, fields: Dict, files: Dict[str, str]) -> List[str]:
+        pixels = require(fields, "pixels")
+        if not isinstance(pixels, list):
+            raise HttpError(400, "pixels must be a list of [x, y, r, g, b]")
+        return [f"--pixel-color={argument(pixel)}" for pixel in pixels]
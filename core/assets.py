@@ -0,0 +1,145 @@
+# python imports
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+# idotmatrix imports
+from core import idm
+from core import storage
+from core import timing
+
+# changed whenever the processing of gifs or images changes, so older entries are not used
+PROCESSING_VERSION = 4
+DEFAULT_MAX_MEGABYTES = 64
+
+
+def max_bytes() -> int:
+    """returns the size cap of the cache (IDOTMATRIX_ASSET_CACHE_MB or the default)"""
+    return int(float(os.environ.get("IDOTMATRIX_ASSET_CACHE_MB", DEFAULT_MAX_MEGABYTES)) * 1024 * 1024)
+
+
+def source_hash(file_path: str) -> str:
+    """returns the sha256 of the content of a source file"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def asset_key(source: str, kind: int, pixel_size: int, options: Optional[Dict] = None) -> str:
+    """returns the cache key of a source processed to pixel_size with the given options"""
+    description = json.dumps(
+        {
+            "source": source,
+            "kind": kind,
+            "size": pixel_size,
+            "options": options or {},
+            "version": PROCESSING_VERSION,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+
+class AssetCache:
+    """Processed gif and image payloads in the cache directory, keyed by the
+    hash of the source, the pixel size and the processing options.
+
+    Entries are .idm files, so a hit is mapped into memory and sent without
+    any processing. The modification time of an entry is its last use: once
+    the entries exceed the size cap, the least recently used ones are
+    removed. Hits and misses are counted in stats.json next to them and
+    recorded as cache-hit and cache-miss with --timings.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, limit: Optional[int] = None) -> None:
+        self.limit = max_bytes() if limit is None else limit
+        self.stats_path = storage.path("assets", "stats.json")
+        self.directory = os.path.dirname(self.stats_path)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + idm.EXTENSION)
+
+    def get(self, key: str) -> Optional[idm.IdmFile]:
+        """returns the cached payload of a key, None on a miss"""
+        path = self.path(key)
+        try:
+            compiled = idm.IdmFile(path)
+        except FileNotFoundError:
+            compiled = None
+        except (OSError, ValueError) as error:
+            self.logging.warning(f"removing broken cache entry {path}: {error}")
+            storage.remove(path)
+            compiled = None
+        if compiled is None:
+            self.count("misses")
+            timing.event("cache-miss")
+            return None
+        # marks the entry as recently used
+        os.utime(path)
+        self.count("hits")
+        timing.event("cache-hit", compiled.bytes)
+        return compiled
+
+    def contains(self, key: str) -> bool:
+        """returns True if a valid entry exists for a key, without counting a hit or miss"""
+        try:
+            idm.IdmFile(self.path(key))
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def put(self, key: str, kind: int, pixel_size: int, chunks: List[bytes]) -> str:
+        """stores a processed payload, evicts old entries and returns the hash of the payload"""
+        digest = idm.write(self.path(key), kind, pixel_size, chunks)
+        self.evict()
+        return digest
+
+    def entries(self) -> List[os.DirEntry]:
+        """returns the cache entries, least recently used first"""
+        entries = [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(idm.EXTENSION) and entry.is_file()
+        ]
+        return sorted(entries, key=lambda entry: entry.stat().st_mtime)
+
+    def evict(self) -> None:
+        """removes the least recently used entries until the cache fits its size cap"""
+        entries = self.entries()
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.limit:
+                break
+            total -= entry.stat().st_size
+            storage.remove(entry.path)
+            self.logging.debug(f"evicted {entry.name} from the asset cache")
+
+    def stats(self) -> Dict[str, int]:
+        """returns the hit and miss counters"""
+        try:
+            with open(self.stats_path, "r") as file:
+                stats = json.load(file)
+            return {"hits": int(stats.get("hits", 0)), "misses": int(stats.get("misses", 0))}
+        except (OSError, ValueError, AttributeError, TypeError):
+            return {"hits": 0, "misses": 0}
+
+    def count(self, name: str) -> None:
+        """adds one to the hits or misses counter"""
+        stats = self.stats()
+        stats[name] += 1
+        stats["updated"] = time.time()
+        try:
+            with open(self.stats_path + ".tmp", "w") as file:
+                json.dump(stats, file)
+            os.replace(self.stats_path + ".tmp", self.stats_path)
+        except OSError as error:
+            # the counters are informational, another process may be writing them
+            self.logging.debug(f"could not update {self.stats_path}: {error}")
+        self.logging.debug(f"asset cache: {stats['hits']} hits, {stats['misses']} misses")
@@ -0,0 +1,319 @@
+# python imports
+import asyncio
+import logging
+import os
+import stat
+import sys
+import time
+import wave
+from typing import List, Optional, Tuple
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+# idotmatrix imports
+from core import jobs
+from core.stream import FrameStream
+
+DEFAULT_RATE = 44100
+DEFAULT_CHANNELS = 1
+DEFAULT_FPS = 20
+DEFAULT_BANDS = 16
+DEFAULT_LATENCY_MS = 150
+# samples per fft, windows overlap by half
+WINDOW = 2048
+# frequency range split into log spaced bands
+MIN_FREQUENCY = 40.0
+MAX_FREQUENCY = 16000.0
+# band level in dB below full scale which shows as an empty bar
+FLOOR_DB = -60.0
+# a bar falls to this share of its height per frame unless the band is louder
+FALL = 0.7
+# bytes read from a pipe at once
+READ_SIZE = 4096
+
+
+def decode(data: bytes, width: int, channels: int) -> numpy.ndarray:
+    """turns little endian pcm data into mono float32 samples in -1..1"""
+    if width == 1:
+        samples = (numpy.frombuffer(data, numpy.uint8).astype(numpy.float32) - 128) / 128
+    elif width == 3:
+        padded = numpy.zeros((len(data) // 3, 4), numpy.uint8)
+        padded[:, 1:] = numpy.frombuffer(data, numpy.uint8)[: len(padded) * 3].reshape(-1, 3)
+        samples = padded.view("<i4")[:, 0].astype(numpy.float32) / 2**31
+    elif width in (2, 4):
+        dtype = "<i2" if width == 2 else "<i4"
+        samples = numpy.frombuffer(data, dtype).astype(numpy.float32) / 2 ** (8 * width - 1)
+    else:
+        raise ValueError(f"unsupported sample width of {width} bytes")
+    samples = samples[: len(samples) // channels * channels]
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+class FileSource:
+    """Samples of a wav file (or a raw signed 16 bit pcm file), released at the
+    rate they would be played, starting with the first poll.
+    """
+
+    def __init__(self, path: str, rate: int = DEFAULT_RATE, channels: int = DEFAULT_CHANNELS) -> None:
+        self.position = 0
+        self.started = None
+        self.finished = False
+        if path.lower().endswith(".wav"):
+            self.wave = wave.open(path, "rb")
+            self.rate = self.wave.getframerate()
+            self.channels = self.wave.getnchannels()
+            self.width = self.wave.getsampwidth()
+            self.file = None
+        else:
+            self.wave = None
+            self.file = open(path, "rb")
+            self.rate, self.channels, self.width = rate, channels, 2
+
+    async def open(self) -> None:
+        """nothing to do, the file is read on demand"""
+
+    def poll(self) -> Tuple[numpy.ndarray, float]:
+        """returns the samples played since the last poll and the time the newest one was played"""
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+        count = int((now - self.started) * self.rate) - self.position
+        if count <= 0:
+            return numpy.zeros(0, numpy.float32), now
+        if self.wave is not None:
+            data = self.wave.readframes(count)
+        else:
+            data = self.file.read(count * self.channels * self.width)
+        frames = len(data) // (self.channels * self.width)
+        if frames < count:
+            self.finished = True
+        self.position += frames
+        return decode(data, self.width, self.channels), self.started + self.position / self.rate
+
+    def close(self) -> None:
+        (self.wave or self.file).close()
+
+
+class PipeSource:
+    """Raw signed 16 bit pcm samples from stdin or a named pipe, read while
+    they arrive (e.g. from arecord or ffmpeg).
+    """
+
+    def __init__(self, path: str, rate: int = DEFAULT_RATE, channels: int = DEFAULT_CHANNELS) -> None:
+        self.path = path
+        self.rate, self.channels, self.width = rate, channels, 2
+        self.chunks: List[bytes] = []
+        self.arrival = time.perf_counter()
+        self.closed = False
+        self.pending = b""
+        self.file = None
+        self.task = None
+
+    async def open(self) -> None:
+        """starts reading the pipe in the background"""
+        self.file = sys.stdin.buffer if self.path == "-" else open(self.path, "rb")
+        reader = asyncio.StreamReader()
+        loop = asyncio.get_running_loop()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), self.file)
+        self.task = asyncio.ensure_future(self._read(reader))
+
+    async def _read(self, reader) -> None:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                self.closed = True
+                return
+            self.chunks.append(data)
+            self.arrival = time.perf_counter()
+
+    @property
+    def finished(self) -> bool:
+        return self.closed and not self.chunks
+
+    def poll(self) -> Tuple[numpy.ndarray, float]:
+        """returns the samples which arrived since the last poll and the time the newest one arrived"""
+        data = self.pending + b"".join(self.chunks)
+        self.chunks.clear()
+        usable = len(data) // (self.channels * self.width) * self.channels * self.width
+        self.pending = data[usable:]
+        return decode(data[:usable], self.width, self.channels), self.arrival
+
+    def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+        if self.file is not None and self.path != "-":
+            self.file.close()
+
+
+def open_source(path: str, rate: int = DEFAULT_RATE, channels: int = DEFAULT_CHANNELS):
+    """returns a PipeSource for - and named pipes, otherwise a FileSource"""
+    if path == "-" or stat.S_ISFIFO(os.stat(path).st_mode):
+        return PipeSource(path, rate, channels)
+    return FileSource(path, rate, channels)
+
+
+class BandAnalyzer:
+    """Levels of log spaced frequency bands in 0..1.
+
+    New samples are cut into windows overlapping by half, which are all
+    transformed with one rfft call, and every band keeps the loudest of them,
+    so short beats between two frames are not lost.
+    """
+
+    def __init__(self, rate: int, bands: int = DEFAULT_BANDS, window: int = WINDOW) -> None:
+        self.window = window
+        self.hop = window // 2
+        self.taper = numpy.hanning(window).astype(numpy.float32)
+        frequencies = numpy.fft.rfftfreq(window, 1 / rate)
+        edges = numpy.geomspace(MIN_FREQUENCY, min(MAX_FREQUENCY, rate / 2), bands + 1)
+        starts = numpy.searchsorted(frequencies, edges[:-1])
+        # every band needs at least one bin of its own
+        for band in range(1, bands):
+            starts[band] = max(starts[band], starts[band - 1] + 1)
+        self.end = max(int(numpy.searchsorted(frequencies, edges[-1])), int(starts[-1]) + 1)
+        self.starts = starts
+        self.bins = numpy.diff(numpy.append(starts, self.end)).astype(numpy.float32)
+        # power of a full scale sine in the bin of its frequency
+        self.reference = (self.taper.sum() / 2) ** 2
+        self.buffer = numpy.zeros(0, numpy.float32)
+
+    def add(self, samples: numpy.ndarray) -> Optional[numpy.ndarray]:
+        """returns the band levels of the windows completed by samples, None if there is none"""
+        self.buffer = numpy.concatenate((self.buffer, samples))
+        if len(self.buffer) < self.window:
+            return None
+        windows = sliding_window_view(self.buffer, self.window)[:: self.hop]
+        spectra = numpy.abs(numpy.fft.rfft(windows * self.taper, axis=1)[:, : self.end]) ** 2
+        power = numpy.add.reduceat(spectra, self.starts, axis=1) / self.bins
+        self.buffer = self.buffer[len(windows) * self.hop :]
+        decibels = 10 * numpy.log10(power.max(axis=0) / self.reference + 1e-12)
+        return numpy.clip(1 - decibels / FLOOR_DB, 0, 1)
+
+
+class SpectrumRenderer:
+    """Draws band levels as bars from green to red on a square canvas."""
+
+    def __init__(self, size: int, bands: int) -> None:
+        self.size = size
+        # the columns of every band, left over columns stay black
+        self.columns = numpy.arange(size) * bands // size
+        rows = numpy.arange(size)[::-1, None] / max(1, size - 1)
+        self.colors = numpy.concatenate(
+            (numpy.minimum(1, 2 * rows), numpy.minimum(1, 2 * (1 - rows)), numpy.zeros_like(rows)),
+            axis=1,
+        )[:, None, :] * 255
+        self.colors = self.colors.astype(numpy.uint8)
+        self.heights = numpy.zeros(bands, numpy.float32)
+
+    def render(self, levels: Optional[numpy.ndarray]) -> numpy.ndarray:
+        self.heights *= FALL
+        if levels is not None:
+            self.heights = numpy.maximum(self.heights, levels)
+        height = numpy.rint(self.heights * self.size)[self.columns]
+        lit = numpy.arange(self.size)[::-1, None] < height[None, :]
+        return numpy.where(lit[:, :, None], self.colors, numpy.uint8(0))
+
+
+class SpectrumSync:
+    """Shows the spectrum of local audio on the DIY canvas at a fixed rate.
+
+    The device's own rhythm packets are not documented, so the bars are
+    drawn on the host and sent through a FrameStream (changed pixels or
+    full image). Every frame uses the newest samples, frames which are due
+    while the previous one is still sent are dropped, so the display never
+    falls behind the audio. The latency is measured from the middle of the
+    newest analyzed window until the frame was sent.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(
+        self,
+        cmd,
+        size: int,
+        fps: float = DEFAULT_FPS,
+        bands: int = DEFAULT_BANDS,
+        latency_ms: float = DEFAULT_LATENCY_MS,
+    ) -> None:
+        if fps <= 0 or bands <= 0:
+            raise ValueError("the frame rate and the number of bands must be positive")
+        self.cmd = cmd
+        self.size = size
+        self.fps = fps
+        self.bands = min(bands, size)
+        self.target = latency_ms / 1000
+        self.latencies: List[float] = []
+        self.dropped = 0
+
+    async def run(self, source) -> dict:
+        """shows the spectrum until the source ends and returns the report"""
+        await source.open()
+        analyzer = BandAnalyzer(source.rate, self.bands)
+        renderer = SpectrumRenderer(self.size, self.bands)
+        stream = FrameStream(self.cmd, self.fps, self.size)
+        conn = self.cmd.conn
+        await conn.connect()
+        self.cmd.uploads().forget()
+        framebuffer = self.cmd.framebuffer()
+        interval = 1 / self.fps
+        # half a window of audio is older than its newest sample
+        window_age = analyzer.window / 2 / source.rate
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        due = started
+        try:
+            while not source.finished:
+                samples, arrival = source.poll()
+                levels = analyzer.add(samples)
+                stream.stats["frames"] += 1
+                await stream.show(renderer.render(levels), framebuffer)
+                if levels is not None:
+                    self.latencies.append(time.perf_counter() - arrival + window_age)
+                due += interval
+                now = time.perf_counter()
+                if now > due:
+                    # the frame took longer than its slot, continue with the newest audio
+                    missed = int((now - due) / interval) + 1
+                    self.dropped += missed
+                    due += missed * interval
+                await jobs.sleep(due - now)
+        except BaseException:
+            framebuffer.invalidate()
+            raise
+        finally:
+            stream.elapsed = time.perf_counter() - started
+            cpu = time.process_time() - cpu_started
+            source.close()
+        if framebuffer.valid:
+            framebuffer.update(framebuffer.pixels)
+        return self.report(stream, cpu)
+
+    def report(self, stream: FrameStream, cpu: float) -> dict:
+        report = stream.report()
+        report["dropped"] = self.dropped
+        report["cpu"] = round(cpu / stream.elapsed, 3) if stream.elapsed > 0 else 0.0
+        if self.latencies:
+            latencies = numpy.array(self.latencies) * 1000
+            report["latency_ms"] = {
+                "mean": round(float(latencies.mean()), 1),
+                "p95": round(float(numpy.percentile(latencies, 95)), 1),
+                "max": round(float(latencies.max()), 1),
+            }
+        self.logging.info(
+            f"music sync showed {report['frames']} frames in {report['seconds']}s at {report['fps']} fps "
+            f"(target {self.fps:g}, {self.dropped} dropped), {report['bytes']} bytes, "
+            f"cpu {report['cpu'] * 100:.1f}% of one core"
+        )
+        if "latency_ms" in report:
+            latency = report["latency_ms"]
+            message = f"audio to display latency {latency['mean']}ms mean, {latency['p95']}ms p95, {latency['max']}ms max"
+            if latency["p95"] > self.target * 1000:
+                self.logging.warning(
+                    f"{message}, above the target of {self.target * 1000:g}ms (try a lower --music-fps or fewer --music-bands)"
+                )
+            else:
+                self.logging.info(f"{message} (target {self.target * 1000:g}ms)")
+        return report
@@ -0,0 +1,134 @@
+# python imports
+import io
+import logging
+import math
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy
+from PIL import Image as PilImage
+
+# idotmatrix imports
+from core.gifstream import ALPHA_THRESHOLD, process_gif
+
+# the settings searched, from the best looking to the smallest: colors per
+# frame and frame rates as share of the rate of the gif
+COLOR_LEVELS = (128, 64, 32, 16, 8, 4, 2)
+DECIMATION = (0.8, 2 / 3, 0.5, 0.4, 1 / 3, 0.25, 0.2, 1 / 6, 0.125)
+# reported for a candidate equal to the reference
+MAX_PSNR = 99.0
+
+log = logging.getLogger("idotmatrix." + __name__)
+
+
+def timeline(data: bytes) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """decodes a gif into its frames as shown on the panel (transparency is
+    black), as (frames, height, width, 3) float32 array, and the start of
+    every frame in ms
+    """
+    frames = []
+    durations = []
+    with PilImage.open(io.BytesIO(data)) as img:
+        for index in range(getattr(img, "n_frames", 1)):
+            img.seek(index)
+            rgba = numpy.asarray(img.convert("RGBA"), dtype=numpy.float32)
+            frames.append(rgba[..., :3] * (rgba[..., 3:] >= ALPHA_THRESHOLD))
+            durations.append(img.info.get("duration") or 100)
+    starts = numpy.concatenate(([0], numpy.cumsum(durations)))
+    return numpy.stack(frames), starts
+
+
+def psnr(reference: Tuple[numpy.ndarray, numpy.ndarray], data: bytes) -> float:
+    """compares a gif with the reference over one loop of the reference and
+    returns the time weighted peak signal to noise ratio in dB
+
+    A candidate with fewer frames shows each of its frames longer, a
+    truncated one loops earlier, both count as the error against the
+    reference frame shown at the same time.
+    """
+    frames, starts = reference
+    candidate, candidate_starts = timeline(data)
+    total, candidate_total = starts[-1], candidate_starts[-1]
+    # every moment one of the two gifs changes its frame
+    loops = numpy.arange(math.ceil(total / candidate_total))[:, None] * candidate_total
+    changes = numpy.unique(numpy.concatenate((starts[:-1], (candidate_starts[:-1] + loops).ravel())))
+    changes = changes[changes < total]
+    weights = numpy.diff(numpy.append(changes, total))
+    shown = numpy.searchsorted(starts, changes, side="right") - 1
+    candidate_shown = numpy.searchsorted(candidate_starts, changes % candidate_total, side="right") - 1
+    # the squared error of every pair of frames shown together, each pair once
+    pairs, inverse = numpy.unique(numpy.stack((shown, candidate_shown), axis=1), axis=0, return_inverse=True)
+    errors = ((frames[pairs[:, 0]] - candidate[pairs[:, 1]]) ** 2).mean(axis=(1, 2, 3))
+    mse = float((errors[inverse.ravel()] * weights).sum() / total)
+    if mse == 0:
+        return MAX_PSNR
+    return min(MAX_PSNR, 10 * math.log10(255**2 / mse))
+
+
+def fit_gif(data: bytes, fits: Callable[[bytes], bool], crop: bool = False) -> Tuple[bytes, Dict]:
+    """searches the colors, frame rate and frame count which look best in
+    the budget checked by fits and returns the gif with its parameters
+
+    For every color count below the colors of the gif, the highest frame
+    rate which fits is searched (the size shrinks with the rate), if none
+    does the frames are cut at the lowest one. The candidate closest to the
+    original (psnr) wins. If nothing fits, the smallest candidate is
+    returned with fits False in its parameters. crop is passed on to the
+    optimizer.
+    """
+    reference = timeline(data)
+    frames, starts = reference
+    size = frames.shape[2]
+    native_fps = len(frames) * 1000 / starts[-1]
+    rates = [None] + [native_fps * factor for factor in DECIMATION]
+    most_colors = max(len(numpy.unique(frame.reshape(-1, 3), axis=0)) for frame in frames)
+    levels = [256] + [colors for colors in COLOR_LEVELS if colors < most_colors]
+    best: Optional[Tuple[bytes, Dict]] = None
+    smallest: Optional[Tuple[bytes, Dict]] = None
+    tried = 0
+
+    def encode(colors, fps, max_frames=None):
+        nonlocal tried, smallest
+        tried += 1
+        report: Dict = {}
+        candidate = process_gif(io.BytesIO(data), size, max_frames, fps, True, report, colors, crop)
+        parameters = {
+            "colors": min(colors, most_colors),
+            "fps": round(float(fps), 2) if fps else None,
+            "frames": report["written"],
+            "bytes": len(candidate),
+        }
+        if smallest is None or len(candidate) < len(smallest[0]):
+            smallest = (candidate, parameters)
+        return (candidate, parameters) if fits(candidate) else None
+
+    for colors in levels:
+        fitted = encode(colors, rates[-1])
+        if fitted is None:
+            # the lowest frame rate is too large still, keeps as many frames as fit
+            low, high = 1, len(frames) - 1
+            while low <= high:
+                middle = (low + high) // 2
+                candidate = encode(colors, rates[-1], middle)
+                if candidate is not None:
+                    fitted, low = candidate, middle + 1
+                else:
+                    high = middle - 1
+        else:
+            # the highest rate which fits, the lowest one does
+            low, high = 0, len(rates) - 2
+            while low <= high:
+                middle = (low + high) // 2
+                candidate = encode(colors, rates[middle])
+                if candidate is not None:
+                    fitted, high = candidate, middle - 1
+                else:
+                    low = middle + 1
+        if fitted is None:
+            continue
+        fitted[1]["psnr"] = round(psnr(reference, fitted[0]), 2)
+        log.debug(f"budget candidate {fitted[1]}")
+        if best is None or fitted[1]["psnr"] > best[1]["psnr"]:
+            best = fitted
+    if best is None:
+        return smallest[0], {**smallest[1], "tried": tried, "fits": False}
+    return best[0], {**best[1], "tried": tried, "fits": True}
@@ -0,0 +1,97 @@
+# python imports
+import json
+import os
+import socket
+import subprocess
+import tempfile
+
+# this module is imported by the schedulers and the gui, so it must only
+# depend on the standard library (no PIL, bleak or idotmatrix imports here)
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "idotmatrix.sock")
+
+
+def socket_path():
+    """returns the daemon socket path (IDOTMATRIX_SOCKET or the default path)"""
+    return os.environ.get("IDOTMATRIX_SOCKET", DEFAULT_SOCKET_PATH)
+
+
+def available(path=None):
+    """checks whether a daemon socket exists at the given path"""
+    return hasattr(socket, "AF_UNIX") and os.path.exists(path or socket_path())
+
+
+# app.py options which take a path, the daemon resolves relative paths
+# against its own working directory
+PATH_OPTIONS = (
+    "--set-gif",
+    "--set-image",
+    "--script",
+    "--stream",
+    "--music-sync",
+    "--timings",
+    "--compile-idm",
+    "--precompile-dir",
+    "--calendar-credentials",
+    "--calendar-token",
+)
+
+
+def absolute_args(args):
+    """returns app.py arguments with the values of PATH_OPTIONS made absolute
+    against the working directory of the caller ("-" stays stdin)
+    """
+    result = []
+    expects_path = False
+    for arg in (str(arg) for arg in args):
+        option, separator, value = arg.partition("=")
+        if expects_path and arg != "-" and not arg.startswith("-"):
+            arg = os.path.abspath(arg)
+        elif separator and option in PATH_OPTIONS and value not in ("", "-"):
+            arg = f"{option}={os.path.abspath(value)}"
+        expects_path = not separator and arg in PATH_OPTIONS
+        result.append(arg)
+    return result
+
+
+def send(args, path=None, timeout=120):
+    """sends app.py arguments to a running daemon and returns its response
+
+    Raises FileNotFoundError or ConnectionRefusedError if no daemon is listening.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or socket_path())
+        sock.sendall(json.dumps({"args": absolute_args(args)}).encode() + b"\n")
+        with sock.makefile("rb") as stream:
+            line = stream.readline()
+    if not line:
+        raise ConnectionError("daemon closed the connection without a response")
+    return json.loads(line)
+
+
+def run(cmd, path=None):
+    """runs a run_in_venv.sh command line, through the daemon when one is listening
+
+    cmd[0] is the launcher script and is only used when falling back to a
+    subprocess. Returns a subprocess.CompletedProcess in both cases.
+    """
+    path = path or socket_path()
+    if available(path):
+        try:
+            response = send(cmd[1:], path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            # stale socket file, the daemon is not running
+            pass
+        except (OSError, ValueError) as error:
+            # the request may have reached the device, so do not send it twice
+            return subprocess.CompletedProcess(
+                cmd, 1, stdout="", stderr=f"daemon request failed: {error}"
+            )
+        else:
+            return subprocess.CompletedProcess(
+                cmd,
+                0 if response.get("ok") else 1,
+                stdout="\n".join(response.get("log", [])),
+                stderr=response.get("error", ""),
+            )
+    return subprocess.run(cmd, capture_output=True, text=True)
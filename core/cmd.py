@@ -1,10 +1,26 @@
 # python imports
+import asyncio
+import copy
 from datetime import datetime
+import io
 import logging
 import os
-from PIL import Image
 import time
-from utils import utils
+import wave
+from core import devices
+from core import estimate
+from core import idm
+from core import jobs
+from core import script
+from core import storage
+from core import timing
+from core import transport
+from core.assets import AssetCache, asset_key, source_hash
+from core.graffiti import Graffiti
+from core.packets import Gif, Image, chunk_count, gif_data, gif_packets, image_data
+from core.timesync import TimeSync
+from core.transfer import Transfer
+from core.uploads import UploadRecord, payload_hash
 
 # idotmatrix imports
 from idotmatrix import ConnectionManager
@@ -12,20 +28,378 @@ from idotmatrix import Chronograph
 from idotmatrix import Clock
 from idotmatrix import Common
 from idotmatrix import Countdown
-from idotmatrix import Gif
-from idotmatrix import Image
 from idotmatrix import FullscreenColor
-from idotmatrix import MusicSync
 from idotmatrix import Scoreboard
-from idotmatrix import Graffiti
 from idotmatrix import Text
 
+# modules which show something else than the DIY canvas
+CANVAS_REPLACING = (Chronograph, Clock, Countdown, FullscreenColor, Gif, Scoreboard, Text)
+# the largest panel, bounds pixels as long as the canvas of the device is unknown
+MAX_PIXEL_SIZE = 64
+# the shadow canvas and the last upload of each device, shared by every CMD so the
+# commands of a fan out and the main command of the daemon never hold diverging copies
+_framebuffers = {}
+_uploads = {}
+
+
+def _shared(records, factory, kind, extension, address):
+    """returns the record of a device, created once per address and cache file"""
+    key = (address, storage.device_file(kind, address, extension))
+    if key not in records:
+        records[key] = factory(address)
+    return records[key]
+
 
 class CMD:
     conn = ConnectionManager()
     logging = logging.getLogger("idotmatrix." + __name__)
+    # set by add_arguments, used to parse the steps of a --script
+    parser = None
+    # set by app.py for --startup-profile
+    startup = None
+
+    def __init__(self, conn=None):
+        if conn is not None:
+            self.conn = conn
+        # one command (and connection) per device when sending to several devices
+        self.devices = {}
+
+    def _module(self, module):
+        """creates an idotmatrix module which sends over the connection of this command"""
+        if module in CANVAS_REPLACING:
+            self.forget_canvas()
+        if module is not Common:
+            # whatever the module shows replaces the last uploaded gif or image
+            self.uploads().forget()
+        instance = module()
+        instance.conn = self.conn
+        return instance
+
+    def framebuffer(self):
+        """returns the shadow of the DIY canvas of the connected device"""
+        # numpy is only needed for image and pixel commands
+        from core.framebuffer import Framebuffer
+
+        return _shared(_framebuffers, Framebuffer, "framebuffer", ".npy", self.conn.address)
+
+    def forget_canvas(self):
+        """drops the shadow of the DIY canvas without loading it"""
+        key = (self.conn.address, storage.device_file("framebuffer", self.conn.address, ".npy"))
+        if key in _framebuffers:
+            _framebuffers[key].invalidate()
+        else:
+            storage.remove(storage.device_file("framebuffer", self.conn.address, ".npy"))
+
+    def uploads(self):
+        """returns the record of the last gif or image uploaded to the connected device"""
+        return _shared(_uploads, UploadRecord, "uploads", ".json", self.conn.address)
+
+    async def _prepare(self, module, file_path, pixel_size, options=None):
+        """builds the payload of a gif or image upload without sending it
+
+        Returns the payload and its hash, or (False, None) if there's an error.
+        Precompiled .idm files are mapped into memory instead of processed.
+        options are passed to uploadProcessed, see gif_options.
+        """
+        if idm.is_idm(file_path):
+            return self._load_compiled(module, file_path, pixel_size)
+        cache = key = None
+        if pixel_size:
+            # processing decodes and resizes every frame, the result is cached
+            kind = idm.GIF if module is Gif else idm.IMAGE
+            cache = AssetCache()
+            try:
+                with timing.span("process"):
+                    key = asset_key(source_hash(file_path), kind, int(pixel_size), options)
+                    cached = cache.get(key)
+            except OSError as error:
+                self.logging.error(f"could not read {file_path}: {error}")
+                return False, None
+            if cached is not None:
+                self.logging.debug(f"using the cached processed payload of {file_path}")
+                return cached.payload(), cached.digest
+        detached = module()
+        detached.conn = None
+        with timing.span("process"):
+            if pixel_size:
+                payload = await detached.uploadProcessed(
+                    file_path=file_path,
+                    pixel_size=int(pixel_size),
+                    **(options or {}),
+                )
+            else:
+                payload = await detached.uploadUnprocessed(file_path=file_path)
+        if payload is False:
+            return False, None
+        if "plain_bytes" in getattr(detached, "report", {}):
+            self._report_optimization(file_path, detached.report)
+        if cache is not None:
+            chunks = payload if kind == idm.GIF else [payload]
+            return payload, cache.put(key, kind, int(pixel_size), chunks)
+        return payload, payload_hash(payload)
+
+    def _report_optimization(self, file_path, report):
+        """logs the bytes and the estimated transfer time the gif optimizer saved"""
+        before, after = report["plain_bytes"], report["bytes"]
+        saved = estimate.transfer_cost(before, chunk_count(before)) - estimate.transfer_cost(
+            after, chunk_count(after)
+        )
+        timing.event("gif-optimized", before - after)
+        self.logging.info(
+            f"optimized {file_path}: {before} -> {after} bytes ({100 * (before - after) / max(before, 1):.0f}% less), "
+            f"{report['duplicates']} duplicate frames merged, "
+            + (f"{report['cropped']} of {report['written']} frames cropped, " if report["cropped"] else "")
+            + f"about {saved:.2f}s less to send"
+        )
+
+    def gif_options(self, args):
+        """returns the processing options of --gif-max-frames, --gif-max-fps,
+        --no-gif-optimize and --gif-crop
+        """
+        options = {}
+        if getattr(args, "gif_max_frames", None):
+            options["max_frames"] = args.gif_max_frames
+        if getattr(args, "gif_max_fps", None):
+            options["max_fps"] = args.gif_max_fps
+        if getattr(args, "no_gif_optimize", False):
+            options["optimize"] = False
+        if getattr(args, "gif_crop", False):
+            options["crop"] = True
+        return options
+
+    def _upload_seconds(self, address, args, payload_bytes, chunks):
+        """returns the estimated seconds of a gif upload to a device"""
+        mode = transport.Transport(devices.DeviceConnection(address), args.transport).mode
+        confirms = transport.confirms(mode, True)
+        seconds, _ = estimate.Calibration(address).estimate(
+            estimate.link(mode, confirms), payload_bytes, chunks if confirms else 1
+        )
+        return seconds
+
+    async def _fit_budget(self, args, payload, digest, address):
+        """reduces a gif payload to --max-upload-bytes and --max-upload-seconds, see core.budget
+
+        Returns the payload and its hash, unchanged if it fits already.
+        """
+        max_bytes, max_seconds = args.max_upload_bytes, args.max_upload_seconds
+        if not max_bytes and not max_seconds:
+            return payload, digest
+
+        def fits(data):
+            chunks = gif_packets(data)
+            payload_bytes = sum(len(chunk) for chunk in chunks)
+            if max_bytes and payload_bytes > max_bytes:
+                return False
+            return not max_seconds or self._upload_seconds(address, args, payload_bytes, len(chunks)) <= max_seconds
+
+        data = bytes(gif_data(payload))
+        if fits(data):
+            self.logging.debug("the gif fits the upload budget")
+            return payload, digest
+        from core import budget
+
+        cache = AssetCache()
+        budget_options = {"max_bytes": max_bytes, "max_seconds": max_seconds}
+        crop = bool(getattr(args, "gif_crop", False))
+        if crop:
+            budget_options["crop"] = True
+        if max_seconds:
+            # the estimate depends on the calibration of the device
+            budget_options["device"] = storage.device_key(address)
+        key = asset_key(digest, idm.GIF, 0, budget_options)
+        with timing.span("process"):
+            cached = cache.get(key)
+            if cached is not None:
+                self.logging.info(f"using the cached fit of {args.set_gif} into the upload budget")
+                return cached.payload(), cached.digest
+            # trying the candidates takes seconds, the daemon keeps serving requests meanwhile
+            fitted, parameters = await asyncio.get_running_loop().run_in_executor(
+                None, budget.fit_gif, data, fits, crop
+            )
+        chunks = gif_packets(fitted)
+        payload_bytes = sum(len(chunk) for chunk in chunks)
+        seconds = self._upload_seconds(address, args, payload_bytes, len(chunks))
+        summary = (
+            f"{parameters['colors']} colors, {parameters['frames']} frames, "
+            f"{'the original frame rate' if parameters['fps'] is None else str(parameters['fps']) + ' fps'}, "
+            f"{sum(len(chunk) for chunk in payload)} -> {payload_bytes} bytes, about {seconds:.2f}s "
+            f"({parameters['tried']} candidates)"
+        )
+        if not parameters["fits"]:
+            self.logging.warning(f"{args.set_gif} does not fit the upload budget, sending the smallest candidate: {summary}")
+            return chunks, payload_hash(chunks)
+        self.logging.info(f"fitted {args.set_gif} into the upload budget: {summary}, psnr {parameters['psnr']} dB")
+        return chunks, cache.put(key, idm.GIF, int(args.process_gif or 0), chunks)
+
+    def _load_compiled(self, module, file_path, pixel_size):
+        """maps a precompiled .idm payload, see --compile-idm"""
+        kind = idm.GIF if module is Gif else idm.IMAGE
+        try:
+            with timing.span("process"):
+                compiled = idm.IdmFile(file_path)
+        except (OSError, ValueError) as error:
+            self.logging.error(f"could not load precompiled payload: {error}")
+            return False, None
+        if compiled.kind != kind:
+            self.logging.error(
+                f"{file_path} holds a payload of kind {idm.KINDS[compiled.kind]}, expected {idm.KINDS[kind]}"
+            )
+            return False, None
+        if pixel_size and int(pixel_size) != compiled.size:
+            self.logging.warning(
+                f"{file_path} was compiled for {compiled.size} pixels, not {pixel_size}"
+            )
+        self.logging.debug(f"using {len(compiled.chunks)} precompiled chunks of {file_path}")
+        return compiled.payload(), compiled.digest
+
+    async def compile_idm(self, args):
+        """processes --set-gif or --set-image into a precompiled .idm payload"""
+        if args.set_gif:
+            module, file_path, pixel_size, kind = Gif, args.set_gif, args.process_gif, idm.GIF
+            options = self.gif_options(args)
+        elif args.set_image:
+            module, file_path, pixel_size, kind = Image, args.set_image, args.process_image, idm.IMAGE
+            options = None
+        else:
+            self.logging.error("--compile-idm needs --set-gif or --set-image")
+            quit()
+        payload, digest = await self._prepare(module, file_path, pixel_size, options)
+        if payload is False:
+            return False
+        if kind == idm.GIF:
+            payload, digest = await self._fit_budget(args, payload, digest, args.address)
+        chunks = payload if kind == idm.GIF else [payload]
+        idm.write(args.compile_idm, kind, int(pixel_size or 0), chunks)
+        self.logging.info(
+            f"compiled {file_path} into {args.compile_idm} ({len(chunks)} chunks, {sum(len(chunk) for chunk in chunks)} bytes)"
+        )
+        return chunks
+
+    def precompile_dir(self, args):
+        """processes a directory of gifs and images into the asset cache, see --precompile-dir"""
+        from core import precompile
+
+        try:
+            sizes = precompile.parse_sizes(args.sizes)
+        except ValueError as error:
+            self.logging.error(str(error))
+            quit()
+        if not os.path.isdir(args.precompile_dir):
+            self.logging.error(f"{args.precompile_dir} is not a directory")
+            quit()
+        report = precompile.precompile(args.precompile_dir, sizes, self.gif_options(args))
+        self.logging.info(
+            f"precompiled {report['compiled']} assets ({report['frames']} frames, {report['bytes']} bytes) "
+            f"in {report['seconds']}s at {report['fps']} frames/s, {report['skipped']} unchanged, {report['failed']} failed"
+        )
+        return report
+
+    async def dry_run(self, args):
+        """builds the payload of --set-gif, --set-image or --set-text and estimates how long
+        sending it takes on every device, using the calibration of earlier uploads
+        """
+        if args.set_gif:
+            payload, digest = await self._prepare(Gif, args.set_gif, args.process_gif, self.gif_options(args))
+            if payload is not False:
+                address = args.address or os.environ.get("IDOTMATRIX_ADDRESS")
+                # the budget is fitted for the first device
+                address = devices.resolve(address)[0] if address else None
+                payload, digest = await self._fit_budget(args, payload, digest, address)
+            chunks, response = payload, True
+        elif args.set_image:
+            payload, digest = await self._prepare(Image, args.set_image, args.process_image)
+            detached = Image()
+            detached.conn = None
+            chunks, response = [await detached.setMode(mode=1), payload], False
+        elif args.set_text:
+            detached = Text()
+            detached.conn = None
+            with timing.span("process"):
+                payload = await detached.setMode(**self._text_options(args))
+            digest = None
+            chunks, response = [payload], False
+        else:
+            self.logging.error("--dry-run needs --set-gif, --set-image or --set-text")
+            quit()
+        if payload is False:
+            return False
+        payload_bytes = sum(len(chunk) for chunk in chunks)
+        address = args.address or os.environ.get("IDOTMATRIX_ADDRESS")
+        for address in devices.resolve(address) if address else [None]:
+            if str(address).lower() == "auto":
+                cached = devices.load_discovered()
+                address = cached[0]["address"] if cached else None
+            mode = transport.RESPONSE
+            if not args.set_text:
+                # text is always sent by the idotmatrix library
+                mode = transport.Transport(devices.DeviceConnection(address), args.transport).mode
+            confirms = transport.confirms(mode, response)
+            seconds, calibrated = estimate.Calibration(address).estimate(
+                estimate.link(mode, confirms), payload_bytes, len(chunks) if confirms else 1
+            )
+            self.logging.info(
+                f"{address or 'any device'}: {payload_bytes} bytes in {len(chunks)} chunks, "
+                f"about {seconds:.2f}s with {mode} writes"
+                + ("" if calibrated else " (not calibrated by an upload yet, rough estimate)")
+            )
+            uploads = _shared(_uploads, UploadRecord, "uploads", ".json", address)
+            if digest is not None and uploads.shows(digest):
+                self.logging.info(f"{address}: shows this content already, the upload would be skipped")
+        return chunks
+
+    def _already_shown(self, digest, force):
+        """checks if the last upload to the device had the same payload"""
+        if force or not self.uploads().shows(digest):
+            return False
+        self.logging.info(
+            "the device shows this content already, skipping the upload (use --force to send it anyway)"
+        )
+        return True
+
+    async def _send_payload(self, module, chunks, response):
+        """sends a prepared payload over the connection of the given module"""
+        try:
+            if module.conn:
+                await Transfer(module.conn, chunks, response, calibrate=True).run()
+            return chunks
+        except Exception as error:
+            self.logging.error(f"could not upload the payload: {error}")
+            return False
+
+    async def _update_canvas(self, target):
+        """sends only the pixels of target which differ from the canvas
+
+        Returns None if the canvas is unknown or a full upload would be cheaper.
+        """
+        framebuffer = self.framebuffer()
+        with timing.span("encode"):
+            changed = framebuffer.diff(target)
+            cheaper = changed is not None and framebuffer.cheaper_as_pixels(
+                changed, target, transport.write_size(self.conn)
+            )
+        if not cheaper:
+            return None
+        self.logging.info(f"sending {len(changed)} changed pixels instead of a full image")
+        result = await self._module(Graffiti).setPixels(changed)
+        if result is False:
+            framebuffer.invalidate()
+        else:
+            framebuffer.update(target)
+        return result
+
+    async def _upload_canvas(self, target):
+        """uploads target as png to the DIY canvas the device already shows"""
+        from core.framebuffer import encode_png
+
+        self.logging.info("sending the whole canvas as image")
+        with timing.span("encode"):
+            data = self._module(Image)._createPayloads(encode_png(target))
+        await Transfer(self.conn, [data], response=False, calibrate=True).run()
+        self.framebuffer().update(target)
+        return data
 
     def add_arguments(self, parser):
+        self.parser = parser
         # scan
         parser.add_argument(
             "--scan",
@@ -47,8 +421,12 @@ class CMD:
         parser.add_argument(
             "--set-time",
             action="store",
-            help="optionally set time to sync to device (use with --sync-time)",
-            default=datetime.now().strftime("%d-%m-%Y-%H:%M:%S"),
+            help="optionally set time to sync to device (use with --sync-time). Defaults to the current time.",
+        )
+        parser.add_argument(
+            "--sync-align",
+            action="store_true",
+            help="waits for the next full second before syncing the current time, so the device clock starts in step with this one (use with --sync-time)",
         )
         # device screen rotation
         parser.add_argument(
@@ -169,6 +547,138 @@ class CMD:
             action="store",
             help="processes the gif instead of sending it raw (useful when the size does not match). Format: <AMOUNT_PIXEL>",
         )
+        parser.add_argument(
+            "--gif-max-frames",
+            action="store",
+            type=int,
+            help="drops the frames of --process-gif after this many. Format: <AMOUNT_FRAMES>",
+        )
+        parser.add_argument(
+            "--gif-max-fps",
+            action="store",
+            type=float,
+            help="drops frames of --process-gif to show at most this many per second, the time of dropped frames goes to the previous one. Format: <FPS>",
+        )
+        parser.add_argument(
+            "--no-gif-optimize",
+            action="store_true",
+            help="sends --process-gif frames as they are, without merging duplicates and shrinking the palette",
+        )
+        parser.add_argument(
+            "--gif-crop",
+            action="store_true",
+            help="lets the gif optimizer crop frames to the changed region and make unchanged pixels transparent (experimental, not verified on all panels)",
+        )
+        parser.add_argument(
+            "--max-upload-bytes",
+            action="store",
+            type=int,
+            help="reduces the colors, frame rate and frame count of --set-gif until the upload fits this many bytes, choosing what looks closest to the original. Format: <BYTES>",
+        )
+        parser.add_argument(
+            "--max-upload-seconds",
+            action="store",
+            type=float,
+            help="like --max-upload-bytes for the estimated transfer time to the device (see --dry-run). Format: <SECONDS>",
+        )
+        # live frames
+        parser.add_argument(
+            "--stream",
+            action="store",
+            help="plays the frames of a gif (or any image) rendered on this host on the DIY canvas, every frame sent as changed pixels or full image, whichever is cheaper. Frames are skipped when the device does not keep up. Resized to --process-image pixels if given. Format: ./path/to/image.gif",
+        )
+        parser.add_argument(
+            "--stream-fps",
+            action="store",
+            type=float,
+            help="target frame rate of --stream. Defaults to 10.",
+            default=10,
+        )
+        # music sync
+        parser.add_argument(
+            "--music-sync",
+            action="store",
+            help="shows the spectrum of local audio as bars on the DIY canvas until it ends: a wav file (played in real time), a raw pcm file or named pipe, or - for stdin (raw pcm is signed 16 bit little endian, e.g. from arecord -t raw). Drawn for --process-image pixels (default 32). Format: ./path/to/audio.wav",
+        )
+        parser.add_argument(
+            "--music-rate",
+            action="store",
+            type=int,
+            help="sample rate of raw pcm for --music-sync. Defaults to 44100.",
+            default=44100,
+        )
+        parser.add_argument(
+            "--music-channels",
+            action="store",
+            type=int,
+            help="channels of raw pcm for --music-sync. Defaults to 1.",
+            default=1,
+        )
+        parser.add_argument(
+            "--music-fps",
+            action="store",
+            type=float,
+            help="frames per second of --music-sync. Defaults to 20.",
+            default=20,
+        )
+        parser.add_argument(
+            "--music-bands",
+            action="store",
+            type=int,
+            help="frequency bands (bars) of --music-sync. Defaults to 16.",
+            default=16,
+        )
+        parser.add_argument(
+            "--music-latency",
+            action="store",
+            type=float,
+            help="audio to display latency in ms which --music-sync should stay below, a warning is logged otherwise. Defaults to 150.",
+            default=150,
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="uploads --set-image or --set-gif even if the device shows the same content already",
+        )
+        parser.add_argument(
+            "--compile-idm",
+            action="store",
+            help="processes --set-gif or --set-image (with --process-gif/--process-image) into a precompiled payload file instead of uploading it. --set-gif/--set-image accept the file afterwards and send it without any processing. Format: ./path/to/file.idm",
+        )
+        parser.add_argument(
+            "--precompile-dir",
+            action="store",
+            help="processes every gif and png in a directory for every --sizes pixel size into the processed-asset cache, on all cores. Unchanged files are skipped. Format: ./path/to/images",
+        )
+        parser.add_argument(
+            "--sizes",
+            action="store",
+            default="32",
+            help="pixel sizes of --precompile-dir (default: 32). Format: 16,32,64",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="processes --set-gif, --set-image or --set-text like an upload and reports the payload size, the chunk count and the estimated transfer time per device without connecting",
+        )
+        # timings
+        parser.add_argument(
+            "--timings",
+            action="store",
+            help="records the time of every phase (connect, process, encode, send, ack) and appends it as json lines, or writes prometheus metrics if the path ends with .prom. Format: ./path/to/timings.jsonl",
+        )
+        parser.add_argument(
+            "--transport",
+            action="store",
+            choices=transport.MODES,
+            help="how uploads are written: response (default, or IDOTMATRIX_TRANSPORT) writes like the idotmatrix library, windowed only waits for every few writes, no-response never waits, auto uses windowed writes and falls back to response writes if the device does not keep up",
+        )
+        # batch script
+        parser.add_argument(
+            "--script",
+            action="store",
+            help="runs the operations of a json lines file in order over a single connection. Format: ./path/to/script.jsonl",
+        )
         # text upload
         parser.add_argument(
             "--set-text",
@@ -287,10 +797,39 @@ class CMD:
 
     async def run(self, args):
         self.logging.info("initializing command line")
-        address = None
         if args.scan:
-            await self.conn.scan()
+            await devices.discover()
             quit()
+        if args.compile_idm:
+            # runs offline, no device needed
+            await self.compile_idm(args)
+            return
+        if args.precompile_dir:
+            # runs offline, no device needed
+            self.precompile_dir(args)
+            return
+        self.check_script(args)
+        if args.dry_run:
+            await self.dry_run(args)
+            return
+        addresses = devices.resolve(self.address(args))
+        with timing.recording(args.timings):
+            if len(addresses) > 1:
+                await self.fan_out(addresses, args)
+            else:
+                with timing.labels(device=addresses[0]):
+                    with timing.span("connect"):
+                        await self.connect(addresses[0])
+                    if self.startup:
+                        self.startup.mark("connect")
+                    with timing.span("command"):
+                        await self.execute(args)
+        if self.startup:
+            self.startup.mark("command")
+
+    def address(self, args):
+        """returns the --address or IDOTMATRIX_ADDRESS value"""
+        address = None
         if args.address:
             self.logging.debug("using --address")
             address = args.address
@@ -300,99 +839,270 @@ class CMD:
         if address is None:
             self.logging.error("no device address given")
             quit()
-        elif str(address).lower() == "auto":
-            await self.conn.connectBySearch()
+        return address
+
+    async def connect(self, address):
+        """connects to the device with the given address (or the first one found for "auto")
+
+        Addresses starting with "emulator" connect to an in-process emulated device.
+        """
+        if str(address).lower() == "auto":
+            await self.connect_auto()
+        elif str(address).lower().startswith("emulator"):
+            # numpy is only needed by the emulator
+            from core import emulator
+
+            self.conn.address = address
+            self.conn.client = emulator.client(address)
+            await self.conn.connect()
         else:
             await self.conn.connectByAddress(address)
+
+    async def connect_auto(self):
+        """connects to the strongest device of the discovery cache, scans only if that fails"""
+        cached = devices.load_discovered()
+        if cached:
+            address = cached[0]["address"]
+            self.logging.debug(f"using cached device {address} (rssi {cached[0]['rssi']})")
+            try:
+                await self.conn.connectByAddress(address)
+                return
+            except Exception as error:
+                self.logging.info(f"could not connect to cached device {address}: {error}")
+                self.conn.client = None
+        found = await devices.discover()
+        if not found:
+            self.logging.error("no target devices found.")
+            return
+        await self.conn.connectByAddress(found[0]["address"])
+
+    async def fan_out(self, addresses, args):
+        """runs the requested operations on all given devices concurrently"""
+        self.logging.info(f"sending to {len(addresses)} devices")
+        results = await asyncio.gather(
+            *(self._execute_on(address, args) for address in addresses)
+        )
+        for result in results:
+            if result["ok"]:
+                self.logging.info(f"{result['address']}: done in {result['elapsed']}s")
+            else:
+                self.logging.error(
+                    f"{result['address']}: failed after {result['elapsed']}s: {result['error']}"
+                )
+        succeeded = len([result for result in results if result["ok"]])
+        self.logging.info(f"{succeeded} of {len(results)} devices succeeded")
+        return results
+
+    async def _execute_on(self, address, args):
+        """runs the requested operations on a single device of a fan out"""
+        device = self.devices.get(address)
+        if device is None:
+            device = self.devices[address] = CMD(devices.DeviceConnection(address))
+            device.parser = self.parser
+        started = time.perf_counter()
+        result = {"address": address, "ok": True}
+        try:
+            with timing.labels(device=address):
+                with timing.span("connect"):
+                    await device.connect(address)
+                # the handlers change args (weather, calendar), so every device gets its own copy
+                with timing.span("command"):
+                    if await device.execute(copy.copy(args)) is False:
+                        result.update(ok=False, error="the device module reported an error")
+        except SystemExit:
+            # the handlers quit() on invalid arguments
+            result.update(ok=False, error="invalid arguments")
+        except Exception as error:
+            result.update(ok=False, error=str(error) or type(error).__name__)
+        result["elapsed"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def slot(self, args):
+        """returns what the operations of args change on the device, used by the daemon
+        queue to replace older requests for the same slot (None if they must never be replaced)
+        """
+        if args.slot:
+            return args.slot
+        if args.toggle_screen_freeze or args.script or args.test:
+            # toggles and sequences do not have a final state a newer request could replace
+            return None
+        settings = {
+            "time": args.sync_time,
+            "flip": args.flip_screen,
+            "screen": args.screen,
+            "brightness": args.set_brightness,
+            "password": args.set_password,
+            "reset": args.reset,
+        }
+        slots = [name for name, value in settings.items() if value]
+        if any(
+            (
+                args.chronograph,
+                args.clock,
+                args.countdown,
+                args.fullscreen_color,
+                args.pixel_color,
+                args.scoreboard,
+                args.image,
+                args.set_gif,
+                args.set_text,
+                args.stream,
+                args.music_sync,
+                args.weather_image_query,
+                args.weather_gif_query,
+                args.calendar_current,
+                args.calendar_next,
+                args.calendar_today,
+            )
+        ):
+            slots.append("display")
+        return "+".join(slots) or None
+
+    def check_script(self, args):
+        """quits if --script is combined with another operation, which would run instead of it"""
+        if not args.script:
+            return
+        operations = (
+            "sync_time", "flip_screen", "toggle_screen_freeze", "screen", "set_brightness",
+            "set_password", "reset", "test", "chronograph", "clock", "countdown",
+            "fullscreen_color", "pixel_color", "scoreboard", "image", "set_gif", "set_text",
+            "stream", "music_sync", "weather_image_query", "weather_gif_query",
+            "calendar_current", "calendar_next", "calendar_today",
+        )
+        combined = [name for name in operations if getattr(args, name, None)]
+        if combined:
+            options = ", ".join("--" + name.replace("_", "-") for name in combined)
+            self.logging.error(f"--script cannot be combined with {options}")
+            quit()
+
+    async def execute(self, args):
+        """runs the requested operations over the current connection"""
+        self.check_script(args)
+        with transport.using(args.transport):
+            return await self._execute(args)
+
+    async def _execute(self, args):
+        """runs the operations of args, returns False if one of them failed"""
         # arguments which can be run in parallel
+        results = []
         if args.sync_time:
-            await self.sync_time(args.set_time)
+            results.append(await self.sync_time(args.set_time, args.sync_align))
         if args.flip_screen:
-            await self.flip_screen(args.flip_screen)
+            results.append(await self.flip_screen(args.flip_screen))
         if args.toggle_screen_freeze:
-            await self.toggle_screen_freeze()
+            results.append(await self.toggle_screen_freeze())
         if args.screen:
-            await self.screen(args.screen)
+            results.append(await self.screen(args.screen))
         if args.set_brightness:
-            await self.set_brightness(int(args.set_brightness))
+            results.append(await self.set_brightness(int(args.set_brightness)))
         if args.set_password:
-            await self.set_password(args.set_password)
+            results.append(await self.set_password(args.set_password))
         if args.reset:
-            await self.reset(args)
+            results.append(await self.reset(args))
+        result = await self._execute_exclusive(args)
+        return False if False in results else result
+
+    async def _execute_exclusive(self, args):
         # arguments which cannot run in parallel
         if args.test:
-            await self.test()
+            return await self.test()
         elif args.chronograph:
-            await self.chronograph(args.chronograph)
+            return await self.chronograph(args.chronograph)
         elif args.clock:
-            await self.clock(args)
+            return await self.clock(args)
         elif args.countdown:
-            await self.countdown(args)
+            return await self.countdown(args)
         elif args.fullscreen_color:
-            await self.fullscreenColor(args.fullscreen_color)
+            return await self.fullscreenColor(args.fullscreen_color)
         elif args.pixel_color:
-            await self.pixelColor(args.pixel_color)
+            return await self.pixelColor(args.pixel_color)
         elif args.scoreboard:
-            await self.scoreboard(args.scoreboard)
+            return await self.scoreboard(args.scoreboard)
         elif args.image:
-            await self.image(args)
+            return await self.image(args)
         elif args.set_gif:
-            await self.gif(args)
+            return await self.gif(args)
         elif args.set_text:
-            await self.text(args)
+            return await self.text(args)
+        elif args.stream:
+            return await self.stream_file(args)
+        elif args.music_sync:
+            return await self.music_sync(args)
         elif args.weather_image_query:
-            await self.weather_image_query(args)
+            return await self.weather_image_query(args)
         elif args.weather_gif_query:
-            await self.weather_gif_query(args)
+            return await self.weather_gif_query(args)
         elif args.calendar_current:
-            await self.calendar_current(args)
+            return await self.calendar_current(args)
         elif args.calendar_next:
-            await self.calendar_next(args)
+            return await self.calendar_next(args)
         elif args.calendar_today:
-            await self.calendar_today(args)
+            return await self.calendar_today(args)
+        elif args.script:
+            return await self.run_script(args)
 
     async def test(self):
         """Tests all available options for the device"""
         self.logging.info("starting test of device")
         ## chronograph
-        await Chronograph().setMode(1)
+        await self._module(Chronograph).setMode(1)
         time.sleep(5)
-        await Chronograph().setMode(0)
+        await self._module(Chronograph).setMode(0)
         time.sleep(1)
         ## clock
-        await Clock().setTimeIndicator(True)
-        await Clock().setMode(0, True, True)
+        await self._module(Clock).setTimeIndicator(True)
+        await self._module(Clock).setMode(0, True, True)
         time.sleep(5)
         ## countdown
-        await Countdown().setMode(1, 0, 5)
+        await self._module(Countdown).setMode(1, 0, 5)
         time.sleep(5)
-        await Countdown().setMode(0, 0, 5)
+        await self._module(Countdown).setMode(0, 0, 5)
         ## fullscreen color
-        await FullscreenColor().setMode(255, 0, 0)
+        await self._module(FullscreenColor).setMode(255, 0, 0)
         time.sleep(5)
         ## scoreboard
-        await Scoreboard().setMode(1, 0)
+        await self._module(Scoreboard).setMode(1, 0)
         time.sleep(1)
-        await Scoreboard().setMode(1, 1)
+        await self._module(Scoreboard).setMode(1, 1)
         time.sleep(1)
-        await Scoreboard().setMode(1, 2)
+        await self._module(Scoreboard).setMode(1, 2)
         time.sleep(1)
-        await Scoreboard().setMode(2, 2)
+        await self._module(Scoreboard).setMode(2, 2)
         ## graffiti
         # load graffiti board and color pixel 0,0 red
-        await Graffiti().setPixel(255, 0, 0, 0, 0)
+        await self._module(Graffiti).setPixel(255, 0, 0, 0, 0)
         # load graffitti board and color pixel 1,1 green
-        await Graffiti().setPixel(0, 255, 0, 1, 1)
+        await self._module(Graffiti).setPixel(0, 255, 0, 1, 1)
         # load graffitti board and color pixel 2,2 blue
-        await Graffiti().setPixel(0, 0, 255, 2, 2)
+        await self._module(Graffiti).setPixel(0, 0, 255, 2, 2)
         time.sleep(5)
         ## diy image (png)
-        await Image().setMode(1)
-        await Image().uploadUnprocessed("./images/demo_32.png")
+        await self._module(Image).setMode(1)
+        await self._module(Image).uploadUnprocessed("./images/demo_32.png")
+
+    async def run_script(self, args):
+        """runs the operations of a --script file in order over the current connection"""
+        steps = script.load(args.script, self.parser)
+        self.logging.info(f"running script {args.script} with {len(steps)} steps")
+        result = None
+        for number, (step, delay) in enumerate(steps, start=1):
+            if step is not None:
+                started = time.perf_counter()
+                result = await self.execute(step)
+                self.logging.info(
+                    f"step {number} of {len(steps)} done in {time.perf_counter() - started:.3f}s"
+                )
+            if delay > 0:
+                # a more important daemon job does not have to wait for the delay
+                await jobs.sleep(delay)
+        return result
 
-    async def sync_time(self, argument):
+    async def sync_time(self, argument, align=False):
         """Synchronize local time to device"""
         self.logging.info("starting to synchronize time")
+        if argument is None:
+            # taken right before sending and compensated for the round trip
+            return await TimeSync(self.conn).sync(align=align)
         try:
             date = datetime.strptime(argument, "%d-%m-%Y-%H:%M:%S")
         except ValueError:
@@ -400,7 +1110,7 @@ class CMD:
                 "wrong format of --set-time: please use dd-mm-YYYY-HH-MM-SS"
             )
             quit()
-        await Common().setTime(
+        return await self._module(Common).setTime(
             date.year,
             date.month,
             date.day,
@@ -409,52 +1119,53 @@ class CMD:
             date.second,
         )
 
-    async def flip_screen(self, argument: str) -> None:
+    async def flip_screen(self, argument: str):
         """flip device screen 180 degrees"""
         self.logging.info("flipping screen")
-        await Common().flipScreen(argument.upper() == "TRUE")
+        return await self._module(Common).flipScreen(argument.upper() == "TRUE")
 
-    async def toggle_screen_freeze(self) -> None:
+    async def toggle_screen_freeze(self):
         """toggles the screen freeze"""
         self.logging.info("toggling screen freeze")
-        await Common().freezeScreen()
+        return await self._module(Common).freezeScreen()
 
-    async def screen(self, argument: str) -> None:
+    async def screen(self, argument: str):
         """turns the screen on or off"""
         if argument.upper() == "ON":
             self.logging.info("turning screen on")
-            await Common().screenOn()
+            return await self._module(Common).screenOn()
         else:
             self.logging.info("turning screen off")
-            await Common().screenOff()
+            self.forget_canvas()
+            return await self._module(Common).screenOff()
 
-    async def set_brightness(self, argument: int) -> None:
+    async def set_brightness(self, argument: int):
         """sets the brightness of the screen"""
         if argument in range(5, 101):
             self.logging.info(f"setting brightness of the screen: {argument}%")
-            await Common().setBrightness(argument)
-        else:
-            self.logging.error("brightness out of range (should be between 5 and 100)")
+            return await self._module(Common).setBrightness(argument)
+        self.logging.error("brightness out of range (should be between 5 and 100)")
+        return False
 
-    async def set_password(self, argument: str) -> None:
+    async def set_password(self, argument: str):
         """sets connection password"""
         try:
             conv_password = int(argument)
             if len(argument) == 6 and conv_password in range(0, 1000000):
                 self.logging.info(f"setting password: {argument}")
-                await Common().setPassword(conv_password)
-            else:
-                self.logging.error(
-                    f"Password should be 6 digits long and in range 000000...999999"
-                )
+                return await self._module(Common).setPassword(conv_password)
+            self.logging.error(
+                f"Password should be 6 digits long and in range 000000...999999"
+            )
         except ValueError:
             self.logging.error(f"Invalid integer: {argument}")
+        return False
 
     async def chronograph(self, argument):
         """sets the chronograph mode"""
         self.logging.info("setting chronograph mode")
         if int(argument) in range(0, 4):
-            await Chronograph().setMode(int(argument))
+            await self._module(Chronograph).setMode(int(argument))
         else:
             self.logging.error("wrong argument for chronograph mode")
             quit()
@@ -467,7 +1178,7 @@ class CMD:
             if len(color) < 3:
                 self.logging.error("wrong argument for --clock-color")
                 quit()
-            await Clock().setMode(
+            await self._module(Clock).setMode(
                 style=int(args.clock),
                 visibleDate=args.clock_with_date,
                 hour24=args.clock_24h,
@@ -506,7 +1217,7 @@ class CMD:
                 "wrong argument for --countdown-time - time cannot be zero"
             )
             quit()
-        await Countdown().setMode(
+        await self._module(Countdown).setMode(
             mode=mode,
             minutes=minutes,
             seconds=seconds,
@@ -519,7 +1230,7 @@ class CMD:
         if len(color) != 3:
             self.logging.error("wrong argument for --fullscreen-color")
             quit()
-        await FullscreenColor().setMode(
+        await self._module(FullscreenColor).setMode(
             int(color[0]),
             int(color[1]),
             color[2],
@@ -536,7 +1247,8 @@ class CMD:
         for params in argument:
             for pixel in params:
                 pixels.append(pixel)
-        # validate all pixels and send them
+        # validate all pixels
+        parsed = []
         for pixel in pixels:
             split = pixel.split("-")
             # check if we got all data
@@ -545,16 +1257,30 @@ class CMD:
                     "need exactly 5 arguments for a single pixel in --pixel-color"
                 )
                 quit()
-            # TODO: proper check if we are within the pixel range of the device
-            # TODO: maybe we can use a delimiter to make use of the MTU size (sending chunks instead of separate requests)
-            # TODO: when filling 32x32 pixels it seems to have trouble to send all pixels. One pixel will be "forgotten" somehow
-            await Graffiti().setPixel(
-                x=int(split[0]),
-                y=int(split[1]),
-                r=int(split[2]),
-                g=int(split[3]),
-                b=int(split[4]),
-            )
+            try:
+                parsed.append(tuple(int(value) for value in split))
+            except ValueError:
+                self.logging.error(f"pixel {pixel} of --pixel-color is not a number")
+                return False
+        # the shadow knows the size of the canvas, otherwise the largest panel is the limit
+        framebuffer = self.framebuffer()
+        size = framebuffer.pixels.shape[0] if framebuffer.valid else MAX_PIXEL_SIZE
+        for x, y, r, g, b in parsed:
+            if not (0 <= x < size and 0 <= y < size):
+                self.logging.error(f"pixel {x}-{y} of --pixel-color is outside of the {size}x{size} canvas")
+                return False
+            if not all(0 <= color <= 255 for color in (r, g, b)):
+                self.logging.error(f"color {r}-{g}-{b} of --pixel-color is not within 0-255")
+                return False
+        # with a known canvas only the changed pixels (or a full image) are sent
+        target = framebuffer.paint(parsed)
+        if target is not None:
+            result = await self._update_canvas(target)
+            if result is None:
+                result = await self._upload_canvas(target)
+            return result
+        # send them batched by color in as few (acknowledged) writes as possible
+        return await self._module(Graffiti).setPixels(parsed)
 
     async def scoreboard(self, argument):
         """sets given score on the scoreboard and shows it"""
@@ -569,52 +1295,137 @@ class CMD:
         if int(scores[0]) > 999 or int(scores[1]) > 999:
             self.logging.error("exceeded maximum value of 999 for --scoreboard")
             quit()
-        await Scoreboard().setMode(
+        await self._module(Scoreboard).setMode(
             count1=int(scores[0]),
             count2=int(scores[1]),
         )
 
     async def image(self, args):
         """enables or disables the image mode and uploads a given image file"""
+        from core.framebuffer import load_pixels
+
         self.logging.info("setting image")
-        image = Image()
         if args.image == "false":
-            await image.setMode(
+            self.forget_canvas()
+            return await self._module(Image).setMode(
                 mode=0,
             )
         else:
-            await image.setMode(
-                mode=1,
-            )
+            framebuffer = self.framebuffer()
+            payload = digest = target = None
             if args.set_image:
-                if args.process_image:
-                    await image.uploadProcessed(
-                        file_path=args.set_image,
-                        pixel_size=int(args.process_image),
-                    )
-                else:
-                    await image.uploadUnprocessed(
-                        file_path=args.set_image,
-                    )
+                payload, digest = await self._prepare(Image, args.set_image, args.process_image)
+                if payload is False:
+                    return False
+                if self._already_shown(digest, args.force):
+                    return payload
+                if not idm.is_idm(args.set_image):
+                    with timing.span("process"):
+                        if args.process_image:
+                            # the processed png has the pixels already, no need to resize the source again
+                            target = load_pixels(io.BytesIO(image_data(payload)))
+                        else:
+                            target = load_pixels(args.set_image)
+                if target is not None and framebuffer.valid:
+                    # the device shows the canvas already, maybe some pixels are enough
+                    result = await self._update_canvas(target)
+                    if result is not None:
+                        if result is not False:
+                            self.uploads().remember(digest)
+                        return result
+            image = self._module(Image)
+            # the mode switch is part of the transfer, so a retry sends it again
+            detached = Image()
+            detached.conn = None
+            chunks = [await detached.setMode(mode=1)]
+            if payload is not None:
+                chunks.append(payload)
+            result = await self._send_payload(image, chunks, response=False)
+            if result is not False:
+                result = chunks[-1]
+            if target is None or result is False:
+                framebuffer.invalidate()
+            else:
+                framebuffer.update(target)
+            if digest is not None and result is not False:
+                self.uploads().remember(digest)
+            return result
 
     async def gif(self, args):
         """enables or disables the gif mode and uploads a given gif file"""
         self.logging.info("setting (animated) GIF")
-        gif = Gif()
-        if args.process_gif:
-            await gif.uploadProcessed(
-                file_path=args.set_gif,
-                pixel_size=int(args.process_gif),
+        payload, digest = await self._prepare(Gif, args.set_gif, args.process_gif, self.gif_options(args))
+        if payload is False:
+            return False
+        payload, digest = await self._fit_budget(args, payload, digest, self.conn.address)
+        if self._already_shown(digest, args.force):
+            return payload
+        gif = self._module(Gif)
+        result = await self._send_payload(gif, payload, response=True)
+        if result is not False:
+            self.uploads().remember(digest)
+        return result
+
+    async def stream(self, frames, fps=10, pixel_size=None):
+        """streams frames (PIL images or numpy arrays) from an iterable or async iterable
+        to the DIY canvas at fps frames per second and returns the report of core.stream.FrameStream
+        """
+        from core.stream import FrameStream
+
+        return await FrameStream(self, fps, pixel_size).play(frames)
+
+    async def stream_file(self, args):
+        """plays the frames of an image file through stream()"""
+        from PIL import Image as PilImage
+        from PIL import ImageSequence
+
+        def frames():
+            with PilImage.open(args.stream) as img:
+                for frame in ImageSequence.Iterator(img):
+                    yield frame.convert("RGB")
+
+        self.logging.info(f"streaming {args.stream} at {args.stream_fps:g} fps")
+        try:
+            return await self.stream(
+                frames(),
+                args.stream_fps,
+                int(args.process_image) if args.process_image else None,
             )
-        else:
-            await gif.uploadUnprocessed(
-                file_path=args.set_gif,
+        except (OSError, ValueError) as error:
+            self.logging.error(f"could not stream {args.stream}: {error}")
+            return False
+
+    async def music_sync(self, args):
+        """shows the spectrum of a wav file or pcm pipe on the DIY canvas"""
+        from core import audio
+
+        self.logging.info(f"showing the spectrum of {args.music_sync}")
+        try:
+            source = audio.open_source(args.music_sync, args.music_rate, args.music_channels)
+            sync = audio.SpectrumSync(
+                self,
+                int(args.process_image) if args.process_image else 32,
+                args.music_fps,
+                args.music_bands,
+                args.music_latency,
             )
+            return await sync.run(source)
+        except (OSError, ValueError, EOFError, wave.Error) as error:
+            self.logging.error(f"could not sync to {args.music_sync}: {error}")
+            return False
 
     async def text(self, args):
         """sets the given text on the device"""
         self.logging.info("setting text")
-        text = Text()
+        text = self._module(Text)
+        # rendering and sending the text happen in one call of the library
+        with timing.span("upload") as span:
+            result = await text.setMode(**self._text_options(args))
+            span.bytes = len(result) if result else 0
+        return result
+
+    def _text_options(self, args):
+        """returns the arguments of Text.setMode for --set-text"""
         text_color = args.text_color.split("-")
         if len(text_color) != 3:
             self.logging.error("wrong argument for --text-color")
@@ -623,7 +1434,7 @@ class CMD:
         if len(bg_color) != 3:
             self.logging.error("wrong argument for --text-bg-color")
             quit()
-        await text.setMode(
+        return dict(
             text=args.set_text,
             font_size=args.text_size,
             font_path=args.text_font_path,
@@ -642,6 +1453,8 @@ class CMD:
             bytes(bytearray.fromhex("04 00 03 80")),
             bytes(bytearray.fromhex("05 00 04 80 50")),
             ]
+        self.forget_canvas()
+        self.uploads().forget()
         for packet in reset_packets:
             await self.conn.send(packet)
 
@@ -654,6 +1467,8 @@ class CMD:
             return
 
         try:
+            from utils import utils
+
             img_path = utils.get_weather_img(args.weather_image_query, api_key, int(pixels))
         except Exception as e:
             self.logging.error(f"failed to get weather info or make weather image: {e}")
@@ -661,7 +1476,7 @@ class CMD:
 
         setattr(args, 'image', 'on')
         setattr(args, 'set_image', img_path)
-        await self.image(args)
+        return await self.image(args)
 
 
     async def weather_gif_query(self, args):
@@ -673,13 +1488,15 @@ class CMD:
             return
 
         try:
+            from utils import utils
+
             gif_path = utils.get_weather_gif(args.weather_gif_query, api_key, int(pixels))
         except Exception as e:
             self.logging.error(f"failed to get weather info or make weather gif: {e}")
             return
 
         setattr(args, 'set_gif', gif_path)
-        await self.gif(args)
+        return await self.gif(args)
 
     async def calendar_current(self, args):
         """Display current meeting from Google Calendar"""
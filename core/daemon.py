@@ -0,0 +1,239 @@
+# python imports
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import logging
+import os
+import time
+
+# idotmatrix imports
+from core import api
+from core import client
+from core import devices
+from core import jobs
+from core import timing
+
+
+class RequestLog(logging.Handler):
+    """collects the log records of a single daemon request"""
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.setFormatter(
+            logging.Formatter("%(levelname)s :: %(name)s :: %(message)s")
+        )
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class Daemon:
+    """keeps the device connection open and runs CMD operations sent over a unix domain socket.
+
+    The protocol is one JSON object per line in both directions. A request
+    contains the app.py arguments, e.g. {"args": ["--set-brightness", "50"]},
+    the response contains "ok", "elapsed" (seconds), "timings", "log" and
+    optionally "error". With --http the same operations are also served as
+    HTTP endpoints (see core.api.HttpApi).
+
+    Device commands wait in a priority queue per device (see core.jobs.JobQueue):
+    --priority lets a command interrupt a less important upload at the next
+    chunk boundary and a newer command for the same slot replaces a queued one,
+    whose response then contains "superseded".
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, cmd, parser, socket_path=None):
+        self.cmd = cmd
+        self.parser = parser
+        self.socket_path = socket_path or client.socket_path()
+        # the shared connection only handles one operation at a time
+        self.lock = asyncio.Lock()
+        # one queue per device (or list of devices)
+        self.queues = {}
+        # --timings given when starting the daemon
+        self.timings = None
+
+    async def serve(self, args):
+        """connects to the device and answers requests until cancelled"""
+        # the device(s) used by requests without --address
+        self.addresses = devices.resolve(self.cmd.address(args))
+        self.timings = args.timings
+        if len(self.addresses) == 1:
+            await self.cmd.connect(self.addresses[0])
+        if os.path.exists(self.socket_path):
+            # left behind by a daemon which did not shut down cleanly
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        self.logging.info(f"daemon listening on {self.socket_path}")
+        http = None
+        if args.http:
+            http = await api.HttpApi(self).start(args.http)
+        resync = None
+        if args.sync_interval:
+            resync = asyncio.ensure_future(self.resync(args.sync_interval, args.sync_align))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if resync is not None:
+                resync.cancel()
+            if http is not None:
+                http.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            await self.cmd.conn.disconnect()
+            for device in self.cmd.devices.values():
+                await device.conn.disconnect()
+
+    async def handle(self, reader, writer):
+        """answers all requests of one client connection"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.process(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError as error:
+            self.logging.debug(f"client went away: {error}")
+        finally:
+            writer.close()
+
+    async def process(self, line):
+        """runs a single request and returns its response"""
+        started = time.perf_counter()
+        try:
+            argv = [str(arg) for arg in json.loads(line)["args"]]
+        except (ValueError, KeyError, TypeError) as error:
+            return {"ok": False, "error": f"invalid request: {error}"}
+        try:
+            args = self.parse(argv)
+        except ValueError as error:
+            return {"ok": False, "error": str(error)}
+        return await self.submit(args, argv, started)
+
+    def parse(self, argv):
+        """parses app.py arguments, raises ValueError with the usage error"""
+        usage = io.StringIO()
+        try:
+            with contextlib.redirect_stderr(usage):
+                return self.parser.parse_args(argv)
+        except SystemExit:
+            # only keep the "error: ..." line of the usage message
+            raise ValueError(usage.getvalue().strip().splitlines()[-1]) from None
+
+    async def submit(self, args, argv, started=None):
+        """queues parsed arguments for their device(s) and returns the response once they ran"""
+        started = started or time.perf_counter()
+        if args.scan or args.compile_idm or args.precompile_dir or args.dry_run:
+            if args.dry_run and not args.address:
+                # estimate for the devices of the daemon
+                args.address = ",".join(self.addresses)
+            response = await self.run(args)
+        else:
+            addresses = devices.resolve(args.address) if args.address else self.addresses
+            key = ",".join(addresses)
+            queue = self.queues.get(key)
+            if queue is None:
+                queue = self.queues[key] = jobs.JobQueue(key)
+            job = jobs.Job(
+                lambda: self.run(copy.copy(args), addresses),
+                priority=args.priority,
+                slot=self.cmd.slot(args),
+                name=" ".join(argv),
+            )
+            response = await queue.submit(job).future
+            if response is None:
+                # a newer request for the same slot was run instead
+                response = {"ok": True, "superseded": str(job.superseded_by), "log": []}
+            if job.preemptions:
+                response["preempted"] = job.preemptions
+        response["elapsed"] = round(time.perf_counter() - started, 3)
+        return response
+
+    async def run(self, args, addresses=None):
+        """runs the operations of a request and returns its response"""
+        request_log = RequestLog()
+        logger = logging.getLogger("idotmatrix")
+        response = {"ok": True}
+        recorder = None
+        try:
+            async with self.lock:
+                # the job may have been preempted while waiting for the connection
+                jobs.checkpoint()
+                logger.addHandler(request_log)
+                # --timings of the daemon itself applies to all requests without their own,
+                # the phases are returned in the response either way
+                with timing.recording(args.timings or self.timings, always=True) as recorder:
+                    if args.scan:
+                        response["devices"] = [
+                            device["address"] for device in await devices.discover()
+                        ]
+                    elif args.compile_idm:
+                        response["ok"] = await self.cmd.compile_idm(args) is not False
+                    elif args.precompile_dir:
+                        # processing a directory takes long, so it runs outside of the event loop
+                        report = await asyncio.get_running_loop().run_in_executor(
+                            None, self.cmd.precompile_dir, args
+                        )
+                        response.update(ok=not report["failed"], report=report)
+                    elif args.dry_run:
+                        response["ok"] = await self.cmd.dry_run(args) is not False
+                    elif len(addresses) > 1:
+                        response["results"] = await self.cmd.fan_out(addresses, args)
+                        response["ok"] = all(result["ok"] for result in response["results"])
+                    else:
+                        with timing.labels(device=addresses[0]):
+                            with timing.span("connect"):
+                                await self.reconnect(addresses[0])
+                            with timing.span("command"):
+                                if await self.cmd.execute(args) is False:
+                                    response.update(ok=False, error="the device module reported an error")
+        except jobs.Preempted:
+            # the device shows a partial upload, so nothing the commands remember is valid
+            for cmd in [self.cmd, *self.cmd.devices.values()]:
+                cmd.forget_canvas()
+                cmd.uploads().forget()
+            raise
+        except SystemExit:
+            # the CMD handlers quit() on invalid arguments
+            response = {"ok": False, "error": "invalid arguments"}
+        except Exception as error:
+            self.logging.error(f"request failed: {error}")
+            response = {"ok": False, "error": str(error)}
+        finally:
+            logger.removeHandler(request_log)
+        if recorder is not None:
+            response["timings"] = recorder.records()
+        response["log"] = request_log.lines
+        return response
+
+    async def resync(self, interval, align):
+        """synchronizes the time of the devices every interval seconds, queued like a request"""
+        request = json.dumps({"args": ["--sync-time"] + (["--sync-align"] if align else [])})
+        while True:
+            response = await self.process(request)
+            if not response["ok"]:
+                self.logging.warning(f"periodic time sync failed: {response.get('error')}")
+            await asyncio.sleep(interval)
+
+    async def reconnect(self, address):
+        """switches to another device if requested and restores a dropped connection"""
+        conn = self.cmd.conn
+        if str(address).lower() == "auto" and conn.address:
+            # keep using the device found before
+            await conn.connect()
+        elif address != conn.address:
+            self.logging.info(f"switching device from {conn.address} to {address}")
+            await conn.disconnect()
+            conn.client = None
+            await self.cmd.connect(address)
+        else:
+            await conn.connect()
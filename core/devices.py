@@ -0,0 +1,148 @@
+# python imports
+import asyncio
+import json
+import logging
+import os
+import time
+
+# idotmatrix imports
+from bleak import AdvertisementData, BleakScanner
+from core import storage
+from core import timing
+from idotmatrix import ConnectionManager
+from idotmatrix.const import BLUETOOTH_DEVICE_NAME, UUID_WRITE_DATA
+
+DEFAULT_GROUPS_PATH = "device_groups.json"
+# how long devices found by a scan are used for --address auto (in seconds)
+DEFAULT_DISCOVERY_TTL = 24 * 60 * 60
+
+log = logging.getLogger("idotmatrix." + __name__)
+
+
+def groups_path():
+    """returns the path of the device groups file (IDOTMATRIX_GROUPS or the default path)"""
+    return os.environ.get("IDOTMATRIX_GROUPS", DEFAULT_GROUPS_PATH)
+
+
+def load_groups(path=None):
+    """loads the device groups, a json object like {"wall": ["00:11:22:33:44:ff", ...]}"""
+    path = path or groups_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def resolve(value, groups=None):
+    """resolves an --address value into a list of addresses
+
+    The value can be a single address, "auto", a group name or a comma
+    separated list of any of them.
+    """
+    if groups is None:
+        groups = load_groups()
+    addresses = []
+    for item in str(value).split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item in groups:
+            addresses.extend(groups[item])
+        else:
+            addresses.append(item)
+    # keep the order, but talk to every device only once
+    return list(dict.fromkeys(addresses))
+
+
+def discovery_ttl():
+    """returns the lifetime of the discovery cache (IDOTMATRIX_DISCOVERY_TTL or the default)"""
+    return float(os.environ.get("IDOTMATRIX_DISCOVERY_TTL", DEFAULT_DISCOVERY_TTL))
+
+
+def load_discovered(ttl=None):
+    """returns the cached devices of the last scan, strongest signal first
+
+    Every device is a dict like {"address": ..., "name": ..., "rssi": -60,
+    "seen": <unix time>}. Devices older than ttl seconds are left out.
+    """
+    path = storage.path("discovery.json")
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r") as file:
+            found = json.load(file)
+    except (OSError, ValueError) as error:
+        log.warning(f"ignoring broken discovery cache {path}: {error}")
+        return []
+    oldest = time.time() - (discovery_ttl() if ttl is None else ttl)
+    found = [device for device in found if device.get("seen", 0) >= oldest]
+    return sorted(found, key=lambda device: device.get("rssi", -127), reverse=True)
+
+
+def save_discovered(found):
+    """replaces the discovery cache with the devices of a scan"""
+    path = storage.path("discovery.json")
+    with open(path + ".tmp", "w") as file:
+        json.dump(found, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+async def discover():
+    """scans for iDotMatrix devices and refreshes the discovery cache
+
+    Returns the devices found (see load_discovered), strongest signal first.
+    """
+    log.info("scanning for iDotMatrix bluetooth devices...")
+    with timing.span("scan"):
+        scanned = await BleakScanner.discover(return_adv=True)
+    seen = time.time()
+    found = []
+    for device, adv in scanned.values():
+        if (
+            isinstance(adv, AdvertisementData)
+            and adv.local_name
+            and str(adv.local_name).startswith(BLUETOOTH_DEVICE_NAME)
+        ):
+            log.info(f"found device {device.address} with name {adv.local_name} (rssi {adv.rssi})")
+            found.append(
+                {
+                    "address": device.address,
+                    "name": adv.local_name,
+                    "rssi": adv.rssi,
+                    "seen": seen,
+                }
+            )
+    found.sort(key=lambda device: device["rssi"], reverse=True)
+    save_discovered(found)
+    return found
+
+
+class _Unshared(type(ConnectionManager)):
+    """skips the singleton behaviour of the ConnectionManager metaclass"""
+
+    def __call__(cls, *args, **kwargs):
+        return type.__call__(cls, *args, **kwargs)
+
+
+class DeviceConnection(ConnectionManager, metaclass=_Unshared):
+    """a ConnectionManager for exactly one device, so several devices can be connected at once"""
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, address=None):
+        super().__init__()
+        self.address = address
+
+    async def send(self, data, response=False):
+        """same as ConnectionManager.send, but does not block the other devices while pausing"""
+        if self.client and self.client.is_connected:
+            self.logging.debug(f"sending message(s) to {self.address}")
+            chunk_size = self.client.services.get_characteristic(
+                UUID_WRITE_DATA
+            ).max_write_without_response_size
+            for i in range(0, len(data), chunk_size):
+                await self.client.write_gatt_char(
+                    UUID_WRITE_DATA, data[i : i + chunk_size], response=response
+                )
+            await asyncio.sleep(0.01)
+            return True
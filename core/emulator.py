@@ -0,0 +1,409 @@
+# python imports
+import asyncio
+import io
+import logging
+import random
+import struct
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy
+from PIL import Image as PilImage
+
+# idotmatrix imports
+from idotmatrix.const import UUID_READ_DATA, UUID_WRITE_DATA
+
+# addresses starting with this prefix are served by the emulator, options can
+# follow separated by colons: emulator-1:size=16:mtu=23:latency=0.01:loss=0.05:drop=0.01:queue=4
+ADDRESS_PREFIX = "emulator"
+DEFAULT_SIZE = 32
+DEFAULT_MTU = 185
+# bytes of an ATT write request which are not payload
+ATT_HEADER_SIZE = 3
+
+# all emulated devices of this process by address
+_devices: Dict[str, "EmulatedDevice"] = {}
+
+
+def is_emulator(address) -> bool:
+    """returns True if the address belongs to an emulated device"""
+    return str(address).lower().startswith(ADDRESS_PREFIX)
+
+
+def parse_options(address: str) -> Dict[str, float]:
+    """returns the options of an emulator address like emulator:size=16:mtu=23"""
+    options = {}
+    for option in str(address).split(":")[1:]:
+        name, _, value = option.partition("=")
+        if name not in ("size", "mtu", "latency", "loss", "drop", "queue", "seed"):
+            raise ValueError(f"unknown emulator option {name}")
+        options[name] = float(value)
+    return options
+
+
+def device(address: str) -> "EmulatedDevice":
+    """returns the emulated device of an address, created on first use"""
+    if address not in _devices:
+        options = parse_options(address)
+        _devices[address] = EmulatedDevice(
+            size=int(options.get("size", DEFAULT_SIZE)),
+            mtu=int(options.get("mtu", DEFAULT_MTU)),
+            latency=options.get("latency", 0.0),
+            loss=options.get("loss", 0.0),
+            drop=options.get("drop", 0.0),
+            queue=int(options.get("queue", 0)),
+            seed=int(options["seed"]) if "seed" in options else None,
+        )
+    return _devices[address]
+
+
+def client(address: str) -> "EmulatedClient":
+    """returns a BleakClient look-alike talking to the emulated device of an address"""
+    return EmulatedClient(address, device(address))
+
+
+class EmulatedWriteError(Exception):
+    """an acknowledged write which the emulated link lost"""
+
+
+class EmulatedDevice:
+    """In-process iDotMatrix device. Decodes the packets written to it into a
+    framebuffer and mode state, so uploads can be checked and benchmarked
+    without a panel.
+
+    The link is simulated with an MTU, a latency per write (acknowledged writes
+    wait for the round trip), a packet loss rate and a rate of dropped
+    connections per write. With a queue, the device only buffers that many
+    writes without response after the last acknowledged one; further writes
+    overflow and are lost, and the next acknowledged write fails. A lost
+    write with response raises
+    EmulatedWriteError like a failed GATT write; a lost write without response
+    is dropped silently and the packets it belonged to are discarded by the
+    device. A new connection starts parsing packets from scratch and drops
+    an unfinished gif or image upload.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(
+        self,
+        size: int = DEFAULT_SIZE,
+        mtu: int = DEFAULT_MTU,
+        latency: float = 0.0,
+        loss: float = 0.0,
+        drop: float = 0.0,
+        queue: int = 0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.size = size
+        self.mtu = mtu
+        self.latency = latency
+        self.loss = loss
+        self.drop = drop
+        self.queue = queue
+        self.random = random.Random(seed)
+        # link statistics
+        self.writes = 0
+        self.bytes = 0
+        self.lost = 0
+        self.discarded = 0
+        self.connections = 0
+        self.drops = 0
+        self.overflows = 0
+        # writes without response since the last acknowledged one
+        self._queued = 0
+        self._overflowed = False
+        self.packets: List[bytes] = []
+        self._buffer = bytearray()
+        self._offset = 0
+        self._lost_ranges: List[Tuple[int, int]] = []
+        self._upload: Optional[bytearray] = None
+        self.reset()
+
+    def reset(self) -> None:
+        """factory state of the device"""
+        self.pixels = numpy.zeros((self.size, self.size, 3), dtype=numpy.uint8)
+        self.mode = "clock"
+        self.brightness = 100
+        self.screen_on = True
+        self.flipped = False
+        self.frozen = False
+        self.clock: Dict[str, int] = {"style": 0, "date": 1, "hour24": 1, "color": (255, 255, 255)}
+        self.time: Optional[Tuple[int, ...]] = None
+        self.text: Dict[str, object] = {}
+        self.gif: Optional[bytes] = None
+        self.gif_frames = 0
+        self.other: Dict[str, bytes] = {}
+
+    @property
+    def write_size(self) -> int:
+        return self.mtu - ATT_HEADER_SIZE
+
+    def state(self) -> Dict[str, object]:
+        """returns a summary of the mode state"""
+        return {
+            "mode": self.mode,
+            "brightness": self.brightness,
+            "screen_on": self.screen_on,
+            "flipped": self.flipped,
+            "clock": self.clock,
+            "text": self.text,
+            "gif_frames": self.gif_frames,
+            "packets": len(self.packets),
+            "writes": self.writes,
+            "bytes": self.bytes,
+            "lost": self.lost,
+            "discarded": self.discarded,
+            "connections": self.connections,
+            "drops": self.drops,
+            "overflows": self.overflows,
+        }
+
+    def connected(self) -> None:
+        """starts a new connection, packets and uploads cut by the old one are gone"""
+        self.connections += 1
+        self._offset += len(self._buffer)
+        self._buffer = bytearray()
+        self._upload = None
+        self._lost_ranges = []
+        self._queued = 0
+        self._overflowed = False
+
+    def dropped(self) -> bool:
+        """decides if the connection drops before the next write"""
+        if self.drop and self.random.random() < self.drop:
+            self.drops += 1
+            return True
+        return False
+
+    async def write(self, data: bytes, response: bool) -> None:
+        """receives one GATT write over the simulated link"""
+        if len(data) > self.write_size:
+            raise ValueError(
+                f"write of {len(data)} bytes exceeds the MTU of {self.mtu} bytes"
+            )
+        if self.latency:
+            await asyncio.sleep(self.latency * (2 if response else 1))
+        self.writes += 1
+        self.bytes += len(data)
+        if response:
+            self._queued = 0
+            if self._overflowed:
+                self._overflowed = False
+                self.receive(data, lost=True)
+                raise EmulatedWriteError("device buffer overflow")
+        elif self.queue:
+            self._queued += 1
+            if self._queued > self.queue:
+                self.overflows += 1
+                self._overflowed = True
+                self.receive(data, lost=True)
+                return
+        lost = self.loss and self.random.random() < self.loss
+        if lost:
+            self.lost += 1
+            if response:
+                raise EmulatedWriteError("write was not acknowledged")
+        self.receive(data, lost=bool(lost))
+
+    def receive(self, data: bytes, lost: bool = False) -> None:
+        """splits the byte stream into packets by their length prefix"""
+        start = self._offset + len(self._buffer)
+        self._buffer.extend(data)
+        if lost:
+            self._lost_ranges.append((start, start + len(data)))
+        while len(self._buffer) >= 4:
+            length = self._packet_length()
+            if length is None or len(self._buffer) < length:
+                break
+            packet = bytes(self._buffer[:length])
+            del self._buffer[:length]
+            end = self._offset + length
+            if any(lo < end and hi > self._offset for lo, hi in self._lost_ranges):
+                self.discarded += 1
+                self.logging.debug(f"discarding packet damaged by a lost write: {packet[:4].hex()}")
+            else:
+                self.handle(packet)
+            self._offset = end
+            self._lost_ranges = [(lo, hi) for lo, hi in self._lost_ranges if hi > end]
+
+    def _packet_length(self) -> Optional[int]:
+        buffer = self._buffer
+        if buffer[2] == 0 and buffer[3] == 0:
+            # image chunks carry the length of the whole png instead of their own
+            if len(buffer) < 9:
+                return None
+            png_length = struct.unpack("<i", buffer[5:9])[0]
+            received = len(self._upload) if self._upload is not None and buffer[4] else 0
+            return 9 + min(4096, png_length - received)
+        # a broken length would never complete, take it as (unknown) 4 byte packet
+        return max(4, int.from_bytes(buffer[0:2], byteorder="little"))
+
+    def handle(self, packet: bytes) -> None:
+        """applies one packet to the device state"""
+        self.packets.append(packet)
+        command = (packet[2], packet[3])
+        if command == (0, 0):
+            self._image_chunk(packet)
+        elif command == (1, 0):
+            self._gif_chunk(packet)
+        elif command == (3, 0) and len(packet) > 4:
+            self._text(packet)
+        elif command == (5, 1):
+            for i in range(8, len(packet) - 1, 2):
+                self._paint(packet[i], packet[i + 1], packet[5:8])
+        elif command == (6, 1):
+            self.mode = "clock"
+            self.clock = {
+                "style": packet[4] & 63,
+                "date": packet[4] >> 7 & 1,
+                "hour24": packet[4] >> 6 & 1,
+                "color": tuple(packet[5:8]),
+            }
+        elif command == (2, 2):
+            self.mode = "color"
+            self.pixels[:, :] = tuple(packet[4:7])
+        elif command == (4, 128):
+            self.brightness = packet[4]
+        elif command == (4, 1):
+            self.mode = "image" if packet[4] else "clock"
+        elif command == (7, 1):
+            self.screen_on = bool(packet[4])
+        elif command == (6, 128):
+            self.flipped = bool(packet[4])
+        elif command == (3, 0):
+            self.frozen = not self.frozen
+        elif command == (3, 128):
+            self.reset()
+        elif command == (1, 128):
+            self.time = tuple(packet[4:11])
+        elif command == (9, 128):
+            self.mode = "chronograph"
+        elif command == (8, 128):
+            self.mode = "countdown"
+        elif command == (10, 128):
+            self.mode = "scoreboard"
+        else:
+            self.logging.debug(f"unknown packet {packet.hex()}")
+            self.other[packet[2:4].hex()] = packet
+
+    def _paint(self, x: int, y: int, color: bytes) -> None:
+        if x < self.size and y < self.size:
+            self.pixels[y, x] = tuple(color)
+
+    def _image_chunk(self, packet: bytes) -> None:
+        png_length = struct.unpack("<i", packet[5:9])[0]
+        if packet[4] == 0 or self._upload is None:
+            self._upload = bytearray()
+        self._upload.extend(packet[9:])
+        if len(self._upload) < png_length:
+            return
+        data, self._upload = bytes(self._upload), None
+        try:
+            with PilImage.open(io.BytesIO(data)) as img:
+                img = img.convert("RGB")
+                if img.size != (self.size, self.size):
+                    self.logging.warning(f"image of {img.size} does not fit the {self.size}px panel")
+                    img = img.resize((self.size, self.size), PilImage.NEAREST)
+                self.pixels = numpy.asarray(img, dtype=numpy.uint8).copy()
+        except (OSError, ValueError) as error:
+            self.logging.warning(f"rejecting broken image: {error}")
+
+    def _gif_chunk(self, packet: bytes) -> None:
+        gif_length = int.from_bytes(packet[5:9], byteorder="little")
+        crc = int.from_bytes(packet[9:13], byteorder="little")
+        if packet[4] == 0 or self._upload is None:
+            self._upload = bytearray()
+        self._upload.extend(packet[16:])
+        if len(self._upload) < gif_length:
+            return
+        data, self._upload = bytes(self._upload), None
+        if len(data) != gif_length or zlib.crc32(data) != crc:
+            self.logging.warning("rejecting gif with wrong length or crc")
+            return
+        try:
+            with PilImage.open(io.BytesIO(data)) as img:
+                self.gif_frames = getattr(img, "n_frames", 1)
+                frame = img.convert("RGB")
+                if frame.size != (self.size, self.size):
+                    frame = frame.resize((self.size, self.size), PilImage.NEAREST)
+                self.pixels = numpy.asarray(frame, dtype=numpy.uint8).copy()
+        except (OSError, ValueError) as error:
+            self.logging.warning(f"rejecting broken gif: {error}")
+            return
+        self.gif = data
+        self.mode = "gif"
+
+    def _text(self, packet: bytes) -> None:
+        length = int.from_bytes(packet[5:9], byteorder="little")
+        crc = int.from_bytes(packet[9:13], byteorder="little")
+        body = packet[16:]
+        if len(body) != length or zlib.crc32(body) != crc:
+            self.logging.warning("rejecting text with wrong length or crc")
+            return
+        self.mode = "text"
+        self.text = {
+            "characters": int.from_bytes(body[0:2], byteorder="little"),
+            "mode": body[4],
+            "speed": body[5],
+            "color_mode": body[6],
+            "color": tuple(body[7:10]),
+            "background_mode": body[10],
+            "background": tuple(body[11:14]),
+        }
+
+
+class _Characteristic:
+    def __init__(self, max_write_without_response_size: int) -> None:
+        self.max_write_without_response_size = max_write_without_response_size
+
+
+class _Services:
+    def __init__(self, device: EmulatedDevice) -> None:
+        self.device = device
+
+    def get_characteristic(self, uuid: str) -> Optional[_Characteristic]:
+        if uuid in (UUID_WRITE_DATA, UUID_READ_DATA):
+            return _Characteristic(self.device.write_size)
+        return None
+
+
+class EmulatedClient:
+    """Stands in for the BleakClient of a ConnectionManager and forwards the
+    GATT writes to an EmulatedDevice.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, address: str, device: EmulatedDevice) -> None:
+        self.address = address
+        self.device = device
+        self.services = _Services(device)
+        self.is_connected = False
+
+    @property
+    def mtu_size(self) -> int:
+        return self.device.mtu
+
+    async def connect(self) -> bool:
+        if self.device.latency:
+            await asyncio.sleep(self.device.latency)
+        self.is_connected = True
+        self.device.connected()
+        return True
+
+    async def disconnect(self) -> bool:
+        self.is_connected = False
+        self.logging.debug(f"{self.address}: {self.device.state()}")
+        return True
+
+    async def write_gatt_char(self, uuid: str, data, response: bool = False) -> None:
+        if not self.is_connected:
+            raise EmulatedWriteError("not connected")
+        if self.device.dropped():
+            self.is_connected = False
+            raise EmulatedWriteError("connection lost")
+        await self.device.write(bytes(data), response)
+
+    async def read_gatt_char(self, uuid: str) -> bytearray:
+        return bytearray()
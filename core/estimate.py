@@ -0,0 +1,94 @@
+# python imports
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+# idotmatrix imports
+from core import storage
+
+# rough link model used before a device is calibrated: acknowledged writes
+# cost a connection event round-trip each, every byte costs its share of the
+# effective throughput
+ROUND_TRIP_SECONDS = 0.03
+BYTE_SECONDS = 1 / 5000
+# weight of the older samples when a new upload is added to the calibration
+DECAY = 0.9
+
+
+def transfer_cost(payload_bytes: int, round_trips: int) -> float:
+    """estimated seconds to send payload_bytes in round_trips acknowledged writes"""
+    return round_trips * ROUND_TRIP_SECONDS + payload_bytes * BYTE_SECONDS
+
+
+def link(mode: str, confirmed: bool) -> str:
+    """returns the calibration key of uploads in a transport mode, e.g. windowed:ack"""
+    return f"{mode}:{'ack' if confirmed else 'send'}"
+
+
+class Calibration:
+    """Throughput model of one device, learned from the real uploads to it.
+
+    Every upload which went through without retries adds its size and
+    duration per transport mode, and seconds = overhead + bytes * per_byte is
+    fitted by least squares with older uploads weighing less. Until uploads
+    of different sizes were seen, only the average throughput is used.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, address: Optional[str]) -> None:
+        self.address = address
+        # weighted sums per link: n, bytes, seconds, bytes², bytes*seconds
+        self.links: Dict[str, Dict[str, float]] = {}
+        self.path = storage.device_file("calibration", address, ".json")
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as file:
+                    self.links = dict(json.load(file).get("links", {}))
+            except (OSError, ValueError, AttributeError, TypeError) as error:
+                self.logging.warning(f"ignoring broken calibration {self.path}: {error}")
+
+    def add(self, key: str, payload_bytes: int, seconds: float) -> None:
+        """adds a measured upload and saves the calibration"""
+        if payload_bytes <= 0 or seconds <= 0:
+            return
+        sums = {name: value * DECAY for name, value in self.links.get(key, {}).items()}
+        for name, value in (
+            ("n", 1.0),
+            ("x", payload_bytes),
+            ("y", seconds),
+            ("xx", payload_bytes * payload_bytes),
+            ("xy", payload_bytes * seconds),
+        ):
+            sums[name] = sums.get(name, 0.0) + value
+        sums["updated"] = time.time()
+        self.links[key] = sums
+        if self.path:
+            with open(self.path + ".tmp", "w") as file:
+                json.dump({"links": self.links}, file)
+            os.replace(self.path + ".tmp", self.path)
+
+    def model(self, key: str) -> Optional[Tuple[float, float]]:
+        """returns (overhead seconds, seconds per byte) of a link, None if it was never measured"""
+        sums = self.links.get(key)
+        if not sums or sums.get("x", 0) <= 0:
+            return None
+        n, x, y, xx, xy = (sums[name] for name in ("n", "x", "y", "xx", "xy"))
+        spread = n * xx - x * x
+        # the fit needs uploads of clearly different sizes
+        if spread > 1e-6 * n * xx:
+            per_byte = (n * xy - x * y) / spread
+            overhead = (y - per_byte * x) / n
+            if per_byte > 0 and overhead >= 0:
+                return overhead, per_byte
+        return 0.0, y / x
+
+    def estimate(self, key: str, payload_bytes: int, round_trips: int) -> Tuple[float, bool]:
+        """returns the estimated seconds of an upload and whether the device was calibrated for it"""
+        model = self.model(key)
+        if model is None:
+            return transfer_cost(payload_bytes, round_trips), False
+        overhead, per_byte = model
+        return overhead + payload_bytes * per_byte, True
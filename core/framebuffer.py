@@ -0,0 +1,121 @@
+# python imports
+import io
+import logging
+import os
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+import numpy
+from PIL import Image as PilImage
+
+# idotmatrix imports
+from core import storage
+from core.estimate import transfer_cost
+from core.graffiti import pack_writes, pixel_packets
+
+
+def load_pixels(file_path: Union[str, BinaryIO], pixel_size: Optional[int] = None) -> Optional[numpy.ndarray]:
+    """loads an image as (size, size, 3) uint8 array, resized like Image.uploadProcessed does
+
+    Returns None if the image can't be read or is not square (its pixels can't
+    be mapped to the canvas then).
+    """
+    try:
+        with PilImage.open(file_path) as img:
+            if pixel_size and img.size != (pixel_size, pixel_size):
+                img = img.resize((pixel_size, pixel_size), PilImage.LANCZOS)
+            if img.size[0] != img.size[1]:
+                return None
+            return numpy.asarray(img.convert("RGB"), dtype=numpy.uint8).copy()
+    except (OSError, ValueError):
+        return None
+
+
+def encode_png(pixels: numpy.ndarray) -> bytes:
+    """encodes a canvas as png for a full image upload"""
+    png_buffer = io.BytesIO()
+    PilImage.fromarray(pixels, "RGB").save(png_buffer, format="PNG")
+    return png_buffer.getvalue()
+
+
+class Framebuffer:
+    """Shadow copy of the DIY canvas of one device, persisted in the cache
+    directory so it survives restarts of the daemon. pixels is None as long
+    as the content of the canvas is unknown.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, address: Optional[str]) -> None:
+        self.address = address
+        self.pixels: Optional[numpy.ndarray] = None
+        self.path = storage.device_file("framebuffer", address, ".npy")
+        if self.path and os.path.exists(self.path):
+            try:
+                self.pixels = numpy.load(self.path)
+            except (OSError, ValueError) as error:
+                self.logging.warning(f"ignoring broken framebuffer {self.path}: {error}")
+
+    @property
+    def valid(self) -> bool:
+        return self.pixels is not None
+
+    def invalidate(self) -> None:
+        """forgets the canvas, e.g. after a reset or when other content is shown"""
+        self.pixels = None
+        storage.remove(self.path)
+
+    def update(self, pixels: numpy.ndarray, save: bool = True) -> None:
+        """remembers what the canvas shows now
+
+        Without save the saved canvas is removed instead (e.g. while
+        streaming), so a crash leaves an unknown canvas rather than a wrong one.
+        """
+        self.pixels = pixels
+        if not save:
+            storage.remove(self.path)
+        elif self.path:
+            with open(self.path + ".tmp", "wb") as file:
+                numpy.save(file, pixels)
+            os.replace(self.path + ".tmp", self.path)
+
+    def paint(self, pixels: List[Tuple[int, int, int, int, int]]) -> Optional[numpy.ndarray]:
+        """returns a copy of the canvas with the given (x, y, r, g, b) pixels applied
+
+        Returns None if the canvas is unknown or a pixel is outside of it.
+        """
+        if not self.valid:
+            return None
+        size = self.pixels.shape[0]
+        target = self.pixels.copy()
+        for x, y, r, g, b in pixels:
+            if x >= size or y >= size:
+                return None
+            target[y, x] = (r, g, b)
+        return target
+
+    def diff(self, target: numpy.ndarray) -> Optional[List[Tuple[int, int, int, int, int]]]:
+        """returns the (x, y, r, g, b) pixels of target which differ from the canvas
+
+        Returns None if the canvas is unknown or has another size.
+        """
+        if not self.valid or self.pixels.shape != target.shape:
+            return None
+        ys, xs = numpy.nonzero(numpy.any(self.pixels != target, axis=2))
+        colors = target[ys, xs]
+        return [
+            (int(x), int(y), int(color[0]), int(color[1]), int(color[2]))
+            for x, y, color in zip(xs, ys, colors)
+        ]
+
+    def cheaper_as_pixels(
+        self, changed: List[Tuple[int, int, int, int, int]], target: numpy.ndarray, write_size: int
+    ) -> bool:
+        """compares sending the changed pixels with a full png upload of target"""
+        writes = pack_writes(pixel_packets(changed, write_size), write_size)
+        pixel_cost = transfer_cost(sum(len(data) for data in writes), len(writes))
+        # a png upload is a single (unacknowledged) stream, plus the mode switch
+        full_cost = transfer_cost(len(encode_png(target)), 2)
+        self.logging.debug(
+            f"{len(changed)} changed pixels: {pixel_cost:.3f}s as pixels, {full_cost:.3f}s as image"
+        )
+        return pixel_cost < full_cost
@@ -0,0 +1,436 @@
+# python imports
+import io
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy
+from PIL import Image as PilImage
+
+# ms, for frames without a duration
+DEFAULT_DURATION = 100
+# frames with more opaque pixels than this alpha are drawn
+ALPHA_THRESHOLD = 128
+
+# a gif is written as:
+#
+#   header          "GIF89a", canvas size, global color table (the palette of the first frame)
+#   loop extension  NETSCAPE2.0 with the loop count
+#   per frame       graphic control extension (delay, disposal, transparent index),
+#                   image descriptor, local color table unless it is the global one, lzw data
+#   trailer         0x3b
+#
+# the lzw data of a frame comes from a single frame gif written by PIL, or
+# from lzw_encode for the frames of GifOptimizer
+LOOP_EXTENSION = b"\x21\xff\x0bNETSCAPE2.0\x03\x01"
+DISPOSAL_NONE = 1
+DISPOSAL_BACKGROUND = 2
+MAX_CODE = 4096
+
+
+def _skip_blocks(data: bytes, pos: int) -> int:
+    """returns the position behind the data sub-blocks starting at pos"""
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _table_bits(table: bytes) -> int:
+    """returns the size field of a color table (2 ** (bits + 1) colors)"""
+    return max(0, (len(table) // 3).bit_length() - 2)
+
+
+def _sub_blocks(data: bytes) -> bytes:
+    """splits data into sub-blocks of up to 255 bytes with the terminator"""
+    blocks = bytearray()
+    for start in range(0, len(data), 255):
+        chunk = data[start : start + 255]
+        blocks.append(len(chunk))
+        blocks += chunk
+    blocks.append(0)
+    return bytes(blocks)
+
+
+def lzw_encode(indices: bytes, min_code_size: int) -> bytes:
+    """encodes the color indices of a frame as gif lzw data (code size and
+    sub-blocks). PIL always uses 8 bit codes at the start, a small palette
+    starts with min_code_size + 1 bits instead.
+    """
+    clear = 1 << min_code_size
+    code_size = min_code_size + 1
+    next_code = clear + 2
+    codes: Dict[int, int] = {}
+    output = bytearray()
+    buffer = clear
+    bits = code_size
+    prefix = indices[0]
+    for index in indices[1:]:
+        key = prefix << 8 | index
+        code = codes.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        buffer |= prefix << bits
+        bits += code_size
+        if next_code < MAX_CODE:
+            codes[key] = next_code
+            next_code += 1
+            if next_code > 1 << code_size and code_size < 12:
+                code_size += 1
+        else:
+            # the table is full, start over
+            buffer |= clear << bits
+            bits += code_size
+            codes.clear()
+            code_size = min_code_size + 1
+            next_code = clear + 2
+        while bits >= 8:
+            output.append(buffer & 0xFF)
+            buffer >>= 8
+            bits -= 8
+        prefix = index
+    buffer |= prefix << bits
+    bits += code_size
+    if next_code == 1 << code_size and code_size < 12:
+        # the decoder adds a code for the last one and grows before the end code
+        code_size += 1
+    buffer |= (clear + 1) << bits
+    bits += code_size
+    while bits > 0:
+        output.append(buffer & 0xFF)
+        buffer >>= 8
+        bits -= 8
+    return bytes([min_code_size]) + _sub_blocks(bytes(output))
+
+
+def split_frame(data: bytes) -> Tuple[bytes, Optional[int], bytes, bytes]:
+    """splits a single frame gif into its color table, transparent index,
+    image descriptor (without the table flags) and lzw data
+    """
+    if data[:3] != b"GIF":
+        raise ValueError("not a gif")
+    flags = data[10]
+    pos = 13
+    table = b""
+    if flags & 0x80:
+        size = 3 << ((flags & 7) + 1)
+        table = data[pos : pos + size]
+        pos += size
+    transparency = None
+    while pos < len(data):
+        if data[pos] == 0x21:
+            label = data[pos + 1]
+            pos += 2
+            if label == 0xF9 and data[pos] == 4 and data[pos + 1] & 1:
+                transparency = data[pos + 4]
+            pos = _skip_blocks(data, pos)
+        elif data[pos] == 0x2C:
+            descriptor = bytearray(data[pos : pos + 10])
+            packed = descriptor[9]
+            pos += 10
+            if packed & 0x80:
+                size = 3 << ((packed & 7) + 1)
+                table = data[pos : pos + size]
+                pos += size
+            # keeps the interlace flag only
+            descriptor[9] = packed & 0x40
+            start = pos
+            pos = _skip_blocks(data, pos + 1)
+            return table, transparency, bytes(descriptor), data[start:pos]
+        else:
+            break
+    raise ValueError("no image in the gif")
+
+
+class GifWriter:
+    """Writes an animated gif one frame at a time, so only the frame being
+    written is held in memory. Frames are paletted images of the canvas size.
+    """
+
+    def __init__(self, file: BinaryIO, size: Tuple[int, int], loop: Optional[int] = 1) -> None:
+        self.file = file
+        self.size = size
+        self.loop = loop
+        self.frames = 0
+        self.global_table: Optional[bytes] = None
+
+    def write(self, frame: PilImage.Image, duration: float, transparency: Optional[int] = None) -> None:
+        """appends a paletted frame shown for duration ms"""
+        encoded = io.BytesIO()
+        if transparency is None:
+            frame.save(encoded, format="GIF")
+        else:
+            frame.save(encoded, format="GIF", transparency=transparency)
+        table, transparency, descriptor, lzw = split_frame(encoded.getvalue())
+        self.append(table, transparency, descriptor, lzw, duration)
+
+    def append(
+        self,
+        table: bytes,
+        transparency: Optional[int],
+        descriptor: bytes,
+        lzw: bytes,
+        duration: float,
+        disposal: int = DISPOSAL_BACKGROUND,
+    ) -> None:
+        """appends an encoded frame, the color table of the first one becomes the global one"""
+        if self.global_table is None:
+            self.global_table = table
+            self.file.write(
+                b"GIF89a" + struct.pack("<HHBBB", self.size[0], self.size[1], 0xF0 | _table_bits(table), 0, 0)
+            )
+            self.file.write(table)
+            if self.loop is not None:
+                self.file.write(LOOP_EXTENSION + struct.pack("<H", self.loop) + b"\x00")
+        flags = disposal << 2 | (transparency is not None)
+        delay = int(round(duration / 10))
+        self.file.write(struct.pack("<BBBBHBB", 0x21, 0xF9, 4, flags, delay, transparency or 0, 0))
+        if table == self.global_table:
+            self.file.write(descriptor)
+        else:
+            self.file.write(descriptor[:9] + bytes([descriptor[9] | 0x80 | _table_bits(table)]))
+            self.file.write(table)
+        self.file.write(lzw)
+        self.frames += 1
+
+    def close(self) -> None:
+        if self.global_table is None:
+            raise ValueError("a gif needs at least one frame")
+        self.file.write(b"\x3b")
+
+
+def quantize(frame: PilImage.Image) -> Tuple[PilImage.Image, Optional[int]]:
+    """reduces a frame to a palette of up to 256 colors, one of them
+    transparent if the frame has transparent pixels
+    """
+    rgba = frame.convert("RGBA")
+    alpha = rgba.getchannel("A")
+    transparent = alpha.getextrema()[0] < ALPHA_THRESHOLD
+    colors = 255 if transparent else 256
+    paletted = rgba.convert("RGB").convert("P", palette=PilImage.Palette.ADAPTIVE, colors=colors)
+    if not transparent:
+        return paletted, None
+    palette = paletted.getpalette()[: colors * 3]
+    paletted.putpalette(palette + [0] * (768 - len(palette)))
+    paletted.paste(colors, mask=alpha.point(lambda value: 255 if value < ALPHA_THRESHOLD else 0))
+    return paletted, colors
+
+
+def _packed(pixels: numpy.ndarray) -> numpy.ndarray:
+    """returns the colors of (..., 3) uint8 pixels as one 0xRRGGBB integer each"""
+    pixels = pixels.astype(numpy.uint32)
+    return pixels[..., 0] << 16 | pixels[..., 1] << 8 | pixels[..., 2]
+
+
+def _table(colors: numpy.ndarray, entries: int) -> bytes:
+    """returns a color table of 0xRRGGBB colors padded to a power of two"""
+    size = 2
+    while size < entries:
+        size *= 2
+    table = numpy.zeros((size, 3), dtype=numpy.uint8)
+    table[: len(colors), 0] = colors >> 16
+    table[: len(colors), 1] = colors >> 8 & 0xFF
+    table[: len(colors), 2] = colors & 0xFF
+    return table.tobytes()
+
+
+class _ByteCounter:
+    """a file which only counts the bytes written to it"""
+
+    def __init__(self) -> None:
+        self.bytes = 0
+
+    def write(self, data: bytes) -> None:
+        self.bytes += len(data)
+
+
+class GifOptimizer:
+    """Writes the frames of a gif for the panel with as few bytes as possible.
+
+    Frames are flattened on black (the panel cannot show transparency) and
+    keep their exact colors if there are no more than colors. A frame equal to the
+    previous one is dropped and its duration added to it. The other frames
+    are written whole like without optimizing.
+
+    With crop, every other frame only covers the rectangle which changed
+    (the previous frame is not disposed), and is encoded with the global or
+    its own color table, with or without the unchanged pixels as
+    transparent, whichever is smallest. The lzw codes start at the smallest
+    size of the table. This is off until it is verified on the panels.
+
+    The frames are also written like without optimizing into a counter, for
+    the report.
+    """
+
+    def __init__(self, writer: GifWriter, colors: int = 256, crop: bool = False) -> None:
+        self.writer = writer
+        self.colors = max(2, min(256, colors))
+        self.crop = crop
+        self.plain = GifWriter(_ByteCounter(), writer.size, writer.loop)
+        self.pending: Optional[List] = None
+        self.canvas: Optional[numpy.ndarray] = None
+        self.global_colors: Optional[numpy.ndarray] = None
+        self.stats = {"frames": 0, "written": 0, "duplicates": 0, "cropped": 0}
+
+    def add(self, frame: PilImage.Image, duration: float) -> None:
+        """adds the next frame, shown for duration ms"""
+        self.stats["frames"] += 1
+        paletted, transparency = quantize(frame)
+        self.plain.write(paletted, duration, transparency)
+        rgba = frame.convert("RGBA")
+        if rgba.getextrema()[3][0] < ALPHA_THRESHOLD:
+            black = PilImage.new("RGBA", rgba.size, (0, 0, 0, 255))
+            mask = rgba.getchannel("A").point(lambda value: 255 if value >= ALPHA_THRESHOLD else 0)
+            rgba = PilImage.composite(rgba, black, mask)
+        rgb = rgba.convert("RGB")
+        pixels = numpy.asarray(rgb)
+        if len(numpy.unique(_packed(pixels))) > self.colors:
+            paletted = rgb.convert("P", palette=PilImage.Palette.ADAPTIVE, colors=self.colors)
+            pixels = numpy.asarray(paletted.convert("RGB"))
+        if self.pending is not None and numpy.array_equal(self.pending[0], pixels):
+            self.pending[1] += duration
+            self.stats["duplicates"] += 1
+            return
+        self.flush()
+        self.pending = [pixels, duration]
+
+    def flush(self) -> None:
+        """writes the pending frame"""
+        if self.pending is None:
+            return
+        pixels, duration = self.pending
+        self.pending = None
+        if not self.crop:
+            # the colors are exact already, unless there were more than self.colors
+            frame = PilImage.fromarray(pixels).convert("P", palette=PilImage.Palette.ADAPTIVE, colors=self.colors)
+            self.writer.write(frame, duration)
+            self.stats["written"] += 1
+            return
+        height, width = pixels.shape[:2]
+        top, left, bottom, right = 0, 0, height, width
+        unchanged = None
+        if self.canvas is not None:
+            changed = numpy.any(self.canvas != pixels, axis=2)
+            rows = numpy.flatnonzero(changed.any(axis=1))
+            columns = numpy.flatnonzero(changed.any(axis=0))
+            top, bottom = rows[0], rows[-1] + 1
+            left, right = columns[0], columns[-1] + 1
+            unchanged = ~changed[top:bottom, left:right]
+            if (bottom - top, right - left) != (height, width):
+                self.stats["cropped"] += 1
+        region = _packed(pixels[top:bottom, left:right])
+        descriptor = struct.pack("<BHHHHB", 0x2C, left, top, right - left, bottom - top, 0)
+        colors, inverse = numpy.unique(region, return_inverse=True)
+        inverse = inverse.reshape(region.shape)
+        candidates = [(colors, inverse)]
+        if self.global_colors is None:
+            self.global_colors = colors
+        elif numpy.isin(colors, self.global_colors).all():
+            candidates.append((self.global_colors, numpy.searchsorted(self.global_colors, region)))
+        best = None
+        for palette, indices in candidates:
+            shared = palette is self.global_colors and self.writer.global_table is not None
+            # the transparent index follows the colors, it must fit the table
+            room = len(self.writer.global_table) // 3 if shared else 256
+            variants = [(indices, None)]
+            if unchanged is not None and unchanged.any() and len(palette) < room:
+                variants.append((numpy.where(unchanged, len(palette), indices), len(palette)))
+            for variant, transparency in variants:
+                if shared:
+                    table = self.writer.global_table
+                else:
+                    table = _table(palette, len(palette) + (transparency is not None))
+                lzw = lzw_encode(variant.astype(numpy.uint8).tobytes(), max(2, _table_bits(table) + 1))
+                cost = len(lzw) + (0 if table == self.writer.global_table else len(table))
+                if best is None or cost < best[0]:
+                    best = (cost, table, transparency, lzw)
+        _, table, transparency, lzw = best
+        self.writer.append(table, transparency, descriptor, lzw, duration, DISPOSAL_NONE)
+        self.canvas = pixels
+        self.stats["written"] += 1
+
+    def close(self) -> Dict:
+        """writes the last frame and returns the stats with the bytes without optimizing"""
+        self.flush()
+        self.plain.close()
+        return {**self.stats, "plain_bytes": self.plain.file.bytes}
+
+
+def frames(
+    img: PilImage.Image,
+    pixel_size: int,
+    max_frames: Optional[int] = None,
+    max_fps: Optional[float] = None,
+) -> Iterator[List]:
+    """yields [frame, duration in ms] for the frames of an open gif, decoded and
+    resized one at a time
+
+    With max_fps, frames starting within the slot of the previous one are
+    dropped and their duration is added to it. Decoding stops after
+    max_frames frames.
+    """
+    interval = 1000 / max_fps if max_fps else 0.0
+    pending = None
+    kept = 0
+    elapsed = 0.0
+    due = 0.0
+    index = 0
+    while True:
+        try:
+            img.seek(index)
+        except EOFError:
+            break
+        duration = img.info.get("duration") or DEFAULT_DURATION
+        if pending is not None and elapsed < due:
+            pending[1] += duration
+        else:
+            if pending is not None:
+                yield pending
+            if max_frames and kept >= max_frames:
+                pending = None
+                break
+            size = (pixel_size, pixel_size)
+            frame = img.resize(size, PilImage.NEAREST) if img.size != size else img.copy()
+            pending = [frame, duration]
+            kept += 1
+            while due <= elapsed:
+                due += interval or duration
+        elapsed += duration
+        index += 1
+    if pending is not None:
+        yield pending
+
+
+def process_gif(
+    file_path: Union[str, BinaryIO],
+    pixel_size: int,
+    max_frames: Optional[int] = None,
+    max_fps: Optional[float] = None,
+    optimize: bool = True,
+    report: Optional[Dict] = None,
+    colors: int = 256,
+    crop: bool = False,
+) -> bytes:
+    """resizes a gif to pixel_size like --process-gif, one frame at a time
+
+    Every frame is decoded, resized, quantized and encoded before the next
+    one is read, so the memory used besides the output is what PIL keeps to
+    decode a frame of the source, whatever the number of frames. The global
+    loading strategy of PIL is left alone. With optimize, frames are
+    written by GifOptimizer (with up to colors colors and crop) and its stats are
+    added to report, which always gets the frames written and the bytes.
+    """
+    output = io.BytesIO()
+    writer = GifWriter(output, (pixel_size, pixel_size))
+    optimizer = GifOptimizer(writer, colors, crop) if optimize else None
+    with PilImage.open(file_path) as img:
+        for frame, duration in frames(img, pixel_size, max_frames, max_fps):
+            if optimizer is not None:
+                optimizer.add(frame, duration)
+            else:
+                paletted, transparency = quantize(frame)
+                writer.write(paletted, duration, transparency)
+    stats = optimizer.close() if optimizer is not None else {}
+    writer.close()
+    if report is not None:
+        report.update(stats, written=writer.frames, bytes=output.tell())
+    return output.getvalue()
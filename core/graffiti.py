@@ -0,0 +1,100 @@
+# python imports
+import logging
+from typing import Dict, List, Tuple, Union
+
+# idotmatrix imports
+from core import timing
+from core.transfer import Transfer
+from core.transport import write_size
+from idotmatrix import Graffiti as BaseGraffiti
+
+# length (2), command (5, 1, 0) and color (3) of a graffiti packet
+HEADER_SIZE = 8
+
+
+def pixel_packets(
+    pixels: List[Tuple[int, int, int, int, int]], max_size: int
+) -> List[bytearray]:
+    """Groups pixels by color into graffiti packets. One packet carries a
+    color followed by as many x/y pairs as fit into max_size bytes.
+
+    Args:
+        pixels (List[Tuple[int, int, int, int, int]]): list of (x, y, r, g, b)
+        max_size (int): maximum size of a packet in bytes
+
+    Returns:
+        List[bytearray]: graffiti packets
+    """
+    # a later pixel wins over an earlier one at the same position
+    colors: Dict[Tuple[int, int, int], List[int]] = {}
+    positions = {(x, y): (r, g, b) for x, y, r, g, b in pixels}
+    for (x, y), color in positions.items():
+        colors.setdefault(color, []).extend((x, y))
+    per_packet = max(1, (max_size - HEADER_SIZE) // 2) * 2
+    packets = []
+    for (r, g, b), coordinates in colors.items():
+        for i in range(0, len(coordinates), per_packet):
+            chunk = coordinates[i : i + per_packet]
+            packet = bytearray([0, 0, 5, 1, 0, r, g, b]) + bytearray(chunk)
+            packet[0:2] = len(packet).to_bytes(2, byteorder="little")
+            packets.append(packet)
+    return packets
+
+
+def pack_writes(packets: List[bytearray], max_size: int) -> List[bytearray]:
+    """Packs whole packets into as few writes of at most max_size bytes as possible.
+
+    Args:
+        packets (List[bytearray]): packets which must not be split
+        max_size (int): maximum size of a write in bytes
+
+    Returns:
+        List[bytearray]: writes
+    """
+    writes: List[bytearray] = []
+    for packet in packets:
+        if writes and len(writes[-1]) + len(packet) <= max_size:
+            writes[-1].extend(packet)
+        else:
+            writes.append(bytearray(packet))
+    return writes
+
+
+class Graffiti(BaseGraffiti):
+    """Graffiti board of the iDotMatrix device with batched pixel updates."""
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    async def setPixels(
+        self, pixels: List[Tuple[int, int, int, int, int]]
+    ) -> Union[bool, List[bytearray]]:
+        """Sets many pixels with as few writes as the connection allows. Every
+        write waits for the response of the device before the next one is sent,
+        so no pixels get lost when painting the whole board.
+
+        Args:
+            pixels (List[Tuple[int, int, int, int, int]]): list of (x, y, r, g, b)
+
+        Returns:
+            Union[bool, List[bytearray]]: False if there's an error, otherwise the writes sent to the device.
+        """
+        try:
+            for pixel in pixels:
+                if len(pixel) != 5 or any(value not in range(0, 256) for value in pixel):
+                    self.logging.error(
+                        f"Graffiti.setPixels expects (x, y, r, g, b) between 0 and 255, got {pixel}"
+                    )
+                    return False
+            if self.conn:
+                await self.conn.connect()
+            max_size = write_size(self.conn)
+            with timing.span("encode"):
+                writes = pack_writes(pixel_packets(pixels, max_size), max_size)
+            self.logging.debug(f"sending {len(pixels)} pixels in {len(writes)} writes")
+            if self.conn:
+                # every write holds whole packets, so an interrupted update can be sent again
+                await Transfer(self.conn, writes, response=True).run()
+            return writes
+        except Exception as error:
+            self.logging.error(f"could not update the Graffiti Board: {error}")
+            return False
@@ -0,0 +1,84 @@
+# python imports
+import mmap
+import os
+import struct
+from typing import List, Union
+
+# idotmatrix imports
+from core.uploads import payload_hash
+
+# precompiled payloads (.idm) hold the exact packets of a gif or image upload:
+#
+#   header   magic "IDM\0", version, kind, pixel size, chunk count, sha256 of the payload
+#   table    offset and length of every chunk
+#   chunks   the packets as sent to the device
+#
+# all numbers are little endian
+MAGIC = b"IDM\x00"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHI32s")
+TABLE_ENTRY = struct.Struct("<II")
+EXTENSION = ".idm"
+
+GIF = 1
+IMAGE = 2
+KINDS = {GIF: "gif", IMAGE: "image"}
+
+
+def is_idm(file_path) -> bool:
+    """returns True if the file is a precompiled payload (by its extension)"""
+    return str(file_path).lower().endswith(EXTENSION)
+
+
+def write(file_path: str, kind: int, pixel_size: int, chunks: List[bytes]) -> str:
+    """writes the chunks of a prepared payload into an .idm file and returns its hash"""
+    digest = payload_hash(list(chunks))
+    offset = HEADER.size + TABLE_ENTRY.size * len(chunks)
+    table = bytearray()
+    for chunk in chunks:
+        table += TABLE_ENTRY.pack(offset, len(chunk))
+        offset += len(chunk)
+    with open(file_path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, kind, pixel_size, len(chunks), bytes.fromhex(digest)))
+        file.write(table)
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(file_path + ".tmp", file_path)
+    return digest
+
+
+class IdmFile:
+    """A precompiled payload mapped into memory. chunks are memoryviews into
+    the mapping, so sending them does not copy or process anything.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.path = file_path
+        with open(file_path, "rb") as file:
+            # the mapping stays valid after the file is closed
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{file_path} is too short for an .idm file")
+        magic, version, self.kind, self.size, count, digest = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{file_path} is not an .idm file of version {VERSION}")
+        if self.kind not in KINDS:
+            raise ValueError(f"{file_path} contains an unknown payload kind {self.kind}")
+        self.digest = digest.hex()
+        if len(self._map) < HEADER.size + count * TABLE_ENTRY.size:
+            raise ValueError(f"{file_path} is truncated")
+        view = memoryview(self._map)
+        self.chunks: List[memoryview] = []
+        for i in range(count):
+            offset, length = TABLE_ENTRY.unpack_from(self._map, HEADER.size + i * TABLE_ENTRY.size)
+            if offset + length > len(self._map):
+                raise ValueError(f"{file_path} is truncated")
+            self.chunks.append(view[offset : offset + length])
+
+    @property
+    def bytes(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def payload(self) -> Union[List[memoryview], memoryview]:
+        """returns the chunks in the shape the library returns them: a list for gifs, one buffer for images"""
+        return self.chunks if self.kind == GIF else self.chunks[0]
@@ -0,0 +1,158 @@
+# python imports
+import asyncio
+import contextvars
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+log = logging.getLogger("idotmatrix." + __name__)
+
+DEFAULT_PRIORITY = 0
+
+# the job the running command belongs to, None outside of a JobQueue
+_current: contextvars.ContextVar = contextvars.ContextVar("idotmatrix_job", default=None)
+# keeps jobs of the same priority in the order they were submitted
+_sequence = itertools.count()
+
+
+class Preempted(BaseException):
+    """Raised at a chunk boundary when a more important job wants the device.
+
+    Derives from BaseException like asyncio.CancelledError, so the handlers
+    which log and swallow the errors of the device modules let it through.
+    """
+
+
+def checkpoint() -> None:
+    """raises Preempted if the running job has to give way (call between chunks)"""
+    job = _current.get()
+    if job is not None and job.preempted_by is not None:
+        raise Preempted(job.preempted_by)
+
+
+async def sleep(seconds: float) -> None:
+    """waits like asyncio.sleep, but raises Preempted as soon as the running job has to give way"""
+    job = _current.get()
+    if job is None:
+        await asyncio.sleep(seconds)
+        return
+    try:
+        await asyncio.wait_for(job.preempting.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+    checkpoint()
+
+
+class Job:
+    """one queued command, run() is called again if the job gets preempted"""
+
+    def __init__(
+        self,
+        run: Callable[[], Awaitable[Any]],
+        priority: int = DEFAULT_PRIORITY,
+        slot: Optional[str] = None,
+        name: str = "",
+    ) -> None:
+        self.run = run
+        self.priority = priority
+        self.slot = slot
+        self.name = name
+        self.sequence = next(_sequence)
+        self.future = asyncio.get_running_loop().create_future()
+        # why the running job has to stop at the next chunk boundary
+        self.preempted_by: Optional[str] = None
+        self.preempting = asyncio.Event()
+        # the newer job of the same slot which made this one obsolete
+        self.superseded_by: Optional["Job"] = None
+        self.preemptions = 0
+
+    def __str__(self) -> str:
+        return f"{self.name or 'job'} (priority {self.priority}, slot {self.slot})"
+
+    def preempt(self, job: "Job", supersede: bool) -> None:
+        if supersede:
+            self.superseded_by = job
+        if self.preempted_by is None:
+            self.preempted_by = f"preempted by {job}"
+            self.preempting.set()
+
+
+class JobQueue:
+    """Runs the jobs of one device one after another, most important first.
+
+    A job with a higher priority than the running one preempts it at the next
+    chunk boundary. The preempted job is queued again and starts over once the
+    more important work is done. Every job updates a slot of the device (e.g.
+    "display" or "brightness"): a new job replaces the queued jobs of the same
+    slot (latest wins) and also preempts a running job of that slot unless the
+    running one is more important, as its result would be overwritten anyway.
+    Jobs without a slot (e.g. scripts) are never replaced.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.pending: List[Job] = []
+        self.current: Optional[Job] = None
+        self.stats: Dict[str, int] = {"done": 0, "superseded": 0, "preempted": 0}
+        self._worker: Optional[asyncio.Task] = None
+
+    def submit(self, job: Job) -> Job:
+        """queues a job, await job.future for its result (None if it was superseded)"""
+        if job.slot is not None:
+            for queued in [queued for queued in self.pending if queued.slot == job.slot]:
+                self.pending.remove(queued)
+                self._supersede(queued, job)
+        current = self.current
+        if current is not None:
+            if job.slot is not None and job.slot == current.slot and job.priority >= current.priority:
+                log.info(f"{self.name}: {job} replaces the running {current}")
+                current.preempt(job, supersede=True)
+            elif job.priority > current.priority:
+                log.info(f"{self.name}: {job} preempts the running {current}")
+                current.preempt(job, supersede=False)
+        self.pending.append(job)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._work())
+        return job
+
+    def _supersede(self, job: Job, newer: Job) -> None:
+        log.info(f"{self.name}: {job} superseded by {newer}")
+        job.superseded_by = newer
+        self.stats["superseded"] += 1
+        if not job.future.done():
+            job.future.set_result(None)
+
+    def _next(self) -> Job:
+        job = min(self.pending, key=lambda job: (-job.priority, job.sequence))
+        self.pending.remove(job)
+        return job
+
+    async def _work(self) -> None:
+        while self.pending:
+            job = self.current = self._next()
+            token = _current.set(job)
+            try:
+                result = await job.run()
+            except Preempted as preemption:
+                job.preemptions += 1
+                job.preempted_by = None
+                job.preempting.clear()
+                if job.superseded_by is not None:
+                    self._supersede(job, job.superseded_by)
+                else:
+                    log.info(f"{self.name}: {job} {preemption}, queued again")
+                    self.stats["preempted"] += 1
+                    # keeps its sequence, so it runs before newer jobs of its priority
+                    self.pending.append(job)
+            except BaseException as error:
+                if not job.future.done():
+                    job.future.set_exception(error)
+                if isinstance(error, (asyncio.CancelledError, KeyboardInterrupt)):
+                    raise
+            else:
+                self.stats["done"] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                _current.reset(token)
+                self.current = None
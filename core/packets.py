@@ -0,0 +1,178 @@
+# python imports
+import logging
+import struct
+import zlib
+from typing import List, Optional, Union
+
+# idotmatrix imports
+from idotmatrix import Gif as BaseGif
+from idotmatrix import Image as BaseImage
+
+# bytes of the device's upload buffer carried by one packet
+CHUNK_SIZE = 4096
+# packet length, 1, 0, first/next flag, gif length, crc, 5, 0, 13
+GIF_HEADER = struct.Struct("<HBBBII3B")
+# total length + chunk count, 0, 0, first/next flag, png length
+IMAGE_HEADER = struct.Struct("<hBBBi")
+# set in the header of every packet but the first one
+NEXT_CHUNK = 2
+
+
+def chunk_count(size: int, chunk_size: int = CHUNK_SIZE) -> int:
+    """returns the number of packets an upload of size bytes is split into"""
+    return max(1, -(-size // chunk_size))
+
+
+def gif_packets(gif_data: Union[bytes, bytearray, memoryview], chunk_size: int = CHUNK_SIZE) -> List[memoryview]:
+    """Builds the packets of a gif upload in one preallocated buffer.
+
+    The gif data is copied exactly once into the buffer, the headers are
+    packed in place in front of every chunk and the packets are returned as
+    views into the buffer, so slicing them into writes copies nothing.
+
+    Args:
+        gif_data (Union[bytes, bytearray, memoryview]): data of the gif file
+        chunk_size (int): size of a chunk
+
+    Returns:
+        List[memoryview]: packets as sent to the device
+    """
+    data = memoryview(gif_data).cast("B")
+    count = chunk_count(len(data), chunk_size)
+    buffer = bytearray(len(data) + count * GIF_HEADER.size)
+    view = memoryview(buffer)
+    crc = zlib.crc32(data)
+    packets = []
+    offset = 0
+    for i in range(count):
+        chunk = data[i * chunk_size : (i + 1) * chunk_size]
+        length = GIF_HEADER.size + len(chunk)
+        GIF_HEADER.pack_into(
+            buffer, offset, length, 1, 0, NEXT_CHUNK if i else 0, len(data), crc, 5, 0, 13
+        )
+        view[offset + GIF_HEADER.size : offset + length] = chunk
+        packets.append(view[offset : offset + length])
+        offset += length
+    return packets
+
+
+def image_packets(png_data: Union[bytes, bytearray, memoryview], chunk_size: int = CHUNK_SIZE) -> memoryview:
+    """Builds the packets of an image upload in one preallocated buffer.
+
+    Unlike gifs, all packets of an image are sent in a single send, so one
+    view of the whole buffer is returned.
+
+    Args:
+        png_data (Union[bytes, bytearray, memoryview]): data of the png file
+        chunk_size (int): size of a chunk
+
+    Returns:
+        memoryview: packets as sent to the device
+    """
+    data = memoryview(png_data).cast("B")
+    count = chunk_count(len(data), chunk_size)
+    buffer = bytearray(len(data) + count * IMAGE_HEADER.size)
+    view = memoryview(buffer)
+    # the device expects the png length plus the number of chunks in every header
+    total = len(data) + count
+    offset = 0
+    for i in range(count):
+        chunk = data[i * chunk_size : (i + 1) * chunk_size]
+        IMAGE_HEADER.pack_into(buffer, offset, total, 0, 0, NEXT_CHUNK if i else 0, len(data))
+        offset += IMAGE_HEADER.size
+        view[offset : offset + len(chunk)] = chunk
+        offset += len(chunk)
+    return view
+
+
+def image_data(packets: Union[bytes, bytearray, memoryview]) -> memoryview:
+    """Returns the png data carried by the packets of an image upload.
+
+    Args:
+        packets (Union[bytes, bytearray, memoryview]): packets built by image_packets
+
+    Returns:
+        memoryview: data of the png file
+    """
+    view = memoryview(packets).cast("B")
+    length = IMAGE_HEADER.unpack_from(view)[4]
+    data = bytearray(length)
+    offset = 0
+    for start in range(0, length, CHUNK_SIZE):
+        offset += IMAGE_HEADER.size
+        size = min(CHUNK_SIZE, length - start)
+        data[start : start + size] = view[offset : offset + size]
+        offset += size
+    return memoryview(data)
+
+
+def gif_data(packets: List[Union[bytes, bytearray, memoryview]]) -> bytes:
+    """Returns the gif data carried by the packets of a gif upload.
+
+    Args:
+        packets (List[Union[bytes, bytearray, memoryview]]): packets built by gif_packets
+
+    Returns:
+        bytes: data of the gif file
+    """
+    return b"".join(memoryview(packet).cast("B")[GIF_HEADER.size :] for packet in packets)
+
+
+class Gif(BaseGif):
+    """Gif upload of the iDotMatrix device with packets built by gif_packets."""
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def _createPayloads(self, gif_data: bytearray, chunk_size: int = CHUNK_SIZE) -> List[memoryview]:
+        return gif_packets(gif_data, chunk_size)
+
+    async def uploadProcessed(
+        self,
+        file_path: str,
+        pixel_size: int = 32,
+        max_frames: Optional[int] = None,
+        max_fps: Optional[float] = None,
+        optimize: bool = True,
+        colors: int = 256,
+        crop: bool = False,
+    ) -> Union[bool, List[memoryview]]:
+        """Processes a gif one frame at a time (see process_gif) and uploads it to the device.
+
+        Args:
+            file_path (str): path to the gif file
+            pixel_size (int, optional): amount of pixels (either 16, 32 or 64). Defaults to 32.
+            max_frames (int, optional): frames after this many are dropped. Defaults to all frames.
+            max_fps (float, optional): drops frames to show at most this many per second. Defaults to all frames.
+            optimize (bool, optional): writes the frames with GifOptimizer, its stats are added to self.report. Defaults to True.
+            colors (int, optional): most colors per frame when optimizing. Defaults to 256.
+            crop (bool, optional): lets the optimizer crop frames to the changed region. Defaults to False.
+
+        Returns:
+            Union[bool, List[memoryview]]: False if there's an error, otherwise returns the payload
+            (self.report holds the frames written and the bytes of the gif)
+        """
+        # numpy is only needed for processing
+        from core.gifstream import process_gif
+
+        self.report = {}
+        try:
+            data = self._createPayloads(
+                process_gif(file_path, pixel_size, max_frames, max_fps, optimize, self.report, colors, crop)
+            )
+        except Exception as error:
+            self.logging.error(f"could not process gif: {error}")
+            return False
+        if self.conn:
+            await self.conn.connect()
+            for chunk in data:
+                await self.conn.send(data=chunk, response=True)
+        return data
+
+
+class Image(BaseImage):
+    """DIY image upload of the iDotMatrix device with packets built by image_packets."""
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def _createPayloads(self, png_data: bytearray) -> memoryview:
+        return image_packets(png_data)
@@ -0,0 +1,125 @@
+# python imports
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+# idotmatrix imports
+from core import idm
+from core.assets import AssetCache, asset_key, source_hash
+from core.packets import Gif, Image
+
+# the sources --precompile-dir processes, by extension
+KINDS = {".gif": idm.GIF, ".png": idm.IMAGE}
+
+log = logging.getLogger("idotmatrix." + __name__)
+
+
+def parse_sizes(sizes: str) -> List[int]:
+    """parses a comma separated list of pixel sizes like 16,32,64"""
+    try:
+        parsed = sorted({int(size) for size in str(sizes).split(",") if size.strip()})
+    except ValueError:
+        raise ValueError(f"expected pixel sizes like 16,32,64, got {sizes}")
+    if not parsed or parsed[0] <= 0:
+        raise ValueError(f"expected pixel sizes like 16,32,64, got {sizes}")
+    return parsed
+
+
+def find_sources(directory: str) -> List[Tuple[str, int]]:
+    """returns the gif and png files below a directory with their payload kind"""
+    sources = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            kind = KINDS.get(os.path.splitext(name)[1].lower())
+            if kind is not None:
+                sources.append((os.path.join(root, name), kind))
+    return sources
+
+
+def compile_asset(
+    file_path: str, kind: int, pixel_size: int, target: str, options: Optional[Dict] = None
+) -> Optional[Tuple[int, int]]:
+    """processes one source like --process-gif/--process-image and writes the
+    payload into the cache entry target. Runs in a worker process.
+
+    Returns the number of frames encoded and the payload bytes, None if the source could not be processed.
+    """
+    module = Gif if kind == idm.GIF else Image
+    detached = module()
+    detached.conn = None
+    options = options if kind == idm.GIF else None
+    payload = asyncio.run(detached.uploadProcessed(file_path=file_path, pixel_size=pixel_size, **(options or {})))
+    if payload is False:
+        return None
+    chunks = payload if kind == idm.GIF else [payload]
+    idm.write(target, kind, pixel_size, chunks)
+    # frames dropped by --gif-max-fps or as duplicates are not counted
+    frames = detached.report["written"] if kind == idm.GIF else 1
+    return frames, sum(len(chunk) for chunk in chunks)
+
+
+def precompile(directory: str, sizes: List[int], options: Optional[Dict] = None, workers: Optional[int] = None) -> Dict:
+    """processes every gif and png below a directory for every pixel size into
+    the asset cache, on all cores. options apply to gifs, see CMD.gif_options.
+
+    Sources are hashed first, so entries of unchanged sources (and copies of
+    the same file) are skipped. Returns the report.
+    """
+    cache = AssetCache()
+    report = {"sources": 0, "compiled": 0, "skipped": 0, "failed": 0, "frames": 0, "bytes": 0}
+    started = time.perf_counter()
+    jobs = {}
+    for file_path, kind in find_sources(directory):
+        report["sources"] += 1
+        try:
+            digest = source_hash(file_path)
+        except OSError as error:
+            log.error(f"could not read {file_path}: {error}")
+            report["failed"] += len(sizes)
+            continue
+        for pixel_size in sizes:
+            key = asset_key(digest, kind, pixel_size, options if kind == idm.GIF else None)
+            if key in jobs or cache.contains(key):
+                report["skipped"] += 1
+            else:
+                jobs[key] = (file_path, kind, pixel_size)
+    workers = workers or os.cpu_count() or 1
+    log.info(
+        f"precompiling {len(jobs)} assets of {report['sources']} sources with {workers} workers, {report['skipped']} unchanged"
+    )
+    if jobs:
+        compiled = []
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            futures = {
+                executor.submit(compile_asset, file_path, kind, pixel_size, cache.path(key), options): key
+                for key, (file_path, kind, pixel_size) in jobs.items()
+            }
+            for future in as_completed(futures):
+                file_path, kind, pixel_size = jobs[futures[future]]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    log.error(f"could not precompile {file_path} for {pixel_size} pixels: {error}")
+                    result = None
+                if result is None:
+                    report["failed"] += 1
+                    continue
+                compiled.append(futures[future])
+                report["compiled"] += 1
+                report["frames"] += result[0]
+                report["bytes"] += result[1]
+                log.debug(f"precompiled {file_path} for {pixel_size} pixels ({result[0]} frames, {result[1]} bytes)")
+        cache.evict()
+        evicted = sum(1 for key in compiled if not cache.contains(key))
+        if evicted:
+            log.warning(
+                f"{evicted} precompiled assets did not fit the asset cache, raise IDOTMATRIX_ASSET_CACHE_MB"
+            )
+    seconds = time.perf_counter() - started
+    report["seconds"] = round(seconds, 3)
+    report["fps"] = round(report["frames"] / seconds, 1) if seconds > 0 else 0.0
+    return report
@@ -0,0 +1,72 @@
+# python imports
+import contextlib
+import io
+import json
+import logging
+import shlex
+
+log = logging.getLogger("idotmatrix." + __name__)
+
+# arguments which do not make sense inside of a script step
+UNSUPPORTED = (
+    "address",
+    "scan",
+    "script",
+    "daemon",
+    "compile_idm",
+    "precompile_dir",
+    "dry_run",
+    "priority",
+    "slot",
+    "http",
+    "sync_interval",
+)
+
+
+def load(path, parser):
+    """parses a --script file into a list of (args, delay) steps
+
+    Every non-empty line which does not start with "#" is a json object with
+    the command line arguments of one step and an optional delay in seconds
+    which is waited after the step, e.g.:
+
+        {"args": ["--set-brightness", "50"]}
+        {"args": "--clock 0 --clock-24h", "delay": 5}
+        {"delay": 2}
+
+    Steps without "args" only wait. Exits on the first invalid line, so a
+    broken script fails before anything is sent to the device.
+    """
+    steps = []
+    with open(path, "r") as file:
+        for number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                step = json.loads(line)
+                argv = step.get("args")
+                delay = float(step.get("delay", 0))
+            except (ValueError, AttributeError, TypeError) as error:
+                log.error(f"invalid step in {path} line {number}: {error}")
+                quit()
+            args = None
+            if argv is not None:
+                if isinstance(argv, str):
+                    argv = shlex.split(argv)
+                usage = io.StringIO()
+                try:
+                    with contextlib.redirect_stderr(usage):
+                        args = parser.parse_args([str(arg) for arg in argv])
+                except SystemExit:
+                    error = usage.getvalue().strip().splitlines()[-1]
+                    log.error(f"invalid step in {path} line {number}: {error}")
+                    quit()
+                for name in UNSUPPORTED:
+                    if getattr(args, name, None):
+                        log.error(
+                            f"invalid step in {path} line {number}: --{name} is not supported in scripts"
+                        )
+                        quit()
+            steps.append((args, delay))
+    return steps
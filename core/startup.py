@@ -0,0 +1,33 @@
+# python imports
+import logging
+import sys
+import time
+
+
+class StartupProfile:
+    """Measures how long the phases of one command line call take (imports,
+    argument parsing, connecting, running the command) and how many modules
+    each phase imported, to make startup regressions visible.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, started: float) -> None:
+        self.started = started
+        self.last = started
+        self.modules = 0
+        self.phases = []
+
+    def mark(self, phase: str) -> None:
+        """ends the current phase, the next one starts now"""
+        now = time.perf_counter()
+        modules = len(sys.modules)
+        self.phases.append((phase, now - self.last, modules - self.modules))
+        self.last = now
+        self.modules = modules
+
+    def report(self) -> None:
+        """logs the duration of every phase"""
+        for phase, elapsed, modules in self.phases:
+            self.logging.info(f"{phase:<10} {elapsed:8.3f}s  {modules:4d} modules imported")
+        self.logging.info(f"{'total':<10} {self.last - self.started:8.3f}s")
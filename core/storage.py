@@ -0,0 +1,30 @@
+# python imports
+import os
+import re
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "idotmatrix")
+
+
+def path(*parts):
+    """returns a path inside the cache directory (IDOTMATRIX_CACHE or ~/.cache/idotmatrix) and creates its parent"""
+    full_path = os.path.join(os.environ.get("IDOTMATRIX_CACHE", DEFAULT_CACHE_DIR), *parts)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    return full_path
+
+
+def device_key(address):
+    """turns a device address into something usable as a file name"""
+    return re.sub(r"[^0-9A-Za-z]+", "-", str(address)).strip("-").lower()
+
+
+def device_file(kind, address, extension):
+    """returns the path of the file of one device in the cache directory, None for an unknown address"""
+    if not address:
+        return None
+    return path(kind, device_key(address) + extension)
+
+
+def remove(file_path):
+    """removes a file of the cache directory if it exists"""
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
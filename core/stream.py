@@ -0,0 +1,200 @@
+# python imports
+import logging
+import time
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Optional, Union
+
+import numpy
+from PIL import Image as PilImage
+
+# idotmatrix imports
+from core import jobs
+from core import timing
+from core import transport
+from core.estimate import transfer_cost
+from core.framebuffer import Framebuffer, encode_png
+from core.graffiti import pack_writes, pixel_packets
+from core.packets import Image, image_packets
+from core.transfer import Transfer
+
+DEFAULT_FPS = 10
+# how often the achieved rate is logged while streaming, in seconds
+REPORT_SECONDS = 10
+
+Frames = Union[Iterable, AsyncIterable]
+
+
+def to_pixels(frame, size: Optional[int] = None) -> numpy.ndarray:
+    """turns a frame into a (size, size, 3) uint8 canvas
+
+    Frames are PIL images or arrays of shape (height, width) or (height,
+    width, 3 or 4) with values in 0..255 (floats in 0..1). Without a size
+    the frame must be square already.
+    """
+    if not isinstance(frame, PilImage.Image):
+        array = numpy.asarray(frame)
+        if array.dtype.kind == "f":
+            array = array * 255
+        array = numpy.clip(array, 0, 255).astype(numpy.uint8)
+        if array.ndim == 2:
+            array = numpy.repeat(array[:, :, None], 3, axis=2)
+        elif array.ndim == 3 and array.shape[2] in (3, 4):
+            array = array[:, :, :3]
+        else:
+            raise ValueError(f"expected a (height, width[, channels]) frame, got the shape {array.shape}")
+        height, width = array.shape[:2]
+        if height == width and size in (None, width):
+            return numpy.ascontiguousarray(array)
+        frame = PilImage.fromarray(array, "RGB")
+    if size and frame.size != (size, size):
+        frame = frame.resize((size, size), PilImage.LANCZOS)
+    if frame.size[0] != frame.size[1]:
+        raise ValueError(f"frames must be square or resized to a pixel size, got {frame.size}")
+    return numpy.asarray(frame.convert("RGB"), dtype=numpy.uint8).copy()
+
+
+async def _frames(frames: Frames) -> AsyncIterator:
+    if hasattr(frames, "__aiter__"):
+        async for frame in frames:
+            yield frame
+    else:
+        for frame in frames:
+            yield frame
+
+
+class FrameStream:
+    """Pushes frames rendered on the host to the DIY canvas at a target rate.
+
+    Every frame is sent as the pixels which changed against the previous one
+    or as full png, whichever is cheaper, and unchanged frames are not sent
+    at all. The canvas is the framebuffer of the command, so one-shot image
+    and pixel commands continue from the last frame.
+
+    A frame which takes longer than its slot (1 / fps) leaves the stream
+    behind, and as many of the following frames are skipped as slots were
+    overrun, so the stream stays in time at the rate the link manages. A
+    source which yields slower than the target rate is simply followed. The
+    last frame of the source is always shown.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, cmd, fps: float = DEFAULT_FPS, size: Optional[int] = None) -> None:
+        if fps <= 0:
+            raise ValueError(f"the frame rate must be positive, got {fps}")
+        self.cmd = cmd
+        self.fps = fps
+        self.size = size
+        self.stats: Dict[str, int] = {
+            "frames": 0,
+            "skipped": 0,
+            "unchanged": 0,
+            "full": 0,
+            "pixels": 0,
+            "bytes": 0,
+        }
+        self.elapsed = 0.0
+
+    @property
+    def achieved_fps(self) -> float:
+        """frames shown (sent or unchanged) per second"""
+        shown = self.stats["frames"] - self.stats["skipped"]
+        return shown / self.elapsed if self.elapsed > 0 else 0.0
+
+    async def play(self, frames: Frames) -> Dict:
+        """streams all frames of an iterable or async iterable and returns the report"""
+        conn = self.cmd.conn
+        await conn.connect()
+        # the canvas does not show the last uploaded image anymore
+        self.cmd.uploads().forget()
+        framebuffer = self.cmd.framebuffer()
+        interval = 1 / self.fps
+        # seconds the stream is behind because frames took longer than their slot
+        debt = 0.0
+        due = None
+        last_skipped = None
+        started = reported = time.perf_counter()
+        try:
+            async for frame in _frames(frames):
+                self.stats["frames"] += 1
+                if due is not None:
+                    due += interval
+                if debt >= interval:
+                    debt -= interval
+                    self.stats["skipped"] += 1
+                    last_skipped = frame
+                    continue
+                last_skipped = None
+                now = time.perf_counter()
+                if due is None or now > due:
+                    # the first frame or a slow source, there is nothing to catch up
+                    due = now
+                else:
+                    await jobs.sleep(due - now)
+                sending = time.perf_counter()
+                await self.show(to_pixels(frame, self.size), framebuffer)
+                debt += max(0.0, time.perf_counter() - sending - interval)
+                if time.perf_counter() - reported >= REPORT_SECONDS:
+                    reported = time.perf_counter()
+                    self.elapsed = reported - started
+                    self.logging.info(
+                        f"streaming at {self.achieved_fps:.1f} fps (target {self.fps:g}), {self.stats['skipped']} of {self.stats['frames']} frames skipped"
+                    )
+            if last_skipped is not None:
+                self.stats["skipped"] -= 1
+                await self.show(to_pixels(last_skipped, self.size), framebuffer)
+        except BaseException:
+            # the device may show a partial frame
+            framebuffer.invalidate()
+            raise
+        finally:
+            self.elapsed = time.perf_counter() - started
+        if framebuffer.valid:
+            framebuffer.update(framebuffer.pixels)
+        report = self.report()
+        self.logging.info(
+            f"streamed {report['frames'] - report['skipped']} of {report['frames']} frames in {report['seconds']}s "
+            f"at {report['fps']} fps (target {self.fps:g}): {report['full']} full, {report['pixels']} as pixels, "
+            f"{report['unchanged']} unchanged, {report['skipped']} skipped, {report['bytes']} bytes"
+        )
+        return report
+
+    def report(self) -> Dict:
+        return {
+            **self.stats,
+            "seconds": round(self.elapsed, 3),
+            "fps": round(self.achieved_fps, 2),
+            "target_fps": self.fps,
+        }
+
+    async def show(self, target: numpy.ndarray, framebuffer: Framebuffer) -> None:
+        """sends one frame as changed pixels or as full image, whichever is cheaper"""
+        with timing.span("frame") as span:
+            changed = framebuffer.diff(target)
+            if changed == []:
+                self.stats["unchanged"] += 1
+                return
+            conn = self.cmd.conn
+            with timing.span("encode"):
+                png = encode_png(target)
+                writes = None
+                if changed is not None:
+                    size = transport.write_size(conn)
+                    writes = pack_writes(pixel_packets(changed, size), size)
+            pixel_bytes = sum(len(data) for data in writes) if writes is not None else 0
+            # a png upload is a single (unacknowledged) stream, plus the mode switch
+            if writes is not None and transfer_cost(pixel_bytes, len(writes)) < transfer_cost(len(png), 2):
+                await Transfer(conn, writes, response=True).run()
+                self.stats["pixels"] += 1
+                span.bytes = pixel_bytes
+            else:
+                chunks = [image_packets(png)]
+                if not framebuffer.valid:
+                    # switch to the DIY canvas first
+                    detached = Image()
+                    detached.conn = None
+                    chunks.insert(0, await detached.setMode(mode=1))
+                await Transfer(conn, chunks, response=False).run()
+                self.stats["full"] += 1
+                span.bytes = sum(len(chunk) for chunk in chunks)
+            self.stats["bytes"] += span.bytes
+            framebuffer.update(target, save=False)
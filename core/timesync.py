@@ -0,0 +1,106 @@
+# python imports
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+# idotmatrix imports
+from core import timing
+from idotmatrix import Common
+from idotmatrix.const import UUID_WRITE_DATA
+
+# acknowledged time writes used to measure the round trip, the last one is the real sync
+DEFAULT_SAMPLES = 3
+
+# wall clock and monotonic clock of the last sync per device address
+_last_sync: Dict[str, Tuple[float, float]] = {}
+
+
+async def time_packet(moment: datetime) -> bytes:
+    """returns the set time packet of the idotmatrix library for a moment"""
+    common = Common()
+    common.conn = None
+    return bytes(
+        await common.setTime(
+            moment.year, moment.month, moment.day, moment.hour, moment.minute, moment.second
+        )
+    )
+
+
+class TimeSync:
+    """Sets the clock of the device, compensated for the time the write takes.
+
+    The device only takes whole seconds and starts counting when the packet
+    arrives, which is about half a round trip after it was written. The
+    round trip is measured with acknowledged writes of the time packet itself
+    (every one of them is a valid, if less exact, sync), the shortest one is
+    used as the link delay. With align, the last packet is written half a
+    round trip before a second boundary and carries that second, so the
+    device clock starts in step with the host clock.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, conn, samples: int = DEFAULT_SAMPLES) -> None:
+        self.conn = conn
+        self.samples = max(1, samples)
+        self.rtts: List[float] = []
+
+    @property
+    def rtt(self) -> float:
+        return min(self.rtts) if self.rtts else 0.0
+
+    async def _write(self, packet: bytes) -> None:
+        client = getattr(self.conn, "client", None)
+        started = time.perf_counter()
+        if client is not None and client.is_connected:
+            await client.write_gatt_char(UUID_WRITE_DATA, packet, response=True)
+        elif not await self.conn.send(data=packet, response=True):
+            raise ConnectionError("the device is not connected")
+        self.rtts.append(time.perf_counter() - started)
+
+    def _arrival(self) -> datetime:
+        """returns the host time at which a packet written now reaches the device"""
+        return datetime.now() + timedelta(seconds=self.rtt / 2)
+
+    async def sync(self, align: bool = False) -> datetime:
+        """sets the device clock to the current time and returns the time sent"""
+        await self.conn.connect()
+        with timing.span("sync"):
+            for _ in range(self.samples - 1):
+                await self._write(await time_packet(self._arrival()))
+            arrival = self._arrival()
+            if align:
+                # send the next full second so that it arrives right on the boundary
+                moment = arrival.replace(microsecond=0) + timedelta(seconds=1)
+                await asyncio.sleep((moment - arrival).total_seconds())
+            else:
+                # the device truncates, rounding halves the error
+                moment = (arrival + timedelta(milliseconds=500)).replace(microsecond=0)
+            await self._write(await time_packet(moment))
+        self.logging.info(
+            f"set the device time to {moment:%H:%M:%S} (round trip {self.rtt * 1000:.1f}ms"
+            + (", aligned to the second)" if align else ")")
+        )
+        self._log_host_clock_step()
+        return moment
+
+    def _log_host_clock_step(self) -> None:
+        """logs how far the host clock moved against the monotonic clock since the last sync
+
+        The device clock can't be read back, so this shows the steps of the host
+        clock (e.g. by NTP) which the device only gets with the next sync.
+        """
+        address = getattr(self.conn, "address", None)
+        now = (time.time(), time.monotonic())
+        last = _last_sync.get(address)
+        _last_sync[address] = now
+        if last is None:
+            return
+        elapsed = now[1] - last[1]
+        host_clock_step = (now[0] - last[0]) - elapsed
+        self.logging.info(
+            f"{elapsed:.0f}s since the last sync of {address}, host_clock_step {host_clock_step * 1000:+.1f}ms "
+            "(not the drift of the device, which can't be read back)"
+        )
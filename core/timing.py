@@ -0,0 +1,152 @@
+# python imports
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+log = logging.getLogger("idotmatrix." + __name__)
+
+# the recorder of the running command, None if --timings is not used
+_recorder: contextvars.ContextVar = contextvars.ContextVar("idotmatrix_timing_recorder", default=None)
+# labels (e.g. the device) added to every span, copied into fan out tasks by asyncio
+_labels: contextvars.ContextVar = contextvars.ContextVar("idotmatrix_timing_labels", default=())
+
+
+class Span:
+    """one measured phase, bytes can be set while it runs"""
+
+    def __init__(self, name: str, bytes: int = 0) -> None:
+        self.name = name
+        self.bytes = bytes
+
+
+class Recorder:
+    """Sums up the spans of one command per phase and device and exports them
+    as json lines or as prometheus text file.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.phases: Dict[Tuple[Tuple[Tuple[str, str], ...], str], Dict[str, float]] = {}
+
+    def add(self, labels, name: str, elapsed: float, bytes: int) -> None:
+        phase = self.phases.setdefault(
+            (labels, name), {"count": 0, "elapsed": 0.0, "max": 0.0, "bytes": 0}
+        )
+        phase["count"] += 1
+        phase["elapsed"] += elapsed
+        phase["max"] = max(phase["max"], elapsed)
+        phase["bytes"] += bytes
+
+    def records(self):
+        """returns one dict per phase and device"""
+        records = []
+        for (labels, name), phase in self.phases.items():
+            record = {"time": round(self.started, 3), **dict(labels), "phase": name}
+            record.update(
+                count=phase["count"],
+                elapsed=round(phase["elapsed"], 6),
+                max=round(phase["max"], 6),
+            )
+            if phase["bytes"]:
+                record["bytes"] = phase["bytes"]
+                if phase["elapsed"] > 0:
+                    record["throughput"] = round(phase["bytes"] / phase["elapsed"], 1)
+            records.append(record)
+        return records
+
+    def export(self, path: str) -> None:
+        """appends json lines to path, or replaces path with prometheus metrics if it ends with .prom"""
+        if path.endswith(".prom"):
+            self.write_prometheus(path)
+        else:
+            with open(path, "a") as file:
+                for record in self.records():
+                    file.write(json.dumps(record) + "\n")
+        log.debug(f"wrote timings of {len(self.phases)} phases to {path}")
+
+    def write_prometheus(self, path: str) -> None:
+        """writes the metrics of the last command for the node exporter textfile collector"""
+        metrics = {
+            "idotmatrix_phase_seconds": ("elapsed", "time spent per phase of the last command"),
+            "idotmatrix_phase_max_seconds": ("max", "longest single span per phase of the last command"),
+            "idotmatrix_phase_count": ("count", "number of spans per phase of the last command"),
+            "idotmatrix_phase_bytes": ("bytes", "bytes sent per phase of the last command"),
+            "idotmatrix_phase_throughput_bytes_per_second": ("throughput", "effective throughput per phase of the last command"),
+        }
+        lines = []
+        records = self.records()
+        for metric, (key, help) in metrics.items():
+            lines.append(f"# HELP {metric} {help}")
+            lines.append(f"# TYPE {metric} gauge")
+            for record in records:
+                if key not in record:
+                    continue
+                labels = ",".join(
+                    f'{name}="{value}"'
+                    for name, value in record.items()
+                    if name not in ("time", "count", "elapsed", "max", "bytes", "throughput")
+                )
+                lines.append(f"{metric}{{{labels}}} {record[key]}")
+        # the collector must never see a half written file
+        with open(path + ".tmp", "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+
+@contextlib.contextmanager
+def recording(path: Optional[str], always: bool = False):
+    """records all spans inside the block and exports them to path
+
+    Does nothing without a path, unless always is set (the spans are then
+    only kept in the returned recorder).
+    """
+    if not path and not always:
+        yield None
+        return
+    recorder = Recorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+        if path:
+            try:
+                recorder.export(path)
+            except OSError as error:
+                log.error(f"could not write timings to {path}: {error}")
+
+
+@contextlib.contextmanager
+def labels(**values):
+    """adds labels to all spans inside the block"""
+    token = _labels.set(_labels.get() + tuple((name, str(value)) for name, value in values.items()))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str, bytes: int = 0):
+    """measures the block as one span of the given phase"""
+    current = Span(name, bytes)
+    recorder = _recorder.get()
+    if recorder is None:
+        yield current
+        return
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        recorder.add(_labels.get(), name, time.perf_counter() - started, current.bytes)
+
+
+def event(name: str, bytes: int = 0) -> None:
+    """counts an event (e.g. a retry) as span of the given phase without duration"""
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.add(_labels.get(), name, 0.0, bytes)
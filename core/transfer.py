@@ -0,0 +1,142 @@
+# python imports
+import logging
+import time
+from typing import List
+
+# idotmatrix imports
+from core import jobs
+from core import timing
+from core.estimate import Calibration, link
+from core.transport import Transport
+
+# how often an interrupted upload is retried before giving up
+DEFAULT_RETRIES = 5
+# first pause before reconnecting, doubled after every failed attempt
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 8.0
+
+
+class Transfer:
+    """Sends the chunks of one upload in order and survives dropped connections.
+
+    Every retry reconnects first and waits with exponential backoff. The
+    device starts parsing a new connection from scratch and drops an
+    unfinished upload, so the payload is always sent again from its first
+    chunk, even if earlier chunks were confirmed. The backoff and the retry
+    limit start over whenever an attempt got further than all before.
+
+    The writes are issued by a Transport (see --transport). If a write fails
+    while the connection stays up, the transport falls back to a safer mode
+    before the chunk is sent again. All spans are labelled with the mode.
+    With calibrate, a transfer which went through without retries calibrates
+    the transfer time estimate of the device (see --dry-run). Only gif and
+    image uploads do, the estimate is made for them.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(
+        self,
+        conn,
+        chunks: List[bytes],
+        response: bool,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = BACKOFF_SECONDS,
+        transport: Transport = None,
+        calibrate: bool = False,
+    ) -> None:
+        self.conn = conn
+        self.transport = transport or Transport(conn)
+        self.chunks = chunks
+        self.response = response
+        self.retries = retries
+        self.backoff = backoff
+        self.calibrate = calibrate
+        # chunks of the current attempt the device confirmed (or sent, without responses)
+        self.confirmed = 0
+        # all retries of the transfer and failures since the last progress
+        self.attempts = 0
+        self._failures = 0
+        self._progress = 0
+        self.restarted_bytes = 0
+
+    @property
+    def bytes(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def _sent_bytes(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks[: self.confirmed])
+
+    async def run(self) -> List[bytes]:
+        """sends all chunks, raises the last error if all retries failed"""
+        while True:
+            with timing.labels(transport=self.transport.mode):
+                with timing.span("upload") as upload:
+                    sent = self._sent_bytes()
+                    started = time.perf_counter()
+                    try:
+                        await self._send()
+                        if self.calibrate and not self.attempts:
+                            self._calibrate(time.perf_counter() - started)
+                        return self.chunks
+                    except Exception as error:
+                        failed = error
+                    finally:
+                        upload.bytes = self._sent_bytes() - sent
+            await self._retry(failed)
+
+    async def _send(self) -> None:
+        await self.conn.connect()
+        while self.confirmed < len(self.chunks):
+            # a more important daemon job may take over between two chunks
+            jobs.checkpoint()
+            chunk = self.chunks[self.confirmed]
+            # acknowledged writes return when the device confirmed them
+            confirms = self.transport.confirms(self.response)
+            with timing.span("ack" if confirms else "send", bytes=len(chunk)):
+                sent = await self.transport.send(chunk, self.response)
+            if not sent:
+                # ConnectionManager.send silently skips unconnected clients
+                raise ConnectionError("the device is not connected")
+            self.confirmed += 1
+
+    def _calibrate(self, seconds: float) -> None:
+        address = getattr(self.conn, "address", None)
+        if not address:
+            return
+        key = link(self.transport.mode, self.transport.confirms(self.response))
+        try:
+            Calibration(address).add(key, self.bytes, seconds)
+        except OSError as error:
+            self.logging.debug(f"could not save the calibration: {error}")
+
+    def _lost_connection(self) -> bool:
+        client = getattr(self.conn, "client", None)
+        return not (client and client.is_connected)
+
+    async def _retry(self, error: Exception) -> None:
+        if not self._lost_connection() and self.transport.fall_back(error):
+            timing.event("fallback")
+        if self.confirmed > self._progress:
+            self._failures = 0
+            self._progress = self.confirmed
+        self._failures += 1
+        if self._failures > self.retries:
+            self.logging.error(f"giving up upload after {self.retries} retries without progress")
+            raise error
+        self.attempts += 1
+        delay = min(MAX_BACKOFF_SECONDS, self.backoff * 2 ** (self._failures - 1))
+        self.logging.warning(
+            f"upload interrupted at chunk {self.confirmed + 1} of {len(self.chunks)} ({error}), "
+            f"retry {self._failures} of {self.retries} in {delay:.1f}s"
+        )
+        timing.event("retry")
+        try:
+            await self.conn.disconnect()
+        except Exception as disconnect_error:
+            self.logging.debug(f"could not disconnect: {disconnect_error}")
+        await jobs.sleep(delay)
+        restarted = self._sent_bytes()
+        self.restarted_bytes += restarted
+        timing.event("restart", bytes=restarted)
+        self.confirmed = 0
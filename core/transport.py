@@ -0,0 +1,246 @@
+# python imports
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import time
+import weakref
+from typing import Dict, Optional
+
+# idotmatrix imports
+from core import storage
+from idotmatrix.const import UUID_WRITE_DATA
+
+# how the writes of an upload are issued:
+#
+#   response     as the idotmatrix library does it (every write of an acknowledged
+#                chunk waits for the device, other chunks are not acknowledged)
+#   windowed     writes without response, but every window-th write and the last
+#                write of every chunk wait for the device, so at most window writes
+#                are in flight and every chunk is confirmed. The window is halved
+#                on errors before falling back to response writes
+#   no-response  no write waits for the device (only for devices which keep up)
+#   auto         the fastest mode which did not fail on the device recently,
+#                falling back to the next one on errors
+#
+# The modes besides response are opt-in until they are verified on more devices.
+RESPONSE = "response"
+WINDOWED = "windowed"
+NO_RESPONSE = "no-response"
+AUTO = "auto"
+MODES = (AUTO, WINDOWED, NO_RESPONSE, RESPONSE)
+# safer mode to continue with if a mode fails
+FALLBACK = {NO_RESPONSE: WINDOWED, WINDOWED: RESPONSE}
+# modes tried by auto, fastest first
+AUTO_MODES = (WINDOWED, RESPONSE)
+DEFAULT_MODE = RESPONSE
+DEFAULT_WINDOW = 8
+# a failed mode is not tried again by auto for this long
+FAILURE_SECONDS = 86400
+# how long to wait for the adapter to report the negotiated MTU
+MTU_SECONDS = 1.0
+# bytes of an ATT write request which are not payload
+ATT_HEADER_SIZE = 3
+# smallest ATT payload every BLE connection supports (MTU 23 - 3 bytes header)
+MIN_WRITE_SIZE = 20
+
+log = logging.getLogger("idotmatrix." + __name__)
+
+# the --transport of the running command
+_mode: contextvars.ContextVar = contextvars.ContextVar("idotmatrix_transport", default=None)
+# negotiated write size per client, forgotten with the client
+_write_sizes: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def default_mode() -> str:
+    """returns the mode used without --transport (IDOTMATRIX_TRANSPORT or response)"""
+    mode = os.environ.get("IDOTMATRIX_TRANSPORT", DEFAULT_MODE)
+    return mode if mode in MODES else DEFAULT_MODE
+
+
+@contextlib.contextmanager
+def using(mode: Optional[str]):
+    """uploads inside the block use the given mode (keeps the current one for None)"""
+    if not mode:
+        yield
+        return
+    token = _mode.set(mode)
+    try:
+        yield
+    finally:
+        _mode.reset(token)
+
+
+def selected() -> str:
+    return _mode.get() or default_mode()
+
+
+def confirms(mode: str, response: bool) -> bool:
+    """returns True if the chunks of an upload are known to have reached the device once sent"""
+    if mode == RESPONSE:
+        return response
+    return mode == WINDOWED
+
+
+def write_size(conn) -> int:
+    """returns the largest write the connection supports without splitting"""
+    try:
+        return _write_sizes[conn.client]
+    except (AttributeError, KeyError, TypeError):
+        pass
+    try:
+        return max(
+            MIN_WRITE_SIZE,
+            conn.client.services.get_characteristic(
+                UUID_WRITE_DATA
+            ).max_write_without_response_size,
+        )
+    except (AttributeError, TypeError):
+        return MIN_WRITE_SIZE
+
+
+async def _acquire_mtu(client) -> bool:
+    """acquires the MTU on BlueZ with a private method of the bleak backend,
+    returns False if this version of bleak does not have it (or it failed),
+    the MTU then comes from mtu_size alone
+    """
+    acquire = getattr(getattr(client, "_backend", None), "_acquire_mtu", None)
+    if not asyncio.iscoroutinefunction(acquire):
+        return False
+    try:
+        await acquire()
+    except Exception as error:
+        log.debug(f"could not acquire the MTU: {error}")
+        return False
+    return True
+
+
+async def negotiate_mtu(conn) -> int:
+    """asks the adapter for the MTU of the connection and returns the largest write size
+
+    BlueZ only reports the negotiated MTU after it was acquired, the other
+    platforms negotiate it on connect. The result is kept per connection.
+    """
+    client = conn.client
+    try:
+        return _write_sizes[client]
+    except (KeyError, TypeError):
+        pass
+    size = write_size(conn)
+    if await _acquire_mtu(client):
+        # the characteristic may take a moment to report more than the minimum
+        deadline = time.monotonic() + MTU_SECONDS
+        while write_size(conn) == MIN_WRITE_SIZE and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        size = write_size(conn)
+    try:
+        size = max(size, int(client.mtu_size) - ATT_HEADER_SIZE)
+    except (AttributeError, TypeError, ValueError):
+        pass
+    log.debug(f"using writes of {size} bytes")
+    try:
+        _write_sizes[client] = size
+    except TypeError:
+        pass
+    return size
+
+
+class TransportRecord:
+    """Remembers when a transport mode failed on one device and the window
+    which worked, so auto does not start with a mode the device cannot keep
+    up with every time.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, address: Optional[str]) -> None:
+        self.address = address
+        self.failures: Dict[str, float] = {}
+        self.window = DEFAULT_WINDOW
+        self.path = storage.device_file("transport", address, ".json")
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as file:
+                    record = json.load(file)
+                self.failures = dict(record.get("failures", {}))
+                self.window = int(record.get("window", DEFAULT_WINDOW))
+            except (OSError, ValueError, AttributeError, TypeError) as error:
+                self.logging.warning(f"ignoring broken transport record {self.path}: {error}")
+
+    def usable(self, mode: str) -> bool:
+        return time.time() - self.failures.get(mode, 0) > FAILURE_SECONDS
+
+    def failed(self, mode: str) -> None:
+        self.failures[mode] = time.time()
+        self.save()
+
+    def shrunk(self, window: int) -> None:
+        self.window = window
+        self.save()
+
+    def save(self) -> None:
+        if self.path:
+            with open(self.path + ".tmp", "w") as file:
+                json.dump({"failures": self.failures, "window": self.window}, file)
+            os.replace(self.path + ".tmp", self.path)
+
+
+class Transport:
+    """Issues the writes of one chunk in the selected mode."""
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, conn, mode: Optional[str] = None, window: Optional[int] = None) -> None:
+        self.conn = conn
+        self.auto = (mode or selected()) == AUTO
+        self.record = TransportRecord(getattr(conn, "address", None)) if self.auto else None
+        self.window = max(1, window or (self.record.window if self.record else DEFAULT_WINDOW))
+        if self.auto:
+            usable = [mode for mode in AUTO_MODES if self.record.usable(mode)]
+            self.mode = usable[0] if usable else RESPONSE
+        else:
+            self.mode = mode or selected()
+
+    def confirms(self, response: bool) -> bool:
+        """returns True if a sent chunk is known to have reached the device"""
+        return confirms(self.mode, response)
+
+    def fall_back(self, error: Exception) -> bool:
+        """halves the window or switches to the next safer mode after an error,
+        returns False if there is nothing left to fall back to
+        """
+        if self.mode == WINDOWED and self.window > 1:
+            self.window //= 2
+            self.logging.warning(f"windowed writes failed ({error}), continuing with a window of {self.window}")
+            if self.record is not None:
+                self.record.shrunk(self.window)
+            return True
+        fallback = FALLBACK.get(self.mode)
+        if fallback is None:
+            return False
+        self.logging.warning(f"{self.mode} writes failed ({error}), falling back to {fallback} writes")
+        if self.record is not None:
+            self.record.failed(self.mode)
+        self.mode = fallback
+        return True
+
+    async def send(self, chunk, response: bool) -> bool:
+        """writes one chunk, returns a falsy value if the device is not connected"""
+        if self.mode == RESPONSE:
+            return await self.conn.send(data=chunk, response=response)
+        client = self.conn.client
+        if not client or not client.is_connected:
+            return False
+        size = await negotiate_mtu(self.conn)
+        view = memoryview(chunk).cast("B")
+        in_flight = 0
+        for offset in range(0, len(view), size):
+            last = offset + size >= len(view)
+            acknowledged = self.mode == WINDOWED and (last or in_flight + 1 >= self.window)
+            await client.write_gatt_char(
+                UUID_WRITE_DATA, view[offset : offset + size], response=acknowledged
+            )
+            in_flight = 0 if acknowledged else in_flight + 1
+        return True
@@ -0,0 +1,54 @@
+# python imports
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional, Union
+
+# idotmatrix imports
+from core import storage
+
+
+def payload_hash(payload: Union[bytes, bytearray, List[bytearray]]) -> str:
+    """returns the sha256 of a payload, which is either one buffer or a list of chunks"""
+    digest = hashlib.sha256()
+    for chunk in payload if isinstance(payload, list) else [payload]:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadRecord:
+    """Remembers the hash of the last gif or image uploaded to one device, so
+    uploading the same content again can be skipped. The record is kept in the
+    cache directory and survives restarts of the client and the daemon.
+    """
+
+    logging = logging.getLogger("idotmatrix." + __name__)
+
+    def __init__(self, address: Optional[str]) -> None:
+        self.address = address
+        self.digest: Optional[str] = None
+        self.path = storage.device_file("uploads", address, ".json")
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as file:
+                    self.digest = json.load(file).get("hash")
+            except (OSError, ValueError, AttributeError) as error:
+                self.logging.warning(f"ignoring broken upload record {self.path}: {error}")
+
+    def shows(self, digest: str) -> bool:
+        """returns True if the last upload to the device had the given hash"""
+        return self.digest is not None and self.digest == digest
+
+    def remember(self, digest: str) -> None:
+        """records the hash of the content the device shows now"""
+        self.digest = digest
+        if self.path:
+            with open(self.path + ".tmp", "w") as file:
+                json.dump({"hash": digest}, file)
+            os.replace(self.path + ".tmp", self.path)
+
+    def forget(self) -> None:
+        """forgets the last upload, e.g. after a reset or when other content is shown"""
+        self.digest = None
+        storage.remove(self.path)
@@ -6,6 +6,7 @@ import numpy
 
 
 from utils.utils import digits, patterns, colors
+from core import client as daemon_client
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QPushButton, QLabel, QStackedWidget,
     QPlainTextEdit, QHBoxLayout, QMessageBox, QListWidgetItem, QGridLayout,
@@ -14,7 +15,8 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtGui import QFont, QIcon, QColor
 from PyQt5.QtCore import Qt, QProcess, QSettings, pyqtSignal
-import sys, os, re, copy
+from PyQt5.QtNetwork import QLocalSocket
+import sys, os, re, copy, json
 
 
 # --- Module-Scope Variables ---
@@ -500,9 +502,8 @@ class PixelPaintDialog(QDialog):
             QMessageBox.warning(self, 'Send Grid', 'No pixels to send.')
 
     def send_command_to_device(self, commands):
-        command_array = ["--address", self.mac_address]
-        for command in commands:
-            command_array.extend(["--pixel-color", command])
+        # all pixels in one --pixel-color, they get batched into as few writes as possible
+        command_array = ["--address", self.mac_address, "--pixel-color", *commands]
         self.run_command(command_array)
         
     def send_clear_command_to_device(self, commands):
@@ -510,10 +511,37 @@ class PixelPaintDialog(QDialog):
         self.run_command(command_array)
 
     def run_command(self, command_array:list):
+        if self.run_command_in_daemon(command_array):
+            return
         process = QProcess(self)
         process.start(shell_cmd, [*shell_init_args, *command_array])
         process.waitForFinished()
 
+    def run_command_in_daemon(self, args):
+        # the socket is read from the event loop, so a slow daemon does not block the dialog
+        if not daemon_client.available():
+            return False
+        socket = QLocalSocket(self)
+        socket.connectToServer(daemon_client.socket_path())
+        if not socket.waitForConnected(500):
+            socket.deleteLater()
+            return False
+        socket.readyRead.connect(lambda: self.handle_daemon_response(socket))
+        socket.write((json.dumps({"args": daemon_client.absolute_args(args)}) + "\n").encode("utf8"))
+        return True
+
+    def handle_daemon_response(self, socket):
+        if not socket.canReadLine():
+            return
+        try:
+            response = json.loads(bytes(socket.readLine()).decode("utf8"))
+        except ValueError as error:
+            response = {"ok": False, "error": f"invalid daemon response: {error}"}
+        socket.disconnectFromServer()
+        socket.deleteLater()
+        if not response.get("ok"):
+            QMessageBox.warning(self, 'Pixel Paint', f"Sending failed: {response.get('error', '')}")
+
     def clear_device(self):
         rgb_str = "0-0-0"
         self.send_clear_command_to_device(["--fullscreen-color", rgb_str.replace('#', '')])
@@ -705,6 +733,8 @@ class DevicePage(QWidget):
 
     def run_command(self, args):
         self.console_output.clear()
+        if self.run_command_in_daemon(args):
+            return
         self.process = QProcess(self)
         self.process.setProcessChannelMode(QProcess.MergedChannels)
         self.process.readyRead.connect(self.handle_ready_read)
@@ -740,6 +770,34 @@ class DevicePage(QWidget):
    
     def process_finished(self):
         pass
+
+    def run_command_in_daemon(self, args):
+        if not daemon_client.available():
+            return False
+        socket = QLocalSocket(self)
+        socket.connectToServer(daemon_client.socket_path())
+        if not socket.waitForConnected(500):
+            socket.deleteLater()
+            return False
+        # every command has its own socket, so overlapping commands get their own responses
+        socket.readyRead.connect(lambda: self.handle_daemon_response(socket, args))
+        socket.write((json.dumps({"args": daemon_client.absolute_args(args)}) + "\n").encode("utf8"))
+        return True
+
+    def handle_daemon_response(self, socket, args):
+        if not socket.canReadLine():
+            return
+        try:
+            response = json.loads(bytes(socket.readLine()).decode("utf8"))
+        except ValueError as error:
+            response = {"ok": False, "error": f"invalid daemon response: {error}"}
+        socket.disconnectFromServer()
+        socket.deleteLater()
+        self.console_output.appendPlainText(f"Command: {' '.join(args)}\n")
+        status = "done" if response.get("ok") else f"failed: {response.get('error', '')}"
+        self.console_output.appendPlainText(f"Output: {status} ({response.get('elapsed', 0)}s)\n")
+        if response.get("log"):
+            self.console_output.appendPlainText('\n'.join(response["log"]) + '\n')
    
     def hex_to_rgb(self, hex_color):
         hex_color = hex_color.lstrip('#')
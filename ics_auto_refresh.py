@@ -9,7 +9,7 @@ import sys
 import time
 import json
 import datetime
-import subprocess
+from core import client
 from ics_calendar_simple import get_ics_events_for_tomorrow_simple, get_ics_events_for_current_simple, get_ics_events_for_today_simple
 
 def get_ics_events_with_cache(meeting_type="tomorrow", cache_duration_minutes=30):
@@ -78,7 +78,7 @@ def display_events_on_device(device_address, events):
             "--set-text", events
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = client.run(cmd)
         
         if result.returncode == 0:
             print(f"✅ Events displayed on device: {events}")
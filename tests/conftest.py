@@ -0,0 +1,77 @@
+# python imports
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# idotmatrix imports
+from core import emulator
+from core.cmd import CMD
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    """every test gets an empty cache directory and fresh emulated devices"""
+    monkeypatch.setenv("IDOTMATRIX_CACHE", str(tmp_path / "cache"))
+    monkeypatch.delenv("IDOTMATRIX_ADDRESS", raising=False)
+    emulator._devices.clear()
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def parser():
+    """the app.py arguments the CMD and the daemon use"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address")
+    CMD().add_arguments(parser)
+    parser.add_argument("--priority", type=int, default=0)
+    parser.add_argument("--slot")
+    return parser
+
+
+@pytest.fixture
+def run(parser):
+    """runs app.py arguments with a new CMD and returns it"""
+
+    def run(*argv):
+        cmd = CMD()
+        cmd.parser = parser
+        asyncio.run(cmd.run(parser.parse_args([str(arg) for arg in argv])))
+        return cmd
+
+    return run
+
+
+def noise_frames(count, size=32, seed=3):
+    generator = random.Random(seed)
+    return [
+        Image.frombytes("RGB", (size, size), bytes(generator.randrange(256) for _ in range(size * size * 3)))
+        for _ in range(count)
+    ]
+
+
+@pytest.fixture
+def gif_file(tmp_path):
+    """an animated 32x32 gif of random pixels"""
+    path = tmp_path / "noise.gif"
+    frames = noise_frames(12)
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=100, loop=0)
+    return str(path)
+
+
+@pytest.fixture
+def png_files(tmp_path):
+    """two 32x32 pngs which differ in a single pixel"""
+    image = Image.new("RGB", (32, 32), (10, 20, 30))
+    first = tmp_path / "first.png"
+    image.save(first)
+    image.putpixel((3, 4), (255, 0, 0))
+    second = tmp_path / "second.png"
+    image.save(second)
+    return str(first), str(second)
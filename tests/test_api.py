@@ -0,0 +1,149 @@
+# python imports
+import asyncio
+import os
+
+import pytest
+
+# idotmatrix imports
+from core import api
+from core.api import FormParser, HttpError, Request
+
+BOUNDARY = b"----boundary1234"
+
+
+def multipart(fields, files):
+    body = bytearray()
+    for name, value in fields.items():
+        body += b"--" + BOUNDARY + b"\r\n"
+        body += f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode() + value + b"\r\n"
+    for name, (filename, data) in files.items():
+        body += b"--" + BOUNDARY + b"\r\n"
+        body += f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'.encode()
+        body += b"Content-Type: image/gif\r\n\r\n" + data + b"\r\n"
+    return bytes(body + b"--" + BOUNDARY + b"--\r\n")
+
+
+@pytest.fixture
+def files():
+    files = {}
+    yield files
+    for path in files.values():
+        os.remove(path)
+
+
+@pytest.mark.parametrize("feed_size", [1, 7, 64, 1 << 20])
+def test_form_parser_streams_files_and_keeps_fields(files, feed_size):
+    # the file contains something which looks like a delimiter, but is not one
+    data = os.urandom(5000) + b"\r\n--" + BOUNDARY[:-1] + os.urandom(100)
+    body = multipart({"process": b"32", "max_fps": b"10"}, {"file": ("upload.gif", data)})
+    parser = FormParser(BOUNDARY, files)
+    for start in range(0, len(body), feed_size):
+        parser.feed(body[start : start + feed_size])
+    assert parser.state == "done"
+    assert parser.fields == {"process": "32", "max_fps": "10"}
+    assert files["file"].endswith(".gif")
+    with open(files["file"], "rb") as file:
+        assert file.read() == data
+
+
+def test_form_parser_stops_before_the_end(files):
+    body = multipart({}, {"file": ("upload.gif", b"GIF89a")})
+    parser = FormParser(BOUNDARY, files)
+    parser.feed(body[:-10])
+    parser.close()
+    assert parser.state != "done"
+    # created files are known, so they can be removed
+    assert "file" in files
+
+
+def test_form_parser_limits_fields(files):
+    body = multipart({"text": b"x" * (65 * 1024)}, {})
+    with pytest.raises(HttpError) as error:
+        FormParser(BOUNDARY, files).feed(body)
+    assert error.value.status == 413
+
+
+def read_body(raw, headers):
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        request = Request(reader, None, "POST", "/gif", headers)
+        return b"".join([chunk async for chunk in request.body()]), request
+
+    return asyncio.run(main())
+
+
+def test_chunked_body():
+    data = os.urandom(3000)
+    raw = b"".join(
+        b"%x;name=value\r\n" % len(part) + part + b"\r\n" for part in (data[:1000], data[1000:2999], data[2999:])
+    )
+    body, request = read_body(raw + b"0\r\nX-Trailer: 1\r\n\r\n", {"transfer-encoding": "chunked"})
+    assert body == data
+    assert request.received == len(data)
+
+
+def test_chunked_multipart_body(files):
+    data = os.urandom(10000)
+    body = multipart({"force": b"1"}, {"file": ("upload.gif", data)})
+    raw = b"".join(b"%x\r\n" % len(body[i : i + 999]) + body[i : i + 999] + b"\r\n" for i in range(0, len(body), 999))
+    received, _ = read_body(raw + b"0\r\n\r\n", {"transfer-encoding": "chunked"})
+    parser = FormParser(BOUNDARY, files)
+    parser.feed(received)
+    assert parser.state == "done"
+    assert parser.fields == {"force": "1"}
+    with open(files["file"], "rb") as file:
+        assert file.read() == data
+
+
+def test_invalid_chunk_size():
+    with pytest.raises(HttpError) as error:
+        read_body(b"zz\r\n", {"transfer-encoding": "chunked"})
+    assert error.value.status == 400
+
+
+def test_body_ending_early():
+    with pytest.raises(HttpError) as error:
+        read_body(b"short", {"content-length": "100"})
+    assert error.value.status == 400
+
+
+def test_stalled_body(monkeypatch):
+    monkeypatch.setattr(api, "BODY_TIMEOUT", 0.05)
+
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"part of the body")
+        request = Request(reader, None, "POST", "/gif", {"content-length": "100"})
+        return [chunk async for chunk in request.body()]
+
+    with pytest.raises(HttpError) as error:
+        asyncio.run(main())
+    assert error.value.status == 408
+
+
+def test_unexpected_errors_are_answered_with_500():
+    class Daemon:
+        addresses = []
+        queues = {}
+
+        def parse(self, argv):
+            raise RuntimeError("broken")
+
+    async def main():
+        server = api.HttpApi(Daemon())
+        await server.start("127.0.0.1:0")
+        port = server.server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = b'{"brightness": 50}'
+        writer.write(b"POST /brightness HTTP/1.1\r\nContent-Type: application/json\r\n")
+        writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+        response = await reader.read()
+        writer.close()
+        server.server.close()
+        return response
+
+    response = asyncio.run(main())
+    assert response.startswith(b"HTTP/1.1 500 Internal Server Error")
+    assert b"internal error: broken" in response
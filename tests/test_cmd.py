@@ -0,0 +1,116 @@
+# python imports
+import asyncio
+
+import numpy
+from PIL import Image
+
+# idotmatrix imports
+from core import emulator
+from core.cmd import CMD
+
+
+def test_gif_upload(run, gif_file):
+    run("--address", "emulator-gif", "--set-gif", gif_file)
+    device = emulator.device("emulator-gif")
+    with open(gif_file, "rb") as file:
+        assert device.gif == file.read()
+    assert device.mode == "gif"
+    assert device.gif_frames == 12
+
+
+def test_image_upload(run, png_files):
+    run("--address", "emulator-image", "--image", "true", "--set-image", png_files[1], "--process-image", "32")
+    device = emulator.device("emulator-image")
+    with Image.open(png_files[1]) as image:
+        assert numpy.array_equal(device.pixels, numpy.asarray(image.convert("RGB")))
+
+
+def test_repeated_upload_is_skipped(run, gif_file):
+    run("--address", "emulator-skip", "--set-gif", gif_file)
+    device = emulator.device("emulator-skip")
+    writes = device.writes
+    run("--address", "emulator-skip", "--set-gif", gif_file)
+    assert device.writes == writes
+    run("--address", "emulator-skip", "--set-gif", gif_file, "--force")
+    assert device.writes > writes
+
+
+def test_upload_after_other_content_is_sent(run, gif_file):
+    run("--address", "emulator-other", "--set-gif", gif_file)
+    run("--address", "emulator-other", "--clock", "1")
+    device = emulator.device("emulator-other")
+    assert device.mode == "clock"
+    run("--address", "emulator-other", "--set-gif", gif_file)
+    assert device.mode == "gif"
+
+
+def test_canvas_update_sends_changed_pixels(run, png_files):
+    first, second = png_files
+    run("--address", "emulator-diff", "--image", "true", "--set-image", first, "--process-image", "32")
+    device = emulator.device("emulator-diff")
+    packets = len(device.packets)
+    run("--address", "emulator-diff", "--image", "true", "--set-image", second, "--process-image", "32")
+    sent = device.packets[packets:]
+    # a single graffiti packet instead of a png
+    assert [packet[2:4] for packet in sent] == [b"\x05\x01"]
+    assert tuple(device.pixels[4, 3]) == (255, 0, 0)
+    with Image.open(second) as image:
+        assert numpy.array_equal(device.pixels, numpy.asarray(image.convert("RGB")))
+
+
+def test_pixel_color_paints_the_canvas(run, png_files):
+    run("--address", "emulator-pixels", "--image", "true", "--set-image", png_files[0], "--process-image", "32")
+    run("--address", "emulator-pixels", "--pixel-color", "1-2-200-100-50", "31-31-1-2-3")
+    device = emulator.device("emulator-pixels")
+    assert tuple(device.pixels[2, 1]) == (200, 100, 50)
+    assert tuple(device.pixels[31, 31]) == (1, 2, 3)
+
+
+def test_pixel_color_outside_of_the_canvas_is_rejected(run, png_files):
+    run("--address", "emulator-bounds", "--image", "true", "--set-image", png_files[0], "--process-image", "32")
+    device = emulator.device("emulator-bounds")
+    packets = len(device.packets)
+    run("--address", "emulator-bounds", "--pixel-color", "32-0-255-0-0")
+    run("--address", "emulator-bounds", "--pixel-color", "0-0-256-0-0")
+    assert len(device.packets) == packets
+
+
+def test_fan_out_keeps_the_canvas_of_the_main_command(run, parser, png_files):
+    first = png_files[0]
+    image = ["--image", "true", "--process-image", "32", "--set-image", first, "--force"]
+    cmd = run("--address", "emulator-shared", *image)
+    # the commands of the fan out paint the canvas the main command shows
+    fan_out = ["--address", "emulator-shared,emulator-other", "--pixel-color", "1-2-200-100-50"]
+    asyncio.run(cmd.run(parser.parse_args(fan_out)))
+    asyncio.run(cmd.run(parser.parse_args(["--address", "emulator-shared", *image])))
+    device = emulator.device("emulator-shared")
+    with Image.open(first) as source:
+        assert numpy.array_equal(device.pixels, numpy.asarray(source.convert("RGB")))
+
+
+def test_fan_out_keeps_the_uploads_of_the_main_command(run, parser, gif_file):
+    cmd = run("--address", "emulator-shared", "--set-gif", gif_file)
+    asyncio.run(cmd.run(parser.parse_args(["--address", "emulator-shared,emulator-other", "--clock", "1"])))
+    asyncio.run(cmd.run(parser.parse_args(["--address", "emulator-shared", "--set-gif", gif_file])))
+    assert emulator.device("emulator-shared").mode == "gif"
+
+
+def test_budget_fit_leaves_the_event_loop_running(parser, gif_file):
+    args = parser.parse_args(["--address", "emulator-budget", "--set-gif", gif_file, "--max-upload-bytes", "20000"])
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        ticker = asyncio.ensure_future(tick())
+        await CMD().run(args)
+        ticker.cancel()
+
+    asyncio.run(main())
+    device = emulator.device("emulator-budget")
+    assert len(device.gif) <= 20000
+    # the ticker kept running while the candidates were tried
+    assert len(ticks) > 2
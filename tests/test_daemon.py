@@ -0,0 +1,37 @@
+# python imports
+import asyncio
+import json
+
+# idotmatrix imports
+from core.cmd import CMD
+from core.daemon import Daemon
+
+
+def process(parser, address, *argv):
+    async def main():
+        cmd = CMD()
+        daemon = Daemon(cmd, parser)
+        daemon.addresses = [address]
+        await cmd.connect(address)
+        return await daemon.process(json.dumps({"args": list(argv)}))
+
+    return asyncio.run(main())
+
+
+def test_failed_command_is_not_ok(parser, tmp_path):
+    response = process(parser, "emulator-fail", "--set-gif", str(tmp_path / "missing.gif"), "--process-gif", "32")
+    assert response["ok"] is False
+    response = process(parser, "emulator-fail", "--set-brightness", "500")
+    assert response["ok"] is False
+
+
+def test_successful_command_is_ok(parser):
+    assert process(parser, "emulator-ok", "--set-brightness", "50")["ok"] is True
+
+
+def test_precompile_dir_reports_its_result(parser, tmp_path, gif_file, png_files):
+    response = process(parser, "emulator-precompile", "--precompile-dir", str(tmp_path), "--sizes", "32")
+    assert response["ok"] is True
+    assert (response["report"]["compiled"], response["report"]["failed"]) == (3, 0)
+    response = process(parser, "emulator-precompile", "--precompile-dir", str(tmp_path / "missing"))
+    assert response["ok"] is False
@@ -0,0 +1,108 @@
+# python imports
+import io
+import random
+import struct
+
+import numpy
+import pytest
+from PIL import Image
+
+# idotmatrix imports
+from core.gifstream import GifWriter, lzw_encode, process_gif
+
+
+def decode(indices, width, height, colors):
+    """wraps indices encoded by lzw_encode into a gif and decodes it with PIL"""
+    entries = 1 << max(1, (colors - 1).bit_length())
+    table = bytes(range(entries)) * 3
+    bits = max(0, entries.bit_length() - 2)
+    descriptor = b"\x2c" + struct.pack("<HHHHB", 0, 0, width, height, 0)
+    output = io.BytesIO()
+    writer = GifWriter(output, (width, height))
+    writer.append(table, None, descriptor, lzw_encode(bytes(indices), max(2, bits + 1)), 100)
+    writer.close()
+    with Image.open(io.BytesIO(output.getvalue())) as image:
+        return numpy.asarray(image).ravel().tolist()
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_lzw_round_trip(seed):
+    generator = random.Random(seed)
+    width, height = generator.randint(1, 64), generator.randint(1, 64)
+    colors = generator.choice([2, 3, 4, 16, 100, 256])
+    # runs compress well, noise fills the code table until it is cleared
+    if seed % 2:
+        indices = [generator.randrange(colors) for _ in range(width * height)]
+    else:
+        indices = []
+        while len(indices) < width * height:
+            indices += [generator.randrange(colors)] * generator.randint(1, 40)
+        indices = indices[: width * height]
+    assert decode(indices, width, height, colors) == indices
+
+
+def test_lzw_round_trip_of_a_large_noisy_frame():
+    generator = random.Random(7)
+    indices = [generator.randrange(256) for _ in range(256 * 256)]
+    assert decode(indices, 256, 256, 256) == indices
+
+
+def animation(tmp_path, count=10, size=64):
+    path = tmp_path / "animation.gif"
+    frames = []
+    for index in range(count):
+        frame = Image.new("RGB", (size, size), (0, 0, 80))
+        frame.paste((255, 200, 0), (index * 4, 8, index * 4 + 16, 24))
+        frames.append(frame)
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=50, loop=0)
+    return str(path), frames
+
+
+def shown(data):
+    with Image.open(io.BytesIO(data)) as image:
+        result = []
+        for index in range(image.n_frames):
+            image.seek(index)
+            result.append((numpy.asarray(image.convert("RGB")).copy(), image.info.get("duration")))
+        return result
+
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_process_gif_resizes_every_frame(tmp_path, optimize):
+    path, frames = animation(tmp_path)
+    report = {}
+    data = process_gif(path, 32, optimize=optimize, report=report)
+    decoded = shown(data)
+    assert len(decoded) == len(frames)
+    for (pixels, duration), frame in zip(decoded, frames):
+        expected = numpy.asarray(frame.resize((32, 32), Image.Resampling.LANCZOS))
+        assert pixels.shape == (32, 32, 3)
+        assert numpy.abs(pixels.astype(int) - expected).max() < 64
+        assert duration == 50
+    assert report["bytes"] == len(data)
+
+
+def test_process_gif_limits_frames_and_rate(tmp_path):
+    path, _ = animation(tmp_path)
+    assert len(shown(process_gif(path, 32, max_frames=4))) == 4
+    decimated = shown(process_gif(path, 32, max_fps=10))
+    # 20 fps halved, every frame shown twice as long
+    assert [duration for _, duration in decimated] == [100] * 5
+
+
+def test_frames_are_only_cropped_with_crop(tmp_path):
+    path, frames = animation(tmp_path)
+    report = {}
+    whole = process_gif(path, 32, report=report)
+    assert report["cropped"] == 0
+    with Image.open(io.BytesIO(whole)) as image:
+        for index in range(image.n_frames):
+            image.seek(index)
+            assert image.tile[0][1] == (0, 0, 32, 32)
+            assert image.disposal_method == 2
+    cropped = process_gif(path, 32, report=report, crop=True)
+    assert report["cropped"] == len(frames) - 1
+    assert len(cropped) < len(whole)
+    for (expected, duration), (pixels, cropped_duration) in zip(shown(whole), shown(cropped)):
+        assert numpy.array_equal(pixels, expected)
+        assert duration == cropped_duration
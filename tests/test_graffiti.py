@@ -0,0 +1,43 @@
+# python imports
+import random
+
+# idotmatrix imports
+from core.graffiti import HEADER_SIZE, pack_writes, pixel_packets
+
+
+def test_pixel_packets_group_pixels_by_color():
+    pixels = [(0, 0, 255, 0, 0), (1, 0, 0, 255, 0), (2, 0, 255, 0, 0), (1, 0, 255, 0, 0)]
+    packets = pixel_packets(pixels, 182)
+    # the later pixel at 1-0 wins
+    assert [bytes(packet) for packet in packets] == [bytes([14, 0, 5, 1, 0, 255, 0, 0, 0, 0, 1, 0, 2, 0])]
+
+
+def test_pixel_packets_fit_the_write_size():
+    pixels = [(x, y, 1, 2, 3) for x in range(32) for y in range(32)]
+    packets = pixel_packets(pixels, 23)
+    assert all(len(packet) <= 23 for packet in packets)
+    assert sum((len(packet) - HEADER_SIZE) // 2 for packet in packets) == len(pixels)
+
+
+def test_pack_writes_keeps_packets_whole():
+    generator = random.Random(1)
+    colors = [(generator.randrange(256), 0, 0) for _ in range(12)]
+    pixels = [(x, y, *generator.choice(colors)) for x in range(12) for y in range(12)]
+    packets = pixel_packets(pixels, 100)
+    writes = pack_writes(packets, 100)
+    assert all(len(write) <= 100 for write in writes)
+    assert b"".join(writes) == b"".join(packets)
+    # every write starts with a packet and ends with one
+    offsets = {0}
+    for packet in packets:
+        offsets.add(max(offsets) + len(packet))
+    position = 0
+    for write in writes:
+        assert position in offsets
+        position += len(write)
+    assert len(writes) < len(packets)
+
+
+def test_pack_writes_sends_oversized_packets_alone():
+    packets = [bytearray(10), bytearray(30), bytearray(5)]
+    assert [len(write) for write in pack_writes(packets, 20)] == [10, 30, 5]
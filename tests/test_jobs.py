@@ -0,0 +1,89 @@
+# python imports
+import asyncio
+
+# idotmatrix imports
+from core import jobs
+
+
+def chunked(name, order, chunks=5):
+    """a job which sends chunks and stops at every chunk boundary when preempted"""
+
+    async def run():
+        for chunk in range(chunks):
+            jobs.checkpoint()
+            order.append(f"{name}{chunk}")
+            await asyncio.sleep(0.001)
+        return name
+
+    return run
+
+
+def test_newer_job_of_the_same_slot_supersedes_queued_and_running_jobs():
+    async def main():
+        order = []
+        queue = jobs.JobQueue("device")
+        first = queue.submit(jobs.Job(chunked("a", order), slot="display"))
+        await asyncio.sleep(0.002)
+        second = queue.submit(jobs.Job(chunked("b", order), slot="display"))
+        third = queue.submit(jobs.Job(chunked("c", order), slot="display"))
+        assert await first.future is None
+        assert await second.future is None
+        assert await third.future == "c"
+        assert first.superseded_by is third
+        assert second.superseded_by is third
+        assert not any(step.startswith("b") for step in order)
+        assert order[-5:] == ["c0", "c1", "c2", "c3", "c4"]
+        assert queue.stats == {"done": 1, "superseded": 2, "preempted": 0}
+
+    asyncio.run(main())
+
+
+def test_more_important_job_preempts_and_the_preempted_job_starts_over():
+    async def main():
+        order = []
+        queue = jobs.JobQueue("device")
+        upload = queue.submit(jobs.Job(chunked("a", order), slot="display"))
+        await asyncio.sleep(0.002)
+        urgent = queue.submit(jobs.Job(chunked("b", order, chunks=2), priority=5, slot="brightness"))
+        assert await urgent.future == "b"
+        assert await upload.future == "a"
+        assert upload.preemptions == 1
+        interrupted = order.index("b0")
+        assert 0 < interrupted < 5
+        assert order[interrupted:] == ["b0", "b1", "a0", "a1", "a2", "a3", "a4"]
+        assert queue.stats == {"done": 2, "superseded": 0, "preempted": 1}
+
+    asyncio.run(main())
+
+
+def test_less_important_job_waits():
+    async def main():
+        order = []
+        queue = jobs.JobQueue("device")
+        upload = queue.submit(jobs.Job(chunked("a", order, chunks=3), priority=5, slot="display"))
+        await asyncio.sleep(0.001)
+        later = queue.submit(jobs.Job(chunked("b", order, chunks=1), slot="display"))
+        assert await upload.future == "a"
+        assert await later.future == "b"
+        assert order == ["a0", "a1", "a2", "b0"]
+
+    asyncio.run(main())
+
+
+def test_sleep_is_interrupted_by_a_preemption():
+    async def main():
+        queue = jobs.JobQueue("device")
+
+        async def waiting():
+            # like the backoff of a transfer, only the first run waits
+            await jobs.sleep(10 if not job.preemptions else 0)
+            return "slept"
+
+        job = queue.submit(jobs.Job(waiting))
+        await asyncio.sleep(0.01)
+        urgent = queue.submit(jobs.Job(chunked("b", [], chunks=1), priority=1))
+        assert await asyncio.wait_for(urgent.future, 1) == "b"
+        assert await asyncio.wait_for(job.future, 1) == "slept"
+        assert job.preemptions == 1
+
+    asyncio.run(main())
@@ -0,0 +1,26 @@
+# python imports
+import os
+
+import pytest
+
+# idotmatrix imports
+from core.packets import gif_data, gif_packets, image_data, image_packets
+from idotmatrix import Gif, Image
+
+
+@pytest.mark.parametrize("size", [1, 4095, 4096, 4097, 3 * 4096 + 17])
+def test_gif_packets_match_the_library(size):
+    data = os.urandom(size)
+    expected = Gif()._createPayloads(bytearray(data))
+    packets = gif_packets(data)
+    assert [bytes(packet) for packet in packets] == [bytes(payload) for payload in expected]
+    assert gif_data(packets) == data
+
+
+@pytest.mark.parametrize("size", [1, 4095, 4096, 4097, 2 * 4096 + 100])
+def test_image_packets_match_the_library(size):
+    data = os.urandom(size)
+    expected = Image()._createPayloads(bytearray(data))
+    packets = image_packets(data)
+    assert bytes(packets) == bytes(expected)
+    assert bytes(image_data(packets)) == data
@@ -0,0 +1,35 @@
+# python imports
+import pytest
+
+# idotmatrix imports
+from core import idm
+from core.precompile import compile_asset, precompile
+
+
+def test_compile_asset_counts_the_frames_written(tmp_path, gif_file):
+    target = str(tmp_path / "noise.idm")
+    frames, size = compile_asset(gif_file, idm.GIF, 32, target, {"max_fps": 5})
+    # 10 fps halved
+    assert frames == 6
+    assert size == idm.IdmFile(target).bytes
+
+
+def test_compile_asset_counts_an_image_as_one_frame(tmp_path, png_files):
+    assert compile_asset(png_files[0], idm.IMAGE, 32, str(tmp_path / "first.idm"))[0] == 1
+
+
+def test_precompile_skips_unchanged_sources(tmp_path, gif_file, png_files):
+    report = precompile(str(tmp_path), [16, 32], workers=1)
+    assert (report["sources"], report["compiled"], report["failed"]) == (3, 6, 0)
+    assert report["frames"] == 2 * (12 + 1 + 1)
+    report = precompile(str(tmp_path), [16, 32], workers=1)
+    assert (report["compiled"], report["skipped"]) == (0, 6)
+
+
+def test_truncated_chunk_table_is_rejected(tmp_path, gif_file):
+    target = str(tmp_path / "noise.idm")
+    compile_asset(gif_file, idm.GIF, 32, target)
+    with open(target, "r+b") as file:
+        file.truncate(idm.HEADER.size + idm.TABLE_ENTRY.size // 2)
+    with pytest.raises(ValueError):
+        idm.IdmFile(target)
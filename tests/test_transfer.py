@@ -0,0 +1,140 @@
+# python imports
+import asyncio
+import json
+import os
+
+# idotmatrix imports
+from core import emulator
+from core import storage
+from core.cmd import CMD
+from core.daemon import Daemon
+from core.packets import gif_packets
+from core.transfer import Transfer
+
+
+def upload(address, data, response=True):
+    async def main():
+        cmd = CMD()
+        await cmd.connect(address)
+        transfer = Transfer(cmd.conn, gif_packets(data), response, retries=20, backoff=0)
+        await transfer.run()
+        await cmd.conn.disconnect()
+        return transfer
+
+    return asyncio.run(main())
+
+
+def test_upload_survives_dropped_connections(gif_file):
+    with open(gif_file, "rb") as file:
+        data = file.read()
+    address = "emulator-drops:drop=0.01:seed=4"
+    transfer = upload(address, data)
+    device = emulator.device(address)
+    assert device.drops > 0
+    assert transfer.attempts == device.drops
+    # every attempt started over with the first chunk
+    assert transfer.restarted_bytes > 0
+    assert device.connections == device.drops + 1
+    assert device.gif == data
+
+
+def test_upload_without_responses_survives_dropped_connections(gif_file):
+    with open(gif_file, "rb") as file:
+        data = file.read()
+    address = "emulator-restarts:drop=0.01:seed=1"
+    transfer = upload(address, data, response=False)
+    device = emulator.device(address)
+    assert device.drops > 0
+    assert transfer.attempts == device.drops
+    assert transfer.restarted_bytes > 0
+    assert device.gif == data
+
+
+def test_priority_preempts_a_running_upload(parser, gif_file):
+    address = "emulator-preempt:latency=0.01"
+    device = emulator.device(address)
+
+    async def main():
+        cmd = CMD()
+        daemon = Daemon(cmd, parser)
+        daemon.addresses = [address]
+        await cmd.connect(address)
+
+        def request(*argv):
+            return asyncio.ensure_future(daemon.process(json.dumps({"args": list(argv)})))
+
+        gif = request("--set-gif", gif_file)
+        while not device.writes:
+            await asyncio.sleep(0.01)
+        brightness = await request("--set-brightness", "40", "--priority", "5")
+        # the gif was interrupted for the brightness and started over
+        assert brightness["ok"]
+        assert device.mode != "gif"
+        assert device.brightness == 40
+        response = await gif
+        assert response["ok"]
+        assert response["preempted"] == 1
+        assert daemon.queues[address].stats == {"done": 2, "superseded": 0, "preempted": 1}
+
+    asyncio.run(main())
+    with open(gif_file, "rb") as file:
+        assert device.gif == file.read()
+    assert device.mode == "gif"
+
+
+def test_newer_request_for_the_same_slot_replaces_the_upload(parser, gif_file):
+    address = "emulator-supersede:latency=0.01"
+    device = emulator.device(address)
+
+    async def main():
+        cmd = CMD()
+        daemon = Daemon(cmd, parser)
+        daemon.addresses = [address]
+        await cmd.connect(address)
+
+        def request(*argv):
+            return asyncio.ensure_future(daemon.process(json.dumps({"args": list(argv)})))
+
+        gif = request("--set-gif", gif_file)
+        while not device.writes:
+            await asyncio.sleep(0.01)
+        text = await request("--set-text", "FREE")
+        assert text["ok"]
+        response = await gif
+        assert response["superseded"]
+
+    asyncio.run(main())
+    assert device.mode == "text"
+    assert device.gif is None
+
+
+def test_unfinished_upload_is_dropped_with_the_connection(gif_file):
+    with open(gif_file, "rb") as file:
+        data = file.read()
+    packets = gif_packets(data, 1024)
+    device = emulator.device("emulator-fresh")
+    client = emulator.client("emulator-fresh")
+
+    async def send(packet):
+        for start in range(0, len(packet), device.write_size):
+            await client.write_gatt_char(None, packet[start : start + device.write_size], response=True)
+
+    async def main():
+        await client.connect()
+        await send(packets[0])
+        await client.connect()
+        for packet in packets[1:]:
+            await send(packet)
+
+    asyncio.run(main())
+    # the rest alone is not the gif
+    assert device.gif is None
+
+
+def test_only_gif_and_image_uploads_calibrate(run, gif_file):
+    with open(gif_file, "rb") as file:
+        upload("emulator-calibration", file.read())
+    path = storage.device_file("calibration", "emulator-calibration", ".json")
+    assert not os.path.exists(path)
+    run("--address", "emulator-calibration", "--set-gif", gif_file, "--force")
+    assert os.path.exists(path)
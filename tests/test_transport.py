@@ -0,0 +1,36 @@
+# python imports
+import asyncio
+import types
+
+# idotmatrix imports
+from core import emulator, transport
+
+
+def connection(backend=None, mtu=100):
+    client = emulator.client(f"emulator-mtu:mtu={mtu}")
+    if backend is not None:
+        client._backend = backend
+    return types.SimpleNamespace(client=client)
+
+
+def test_mtu_without_the_bluez_backend_comes_from_mtu_size():
+    assert asyncio.run(transport.negotiate_mtu(connection())) == 97
+
+
+def test_mtu_falls_back_to_mtu_size_if_acquiring_fails():
+    class Backend:
+        calls = 0
+
+        async def _acquire_mtu(self):
+            Backend.calls += 1
+            raise RuntimeError("not supported")
+
+    assert asyncio.run(transport.negotiate_mtu(connection(Backend()))) == 97
+    assert Backend.calls == 1
+
+
+def test_response_writes_are_the_default(monkeypatch):
+    monkeypatch.delenv("IDOTMATRIX_TRANSPORT", raising=False)
+    assert transport.selected() == transport.RESPONSE
+    monkeypatch.setenv("IDOTMATRIX_TRANSPORT", "auto")
+    assert transport.selected() == transport.AUTO